@@ -0,0 +1,114 @@
+"""Measure import-to-first-call time for each Lambda module, as a cold start would see it.
+
+Each measurement runs in a fresh Python process: it times importing the handler module, then the module's first AWS
+call, which is where its client is now created. AWS is stubbed out with a botocore `before-call` hook, so no
+credentials or network access are needed. Eagerly creating an S3 resource and an S3 client are timed for reference.
+
+    python benchmarks/cold_start.py --runs 5
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+
+CHILD = """
+import time
+
+start = time.perf_counter()
+{setup}
+imported = time.perf_counter()
+
+
+class StubbedHttpResponse:
+    status_code = 200
+
+
+def stub(model, params, **kwargs):
+    return StubbedHttpResponse(), {response}
+
+
+{call}
+called = time.perf_counter()
+print(imported - start, called - imported)
+"""
+
+LAMBDAS = {
+    'verify': (
+        'verify/src',
+        'import verify',
+        "verify.s3.meta.events.register('before-call', stub)\nverify.s3.head_object(Bucket='b', Key='k')",
+        "{'ContentLength': 1, 'ETag': '\"etag\"'}",
+    ),
+    'ingest': (
+        'ingest/src',
+        'import ingest',
+        "ingest.s3.meta.events.register('before-call', stub)\ningest.s3.head_object(Bucket='b', Key='k')",
+        "{'ContentLength': 1, 'ETag': '\"etag\"'}",
+    ),
+    'metadata_construction': (
+        'metadata-construction/src',
+        'import metadata_construction',
+        "metadata_construction.s3.meta.events.register('before-call', stub)\n"
+        "metadata_construction.get_s3_file_size({'Bucket': 'b', 'Key': 'k'})",
+        "{'ContentLength': 1}",
+    ),
+    'invoke': (
+        'invoke/src',
+        'import invoke',
+        "invoke.sfn.meta.events.register('before-call', stub)\n"
+        "invoke.sfn.start_execution(stateMachineArn='arn:aws:states:us-east-1:123456789012:stateMachine:s', "
+        "input='{}')",
+        "{'executionArn': 'arn'}",
+    ),
+    'notify': (
+        'notify/src',
+        'import notify',
+        "client = notify.get_sns_client('us-east-1')\nclient.meta.events.register('before-call', stub)\n"
+        "client.publish(TopicArn='arn:aws:sns:us-east-1:123456789012:t', Message='m')",
+        "{'MessageId': '1'}",
+    ),
+}
+
+REFERENCES = {
+    'boto3.resource(s3)': ('import boto3', "boto3.resource('s3')", '{}'),
+    'boto3.client(s3)': ('import boto3', "boto3.client('s3')", '{}'),
+}
+
+
+def measure(setup, call, response, src_dir=None):
+    env = {
+        **os.environ,
+        'CONFIG': '{}',
+        'AWS_DEFAULT_REGION': 'us-east-1',
+        'AWS_ACCESS_KEY_ID': 'benchmark',
+        'AWS_SECRET_ACCESS_KEY': 'benchmark',
+        'AWS_EC2_METADATA_DISABLED': 'true',
+        'PYTHONPATH': os.pathsep.join(str(ROOT / path) for path in ('common/src', src_dir) if path),
+    }
+    code = CHILD.format(setup=setup, call=call, response=response)
+    output = subprocess.run([sys.executable, '-c', code], env=env, check=True, capture_output=True, text=True)
+    return [float(seconds) for seconds in output.stdout.split()]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=5, help='Fresh processes per measurement; the median is shown')
+    args = parser.parse_args()
+
+    print(f'{"module":<24}{"import (ms)":>12}{"first call (ms)":>17}{"total (ms)":>12}')
+    rows = [(name, src_dir, setup, call, response) for name, (src_dir, setup, call, response) in LAMBDAS.items()]
+    rows += [(name, None, setup, call, response) for name, (setup, call, response) in REFERENCES.items()]
+    for name, src_dir, setup, call, response in rows:
+        runs = [measure(setup, call, response, src_dir) for _ in range(args.runs)]
+        imported = statistics.median(run[0] for run in runs) * 1000
+        called = statistics.median(run[1] for run in runs) * 1000
+        total = statistics.median(sum(run) for run in runs) * 1000
+        print(f'{name:<24}{imported:>12.1f}{called:>17.1f}{total:>12.1f}')
+
+
+if __name__ == '__main__':
+    main()
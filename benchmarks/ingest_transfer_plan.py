@@ -0,0 +1,131 @@
+"""Compare the S3 requests issued by the fixed and size-aware ingest transfer configs.
+
+S3 is stubbed out with a botocore `before-call` hook, so no AWS credentials or network access are needed. Each
+stubbed request sleeps for a simulated latency plus the time to move its bytes at a simulated per-request bandwidth.
+
+    python benchmarks/ingest_transfer_plan.py --latency 0.001 --bandwidth 1e12
+"""
+import argparse
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from pathlib import Path
+
+os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+os.environ.setdefault('CONFIG', '{}')
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'ingest' / 'src'))
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'common' / 'src'))
+
+from boto3.s3.transfer import TransferConfig, create_transfer_manager  # noqa: E402
+
+import ingest  # noqa: E402
+
+MB = 1024 * 1024
+
+FIXED_TRANSFER_CONFIG = {
+    'multipart_threshold': 61644800,
+    'multipart_chunksize': 61644800,
+}
+
+TRANSFER_PLAN = {
+    'multipart_threshold': 64 * MB,
+    'min_part_size': 16 * MB,
+    'target_parts': 32,
+    'max_concurrency': 32,
+}
+
+GRANULES = {
+    'small': {'Metadata': 3 * 1024, 'Browse': 500 * 1024, 'Product': 40 * MB},
+    'typical': {'Metadata': 3 * 1024, 'Browse': 500 * 1024, 'Product': 800 * MB},
+    'large': {'Metadata': 3 * 1024, 'Browse': 2 * MB, 'Product': 6 * 1024 * MB},
+}
+
+
+class StubbedS3:
+    def __init__(self, sizes, latency, bandwidth):
+        self.sizes = sizes
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.calls = Counter()
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.lock = threading.Lock()
+
+    def get_bytes(self, model, headers):
+        if model.name == 'UploadPartCopy':
+            start, end = headers['x-amz-copy-source-range'].split('=')[1].split('-')
+            return int(end) - int(start) + 1
+        if model.name == 'CopyObject':
+            return self.sizes[headers['x-amz-copy-source'].split('/')[-1]]
+        return 0
+
+    def __call__(self, model, params, **kwargs):
+        with self.lock:
+            self.calls[model.name] += 1
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        time.sleep(self.latency + self.get_bytes(model, params['headers']) / self.bandwidth)
+        with self.lock:
+            self.in_flight -= 1
+
+        if model.name == 'HeadObject':
+            return StubbedHttpResponse(), {'ContentLength': self.sizes[params['url_path'].split('/')[-1]],
+                                           'ETag': '"etag"'}
+        responses = {
+            'CopyObject': {'CopyObjectResult': {'ETag': '"etag"'}},
+            'CreateMultipartUpload': {'UploadId': 'upload-id'},
+            'UploadPartCopy': {'CopyPartResult': {'ETag': '"etag"'}},
+            'CompleteMultipartUpload': {},
+        }
+        return StubbedHttpResponse(), responses[model.name]
+
+
+class StubbedHttpResponse:
+    status_code = 200
+
+
+def run(strategy, sizes, stub):
+    client = ingest.s3
+    copies = {name: ({'Bucket': 'source', 'Key': name}, 'dest', name) for name in sizes}
+    source_objects = {name: {'ContentLength': size, 'ETag': '"etag"'} for name, size in sizes.items()}
+
+    client.meta.events.register('before-call.s3', stub)
+    try:
+        start = time.perf_counter()
+        if strategy == 'fixed':
+            for name, (copy_source, dest_bucket, dest_key) in copies.items():
+                transfer_config = TransferConfig(**FIXED_TRANSFER_CONFIG)
+                with create_transfer_manager(client, transfer_config) as transfer_manager:
+                    ingest.copy_s3_object(copy_source, dest_bucket, dest_key, transfer_manager,
+                                          source_objects[name], transfer_config.multipart_threshold)
+        elif strategy == 'planned':
+            ingest.copy_s3_objects(copies, source_objects, TRANSFER_PLAN)
+        else:
+            ingest.copy_s3_objects_concurrently(copies, source_objects, TRANSFER_PLAN, len(copies))
+        return time.perf_counter() - start
+    finally:
+        client.meta.events.unregister('before-call.s3', stub)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--latency', type=float, default=0.02, help='Simulated seconds of latency per request')
+    parser.add_argument('--bandwidth', type=float, default=50e9,
+                        help='Simulated server-side copy bytes per second per request')
+    args = parser.parse_args()
+
+    print(f'{"granule":<10}{"strategy":<13}{"HeadObject":>11}{"CopyObject":>11}{"PartCopy":>10}'
+          f'{"MaxInFlight":>13}{"Seconds":>9}')
+    for granule, sizes in GRANULES.items():
+        for strategy in ('fixed', 'planned', 'concurrent'):
+            stub = StubbedS3(sizes, args.latency, args.bandwidth)
+            seconds = run(strategy, sizes, stub)
+            print(f'{granule:<10}{strategy:<13}{stub.calls["HeadObject"]:>11}{stub.calls["CopyObject"]:>11}'
+                  f'{stub.calls["UploadPartCopy"]:>10}'
+                  f'{stub.max_in_flight:>13}{seconds:>9.3f}')
+
+
+if __name__ == '__main__':
+    main()
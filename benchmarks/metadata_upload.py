@@ -0,0 +1,67 @@
+"""Compare uploading rendered UMM-G through a /tmp file with `upload_file` against an in-memory `put_object`.
+
+S3 is stubbed out with a botocore `before-call` hook, so no AWS credentials or network access are needed; the timings
+therefore measure the client-side cost of each path (file write, transfer manager, MD5) rather than network time.
+
+    python benchmarks/metadata_upload.py --number 200
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+os.environ.setdefault('CONFIG', '{}')
+sys.path.insert(0, str(ROOT / 'metadata-construction' / 'src'))
+sys.path.insert(0, str(ROOT / 'common' / 'src'))
+
+import metadata_construction  # noqa: E402
+
+
+class StubbedHttpResponse:
+    status_code = 200
+
+
+def stub(model, params, **kwargs):
+    return StubbedHttpResponse(), {'ETag': '"etag"'}
+
+
+def get_content():
+    umm_file = ROOT / 'tests' / 'data' / 'granule1' / 'granule.umm.json'
+    return json.dumps(json.loads(umm_file.read_text()), sort_keys=True)
+
+
+def run(strategy, content, number):
+    s3_object = {'bucket': 'myBucket', 'key': f'benchmark-{os.getpid()}.umm.json'}
+    client = metadata_construction.s3
+    client.meta.events.register('before-call.s3', stub)
+    try:
+        start = time.perf_counter()
+        for _ in range(number):
+            if strategy == 'file':
+                metadata_construction.upload_content_to_s3(s3_object, content)
+            else:
+                metadata_construction.put_content_to_s3(s3_object, content, content_md5=strategy == 'memory+md5')
+        return time.perf_counter() - start
+    finally:
+        client.meta.events.unregister('before-call.s3', stub)
+        Path('/tmp', s3_object['key']).unlink(missing_ok=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--number', type=int, default=200, help='Uploads per measurement')
+    args = parser.parse_args()
+
+    content = get_content()
+    print(f'{"strategy":<13}{"per upload (us)":>16}')
+    for strategy in ('file', 'memory', 'memory+md5'):
+        seconds = run(strategy, content, args.number)
+        print(f'{strategy:<13}{seconds / args.number * 1e6:>16.1f}')
+
+
+if __name__ == '__main__':
+    main()
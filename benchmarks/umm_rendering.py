@@ -0,0 +1,93 @@
+"""Compare rendering and serializing UMM-G with and without footprint simplification and the fast serializer.
+
+Renders the test granules in `tests/data`, plus versions of them with footprints densified to `--density` vertices per
+edge, as dense GUNW footprints arrive from the SDS. For each footprint tolerance it reports the boundary points kept,
+the time to render the UMM-G, the time to serialize it with `json` and with `orjson`, and the size of the document.
+No AWS calls are made.
+
+    python benchmarks/umm_rendering.py --number 500 --density 50
+"""
+import argparse
+import copy
+import json
+import os
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+
+ROOT = Path(__file__).resolve().parent.parent
+os.environ.setdefault('CONFIG', '{}')
+sys.path.insert(0, str(ROOT / 'metadata-construction' / 'src'))
+sys.path.insert(0, str(ROOT / 'common' / 'src'))
+
+import metadata_construction  # noqa: E402
+
+TOLERANCES = [None, 0, 0.0001, 0.001, 0.01]
+
+
+def densify(ring, density):
+    points = np.asarray(ring, dtype=float)
+    fractions = np.linspace(0, 1, density, endpoint=False)[:, np.newaxis]
+    edges = [start + fractions * (end - start) for start, end in zip(points[:-1], points[1:])]
+    return np.vstack([*edges, points[:1]]).tolist()
+
+
+def get_granules(density):
+    granules = {}
+    for granule_dir in sorted((ROOT / 'tests' / 'data').iterdir()):
+        sds_metadata = json.loads((granule_dir / 'sds_metadata.json').read_text())
+        inputs = json.loads((granule_dir / 'inputs.json').read_text())
+        config = json.loads((granule_dir / 'config.json').read_text())
+        granules[granule_dir.name] = (sds_metadata, inputs, config)
+
+        dense_metadata = copy.deepcopy(sds_metadata)
+        ring = dense_metadata['location']['coordinates'][0]
+        dense_metadata['location']['coordinates'][0] = densify(ring, density)
+        granules[f'{granule_dir.name}-dense'] = (dense_metadata, inputs, config)
+    return granules
+
+
+def time_per_call(function, number):
+    start = time.perf_counter()
+    for _ in range(number):
+        function()
+    return (time.perf_counter() - start) / number
+
+
+def measure(sds_metadata, inputs, config, number):
+    def render():
+        return metadata_construction.render_granule_metadata(sds_metadata, config, inputs['Product'], inputs['Browse'],
+                                                             product_size=1)
+
+    umm_json = render()
+    fast_config = {**config, 'fast_serializer': True}
+    return {
+        'points': len(umm_json['SpatialExtent']['HorizontalSpatialDomain']['Geometry']['GPolygons'][0]['Boundary']
+                      ['Points']),
+        'render': time_per_call(render, number),
+        'json': time_per_call(lambda: metadata_construction.serialize_umm(umm_json, config), number),
+        'orjson': time_per_call(lambda: metadata_construction.serialize_umm(umm_json, fast_config), number),
+        'bytes': len(metadata_construction.serialize_umm(umm_json, config).encode()),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--number', type=int, default=500, help='Calls per measurement')
+    parser.add_argument('--density', type=int, default=50, help='Vertices per footprint edge in the dense granules')
+    args = parser.parse_args()
+
+    print(f'{"granule":<16}{"tolerance":>10}{"points":>8}{"render (us)":>13}{"json (us)":>11}{"orjson (us)":>13}'
+          f'{"bytes":>9}')
+    for name, (sds_metadata, inputs, config) in get_granules(args.density).items():
+        for tolerance in TOLERANCES:
+            granule_config = config if tolerance is None else {**config, 'footprint_tolerance': tolerance}
+            result = measure(sds_metadata, inputs, granule_config, args.number)
+            print(f'{name:<16}{str(tolerance):>10}{result["points"]:>8}{result["render"] * 1e6:>13.1f}'
+                  f'{result["json"] * 1e6:>11.1f}{result["orjson"] * 1e6:>13.1f}{result["bytes"]:>9}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,54 @@
+"""Compare per-call schema validation cost in the verify Lambda with and without cached validators.
+
+Validates the test granule metadata in `tests/data` and `tests/example-message.json`, once re-reading and re-checking
+the schema on every call the way `jsonschema.validate` does, and once with the validators `verify` caches per container.
+
+    python benchmarks/verify_schema.py --number 1000
+"""
+import argparse
+import json
+import os
+import sys
+import timeit
+from pathlib import Path
+
+import jsonschema
+
+ROOT = Path(__file__).resolve().parent.parent
+os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+os.environ.setdefault('CONFIG', '{}')
+sys.path.insert(0, str(ROOT / 'verify' / 'src'))
+sys.path.insert(0, str(ROOT / 'common' / 'src'))
+os.chdir(ROOT / 'verify' / 'src')
+
+import verify  # noqa: E402
+
+
+def uncached(instance, schema_file):
+    jsonschema.validate(instance, verify.get_json_from_file(schema_file))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--number', type=int, default=500, help='Validations per measurement')
+    args = parser.parse_args()
+
+    documents = [
+        ('example-message.json', ROOT / 'tests' / 'example-message.json', 'message_schema.json'),
+        *[
+            (f'{metadata_file.parent.name}/sds_metadata.json', metadata_file, 'metadata_schema.json')
+            for metadata_file in sorted((ROOT / 'tests' / 'data').glob('*/sds_metadata.json'))
+        ],
+    ]
+
+    print(f'{"document":<30}{"uncached (us)":>15}{"cached (us)":>13}{"speedup":>9}')
+    for name, path, schema_file in documents:
+        instance = json.loads(path.read_text())
+        uncached_seconds = timeit.timeit(lambda: uncached(instance, schema_file), number=args.number)
+        cached_seconds = timeit.timeit(lambda: verify.validate_json(instance, schema_file), number=args.number)
+        print(f'{name:<30}{uncached_seconds / args.number * 1e6:>15.1f}'
+              f'{cached_seconds / args.number * 1e6:>13.1f}{uncached_seconds / cached_seconds:>8.1f}x')
+
+
+if __name__ == '__main__':
+    main()
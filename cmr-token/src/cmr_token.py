@@ -1,15 +1,18 @@
 import base64
 import json
 import os
+from datetime import datetime, timedelta, timezone
 from logging import getLogger
 
-import boto3
 import requests_pkcs12
 
+import instrumentation
+from aws_clients import LazyClient
+
 log = getLogger()
 log.setLevel('INFO')
-s3 = boto3.client('s3')
-secrets_manager = boto3.client('secretsmanager')
+s3 = LazyClient('s3')
+secrets_manager = LazyClient('secretsmanager')
 
 
 def get_secret_value(secret_arn: str) -> dict:
@@ -22,16 +25,20 @@ def get_new_token(certificate: bytes, passphrase: str) -> str:
         'https://api.launchpad.nasa.gov/icam/api/sm/v1/gettoken',
         pkcs12_data=certificate,
         pkcs12_password=passphrase,
+        hooks=instrumentation.get_requests_hooks('launchpad'),
     )
     log.info('Response text: %s', response.text)
     response.raise_for_status()
     return response.json()['sm_token']
 
 
+@instrumentation.handler
 def lambda_handler(event, context):
     secret = get_secret_value(os.environ['CERTIFICATE_SECRET_ARN'])
     certificate = base64.b64decode(secret['certificate'])
     passphrase = secret['passphrase']
 
     token = get_new_token(certificate, passphrase)
-    s3.put_object(Bucket=os.environ['BUCKET'], Key=os.environ['KEY'], Body=token)
+    expires_at = datetime.now(timezone.utc) + timedelta(seconds=int(os.environ['TOKEN_LIFETIME_IN_SECONDS']))
+    s3.put_object(Bucket=os.environ['BUCKET'], Key=os.environ['KEY'], Body=token,
+                  Metadata={'expires-at': expires_at.isoformat()})
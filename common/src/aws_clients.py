@@ -0,0 +1,84 @@
+"""boto3 clients shared by the modules of a Lambda, created on first use from a single session.
+
+Creating a client loads and parses its service model, which is much of a Lambda's cold start. Module-level
+`LazyClient`s defer that until the client is first used and `get_client` builds each client once per container, so
+importing a module is cheap and a handler only pays for the clients it actually calls. Low-level clients are
+preferred; `LazyResource` is for code built around resource objects.
+
+This module is copied into each Lambda's `src/` directory when packaging.
+"""
+import threading
+
+import boto3
+from botocore.config import Config
+
+import instrumentation
+
+_lock = threading.RLock()
+_session = None
+_clients = {}
+_resources = {}
+
+
+def get_session():
+    global _session
+    with _lock:
+        if _session is None:
+            _session = boto3.session.Session()
+            instrumentation.register_session(_session)
+        return _session
+
+
+def _get_config(config_kwargs):
+    return Config(**dict(config_kwargs)) if config_kwargs else None
+
+
+def get_client(service_name, region_name=None, **config_kwargs):
+    key = (service_name, region_name, tuple(sorted(config_kwargs.items())))
+    client = _clients.get(key)
+    if client is None:
+        # creating clients from one session is not thread safe
+        with _lock:
+            client = _clients.get(key)
+            if client is None:
+                client = get_session().client(service_name, region_name=region_name, config=_get_config(key[2]))
+                _clients[key] = client
+    return client
+
+
+def get_resource(service_name, region_name=None, **config_kwargs):
+    key = (service_name, region_name, tuple(sorted(config_kwargs.items())))
+    resource = _resources.get(key)
+    if resource is None:
+        with _lock:
+            resource = _resources.get(key)
+            if resource is None:
+                resource = get_session().resource(service_name, region_name=region_name, config=_get_config(key[2]))
+                _resources[key] = resource
+    return resource
+
+
+def create_resource(service_name, region_name=None):
+    """Return a new resource from the shared session, for code that needs one per thread."""
+    with _lock:
+        return get_session().resource(service_name, region_name=region_name)
+
+
+class LazyClient:
+    """Stands in for a boto3 client at module level, creating it the first time one of its attributes is used."""
+    def __init__(self, service_name, region_name=None, **config_kwargs):
+        self._args = (service_name, region_name)
+        self._config_kwargs = config_kwargs
+
+    def __getattr__(self, name):
+        return getattr(get_client(*self._args, **self._config_kwargs), name)
+
+
+class LazyResource:
+    """Stands in for a boto3 resource at module level, creating it the first time one of its attributes is used."""
+    def __init__(self, service_name, region_name=None, **config_kwargs):
+        self._args = (service_name, region_name)
+        self._config_kwargs = config_kwargs
+
+    def __getattr__(self, name):
+        return getattr(get_resource(*self._args, **self._config_kwargs), name)
@@ -0,0 +1,210 @@
+"""Latency metrics for the AWS and CMR calls a Lambda makes, logged as CloudWatch embedded metric format records.
+
+Set the INSTRUMENTATION_ENABLED environment variable to `true` to turn it on. Every call is then logged with its
+service, operation, bucket or host, the bytes sent or received and its duration, and every invocation of a handler
+wrapped with `handler` ends with a summary of the time spent in each kind of call and whether it was a cold start.
+A Lambda container serves one invocation at a time, so calls from every thread count toward the current invocation.
+When it is off nothing is registered and `handler` returns the handler as is, so instrumented code runs unchanged.
+
+boto3 sessions are hooked with `register_session`, requests sessions with `register_requests_session` and httpx
+clients with `get_httpx_event_hooks`. This module is copied into each Lambda's `src/` directory when packaging.
+"""
+import functools
+import json
+import os
+import threading
+import time
+from urllib.parse import urlsplit
+
+ENABLED = os.getenv('INSTRUMENTATION_ENABLED', 'false').lower() == 'true'
+NAMESPACE = 'grfn-ingest/calls'
+
+
+class CallSummary:
+    """Count, duration and bytes of each kind of call made since the last `reset`, from any thread."""
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.calls = {}
+
+    def add(self, name, duration_in_seconds, size_in_bytes):
+        with self._lock:
+            call = self.calls.setdefault(name, {'Count': 0, 'Duration': 0.0, 'Bytes': 0})
+            call['Count'] += 1
+            call['Duration'] += duration_in_seconds * 1000
+            call['Bytes'] += size_in_bytes or 0
+
+    def reset(self):
+        with self._lock:
+            calls, self.calls = self.calls, {}
+        return calls
+
+
+SUMMARY = CallSummary()
+_cold_start = True
+
+
+def emit(dimensions, metrics, properties=None, namespace=NAMESPACE):
+    """Log one embedded metric format record; `metrics` maps each metric name to its value and unit."""
+    # https://docs.aws.amazon.com/AmazonCloudWatch/latest/monitoring/CloudWatch_Embedded_Metric_Format_Specification.html
+    record = {
+        '_aws': {
+            'Timestamp': int(time.time() * 1000),
+            'CloudWatchMetrics': [
+                {
+                    'Namespace': namespace,
+                    'Dimensions': [list(dimensions)],
+                    'Metrics': [{'Name': name, 'Unit': unit} for name, (_, unit) in metrics.items()],
+                },
+            ],
+        },
+        **dimensions,
+        **(properties or {}),
+        **{name: value for name, (value, _) in metrics.items()},
+    }
+    # one write, so records logged from concurrent threads stay on separate lines
+    print(json.dumps(record) + '\n', end='', flush=True)
+
+
+def record_call(service, operation, duration_in_seconds, endpoint=None, size_in_bytes=None, error=None):
+    metrics = {'Duration': (duration_in_seconds * 1000, 'Milliseconds')}
+    if size_in_bytes is not None:
+        metrics['Bytes'] = (size_in_bytes, 'Bytes')
+    dimensions = {
+        'FunctionName': os.getenv('AWS_LAMBDA_FUNCTION_NAME', ''),
+        'Service': service,
+        'Operation': operation,
+    }
+    emit(dimensions, metrics, {'Endpoint': endpoint, 'Error': error})
+    SUMMARY.add(f'{service}.{operation}', duration_in_seconds, size_in_bytes)
+
+
+def get_body_size(body):
+    if isinstance(body, (bytes, bytearray)):
+        return len(body)
+    if isinstance(body, str):
+        return len(body.encode())
+    if hasattr(body, 'seek') and hasattr(body, 'tell'):
+        position = body.tell()
+        size = body.seek(0, os.SEEK_END) - position
+        body.seek(position)
+        return size
+    return None
+
+
+def _start_botocore_call(params, model, context, **kwargs):
+    context['instrumentation'] = {
+        'start': time.perf_counter(),
+        'service': model.service_model.service_name,
+        'operation': model.name,
+        'endpoint': params.get('Bucket'),
+        'size': get_body_size(params.get('Body')),
+    }
+
+
+def _record_botocore_call(context, parsed=None, exception=None, **kwargs):
+    call = context.pop('instrumentation', None)
+    if call is None:
+        return
+    error = None
+    if exception is not None:
+        error = type(exception).__name__
+    elif parsed and 'Error' in parsed:
+        error = parsed['Error'].get('Code')
+    size = call['size']
+    if call['operation'] == 'GetObject' and parsed:
+        size = parsed.get('ContentLength')
+    record_call(call['service'], call['operation'], time.perf_counter() - call['start'], call['endpoint'], size,
+                error)
+
+
+def register_session(session):
+    """Record the calls of every client and resource created from a boto3 session afterwards."""
+    if not ENABLED:
+        return
+    session.events.register('provide-client-params', _start_botocore_call, unique_id='instrumentation-start')
+    session.events.register('after-call', _record_botocore_call, unique_id='instrumentation-after-call')
+    session.events.register('after-call-error', _record_botocore_call, unique_id='instrumentation-after-call-error')
+
+
+def _record_requests_response(service, response, *args, **kwargs):
+    request = response.request
+    error = str(response.status_code) if response.status_code >= 400 else None
+    # elapsed runs from sending the request until the response headers are parsed
+    record_call(service, request.method, response.elapsed.total_seconds(), urlsplit(request.url).netloc,
+                get_body_size(request.body) or 0, error)
+
+
+def get_requests_hooks(service):
+    """Return the `hooks` argument for a requests call that records the call under `service`."""
+    if not ENABLED:
+        return {}
+    return {'response': [functools.partial(_record_requests_response, service)]}
+
+
+def register_requests_session(session, service):
+    for event, hooks in get_requests_hooks(service).items():
+        session.hooks[event].extend(hooks)
+
+
+def get_httpx_event_hooks(service):
+    """Return the `event_hooks` argument for an httpx.AsyncClient that records its calls under `service`."""
+    if not ENABLED:
+        return {}
+
+    async def start_request(request):
+        request.extensions['instrumentation_start'] = time.perf_counter()
+
+    async def record_response(response):
+        request = response.request
+        error = str(response.status_code) if response.status_code >= 400 else None
+        record_call(service, request.method, time.perf_counter() - request.extensions['instrumentation_start'],
+                    request.url.host, len(request.content), error)
+
+    return {'request': [start_request], 'response': [record_response]}
+
+
+def get_process_age_in_seconds():
+    # the process start time in /proc is in clock ticks after boot
+    try:
+        with open('/proc/self/stat') as f:
+            start_ticks = int(f.read().rsplit(')', 1)[1].split()[19])
+        return time.clock_gettime(time.CLOCK_BOOTTIME) - start_ticks / os.sysconf('SC_CLK_TCK')
+    except (AttributeError, IndexError, OSError, ValueError):
+        return None
+
+
+def log_summary(duration_in_seconds, cold_start, init_duration_in_seconds, event):
+    calls = SUMMARY.reset()
+    metrics = {
+        'InvocationDuration': (duration_in_seconds * 1000, 'Milliseconds'),
+        # summed over calls made concurrently, so it can exceed the invocation duration
+        'CallDuration': (sum(call['Duration'] for call in calls.values()), 'Milliseconds'),
+        'ColdStart': (int(cold_start), 'Count'),
+    }
+    if init_duration_in_seconds is not None:
+        metrics['InitDuration'] = (init_duration_in_seconds * 1000, 'Milliseconds')
+    properties = {'Calls': calls}
+    if isinstance(event, dict) and 'ProductName' in event:
+        properties['ProductName'] = event['ProductName']
+    emit({'FunctionName': os.getenv('AWS_LAMBDA_FUNCTION_NAME', '')}, metrics, properties)
+
+
+def handler(function):
+    """Wrap a Lambda handler to log a summary of its calls after each invocation."""
+    if not ENABLED:
+        return function
+
+    @functools.wraps(function)
+    def wrapper(event, context):
+        global _cold_start
+        cold_start, _cold_start = _cold_start, False
+        # on a cold start, the time from the runtime starting to the first invocation is spent on imports and setup
+        init_duration = get_process_age_in_seconds() if cold_start else None
+        SUMMARY.reset()
+        start = time.perf_counter()
+        try:
+            return function(event, context)
+        finally:
+            log_summary(time.perf_counter() - start, cold_start, init_duration, event)
+
+    return wrapper
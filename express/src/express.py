@@ -0,0 +1,38 @@
+import json
+import os
+from logging import getLogger
+
+import ingest
+import instrumentation
+import metadata_construction
+import verify
+
+
+log = getLogger()
+log.setLevel('INFO')
+CONFIG = json.loads(os.getenv('CONFIG'))
+
+# SDS metadata verify forwards to metadata construction, only needed within the invocation
+FORWARDED_METADATA = ['SdsMetadata', 'SdsMetadataLocation']
+
+
+def process(event, config):
+    """Verify, ingest and construct the metadata for one granule, passing each step's results to the next in memory.
+
+    Errors are raised unchanged from the step that failed, so the Notify step reports the same error codes as for the
+    separate Verify, Ingest and MetadataConstruction Lambda functions. `config` holds the CONFIG of each of those
+    functions under `verify`, `ingest` and `metadata_construction`.
+    """
+    verify_results = verify.verify(event, config['verify'])
+    ingest_results = ingest.ingest({**event, 'VerifyResults': verify_results}, config['ingest'])
+    construction_results = metadata_construction.create_granule_metadata_in_s3(ingest_results,
+                                                                               config['metadata_construction'])
+    return {
+        'IngestResults': {key: value for key, value in ingest_results.items() if key not in FORWARDED_METADATA},
+        'ConstructionResults': construction_results,
+    }
+
+
+@instrumentation.handler
+def lambda_handler(event, context):
+    return process(event, CONFIG)
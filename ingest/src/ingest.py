@@ -1,19 +1,119 @@
 import json
+import math
 import os
+from concurrent.futures import ThreadPoolExecutor
 from logging import getLogger
 from mimetypes import guess_type
 
-import boto3
-from boto3.s3.transfer import TransferConfig
+from boto3.s3.transfer import TransferConfig, create_transfer_manager
+from botocore.exceptions import ClientError
+from s3transfer.subscribers import BaseSubscriber
+
+import instrumentation
+from aws_clients import LazyClient, get_client
 
 
 log = getLogger()
 log.setLevel('INFO')
-s3 = boto3.resource('s3')
+s3 = LazyClient('s3')
 config = json.loads(os.getenv('CONFIG'))
 
+OUTPUT_BUCKETS = {
+    'Metadata': 'metadata_bucket',
+    'Browse': 'browse_bucket',
+    'Product': 'product_bucket',
+}
+
+# S3 multipart upload limits, see https://docs.aws.amazon.com/AmazonS3/latest/userguide/qfacts.html
+MIN_PART_SIZE = 5 * 1024 * 1024
+MAX_PART_SIZE = 5 * 1024 * 1024 * 1024
+MAX_PARTS = 10000
+
+
+class COPY_FAILED(Exception):
+    pass
+
+
+class ProvideSizeSubscriber(BaseSubscriber):
+    """Hands a known object size and ETag to the transfer manager so it does not issue its own HeadObject"""
+    def __init__(self, size, etag=None):
+        self.size = size
+        self.etag = etag
+
+    def on_queued(self, future, **kwargs):
+        future.meta.provide_transfer_size(self.size)
+        # older s3transfer releases do not track the source ETag
+        if self.etag is not None and hasattr(future.meta, 'provide_object_etag'):
+            future.meta.provide_object_etag(self.etag)
+
+
+def get_part_size(size, plan):
+    part_size = max(plan['min_part_size'], math.ceil(size / plan['target_parts']), math.ceil(size / MAX_PARTS))
+    return min(max(part_size, MIN_PART_SIZE), MAX_PART_SIZE)
+
+
+def plan_transfer_config(sizes, plan):
+    """Choose a multipart threshold, part size and concurrency for copying objects of the given sizes.
+
+    Objects smaller than the threshold are copied with a single CopyObject request. Larger objects are split into
+    about `target_parts` parts so they copy with many parallel UploadPartCopy requests. The part size is chosen for the
+    largest object, since a transfer manager applies one part size to every transfer it runs.
+    """
+    threshold = plan['multipart_threshold']
+    largest = max(sizes)
+    if largest < threshold:
+        return TransferConfig(multipart_threshold=threshold, max_concurrency=len(sizes))
+
+    part_size = get_part_size(largest, plan)
+    requests = sum(math.ceil(size / part_size) if size >= threshold else 1 for size in sizes)
+    return TransferConfig(
+        multipart_threshold=threshold,
+        multipart_chunksize=part_size,
+        max_concurrency=min(requests, plan['max_concurrency']),
+    )
+
+
+def get_source_object(event, name):
+    verified_objects = (event.get('VerifyResults') or {}).get('Objects', {})
+    if name in verified_objects:
+        return verified_objects[name]
+    response = s3.head_object(Bucket=event[name]['Bucket'], Key=event[name]['Key'])
+    return {'ContentLength': response['ContentLength'], 'ETag': response['ETag']}
+
+
+def needs_source_etag(source_object, multipart_threshold=None):
+    """Return whether a copy of the source object will get a different ETag, so it must record the source ETag.
+
+    A single part copy of a single part upload keeps its ETag. A multipart copy gets an ETag computed from its own
+    parts, and a single part copy of a multipart upload (whose ETag ends in `-<parts>`) the MD5 of its content.
+    """
+    etag = source_object.get('ETag')
+    if etag is None:
+        return False
+    if multipart_threshold is None or source_object['ContentLength'] >= multipart_threshold:
+        return True
+    return '-' in etag
 
-def copy_s3_object(copy_source, dest_bucket, dest_key, transfer_config):
+
+def is_already_copied(source_object, dest_bucket, dest_key):
+    """Check whether a previous attempt already copied the source object to the destination.
+
+    Copies whose ETag differs from their source's record the source ETag in their metadata; see `needs_source_etag`.
+    """
+    if source_object.get('ETag') is None:
+        return False
+    try:
+        response = s3.head_object(Bucket=dest_bucket, Key=dest_key)
+    except ClientError as e:
+        if e.response['Error']['Code'] in ['403', '404']:
+            return False
+        raise
+    if response['ContentLength'] != source_object['ContentLength']:
+        return False
+    return source_object['ETag'] in (response['ETag'], response.get('Metadata', {}).get('source-etag'))
+
+
+def copy_s3_object(copy_source, dest_bucket, dest_key, transfer_manager, source_object=None, multipart_threshold=None):
     log.info('Copying %s', dest_key)
     content_type = guess_type(dest_key)[0]
     if not content_type:
@@ -23,35 +123,96 @@ def copy_s3_object(copy_source, dest_bucket, dest_key, transfer_config):
         'MetadataDirective': 'REPLACE',
         'TaggingDirective': 'REPLACE',
     }
-    s3.Bucket(dest_bucket).copy(CopySource=copy_source, Key=dest_key, ExtraArgs=extra_args, Config=transfer_config)
+    subscribers = None
+    if source_object is not None:
+        subscribers = [ProvideSizeSubscriber(source_object['ContentLength'], source_object.get('ETag'))]
+        if needs_source_etag(source_object, multipart_threshold):
+            extra_args['Metadata'] = {'source-etag': source_object['ETag']}
+    future = transfer_manager.copy(copy_source=copy_source, bucket=dest_bucket, key=dest_key, extra_args=extra_args,
+                                   subscribers=subscribers)
+    future.result()
 
 
-def lambda_handler(event, context):
-    log.info('Processing %s', event['ProductName'])
-    transfer_config = TransferConfig(**config['transfer_config'])
+def ingest_s3_object(copy_source, dest_bucket, dest_key, transfer_manager, source_object, skip_identical,
+                     multipart_threshold=None):
+    if skip_identical and is_already_copied(source_object, dest_bucket, dest_key):
+        log.info('Skipping %s, already copied', dest_key)
+        return False
+    copy_s3_object(copy_source, dest_bucket, dest_key, transfer_manager, source_object, multipart_threshold)
+    return True
+
+
+def copy_s3_objects(copies, source_objects, plan, skip_identical=False):
+    skipped = []
+    for name, (copy_source, dest_bucket, dest_key) in copies.items():
+        transfer_config = plan_transfer_config([source_objects[name]['ContentLength']], plan)
+        with create_transfer_manager(get_client('s3'), transfer_config) as transfer_manager:
+            if not ingest_s3_object(copy_source, dest_bucket, dest_key, transfer_manager, source_objects[name],
+                                    skip_identical, transfer_config.multipart_threshold):
+                skipped.append(name)
+    return skipped
+
 
-    metadata_output_key = event['ProductName'] + os.path.splitext(event['Metadata']['Key'])[1]
-    copy_s3_object(event['Metadata'], config['metadata_bucket'], metadata_output_key, transfer_config)
+def copy_s3_objects_concurrently(copies, source_objects, plan, max_workers, skip_identical=False):
+    transfer_config = plan_transfer_config([obj['ContentLength'] for obj in source_objects.values()], plan)
+    skipped = []
+    errors = {}
+    with create_transfer_manager(get_client('s3'), transfer_config) as transfer_manager:
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = {
+                name: executor.submit(ingest_s3_object, copy_source, dest_bucket, dest_key, transfer_manager,
+                                      source_objects[name], skip_identical, transfer_config.multipart_threshold)
+                for name, (copy_source, dest_bucket, dest_key) in copies.items()
+            }
+            for name, future in futures.items():
+                try:
+                    if not future.result():
+                        skipped.append(name)
+                except Exception as e:
+                    log.exception('Failed to copy %s', name)
+                    errors[name] = e
 
-    browse_output_key = event['ProductName'] + os.path.splitext(event['Browse']['Key'])[1]
-    copy_s3_object(event['Browse'], config['browse_bucket'], browse_output_key, transfer_config)
+    if errors:
+        raise COPY_FAILED('; '.join(f'{name}: {error}' for name, error in errors.items()))
+    return skipped
 
-    product_output_key = event['ProductName'] + os.path.splitext(event['Product']['Key'])[1]
-    copy_s3_object(event['Product'], config['product_bucket'], product_output_key, transfer_config)
+
+def get_copies(event, config):
+    copies = {}
+    for name, bucket_key in OUTPUT_BUCKETS.items():
+        output_key = event['ProductName'] + os.path.splitext(event[name]['Key'])[1]
+        copies[name] = (event[name], config[bucket_key], output_key)
+    return copies
+
+
+def ingest(event, config):
+    log.info('Processing %s', event['ProductName'])
+    copies = get_copies(event, config)
+    source_objects = {name: get_source_object(event, name) for name in copies}
+    skip_identical = config.get('skip_identical_copies', False)
+
+    if config.get('concurrent_copies'):
+        skipped = copy_s3_objects_concurrently(copies, source_objects, config['transfer_plan'], len(copies),
+                                               skip_identical)
+    else:
+        skipped = copy_s3_objects(copies, source_objects, config['transfer_plan'], skip_identical)
 
     output = {
-        'Product': {
-            'Bucket': config['product_bucket'],
-            'Key': product_output_key,
-        },
-        'Metadata': {
-            'Bucket': config['metadata_bucket'],
-            'Key': metadata_output_key,
-        },
-        'Browse': {
-            'Bucket': config['browse_bucket'],
-            'Key': browse_output_key,
+        name: {
+            'Bucket': dest_bucket,
+            'Key': dest_key,
         }
+        for name, (_, dest_bucket, dest_key) in copies.items()
     }
+    output['SkippedCopies'] = skipped
+    # pass the metadata verify already read on to metadata construction, so it need not download it again
+    for name in ('SdsMetadata', 'SdsMetadataLocation'):
+        if name in event.get('VerifyResults', {}):
+            output[name] = event['VerifyResults'][name]
     log.info('Done processing %s', event['ProductName'])
     return output
+
+
+@instrumentation.handler
+def lambda_handler(event, context):
+    return ingest(event, config)
@@ -1,16 +1,63 @@
+import hashlib
 import json
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from logging import getLogger
 from os import getenv
 
-import boto3
+from botocore.exceptions import ClientError
+
+import instrumentation
+from aws_clients import LazyClient, LazyResource
 
 
 log = getLogger()
 log.setLevel('INFO')
 CONFIG = json.loads(getenv('CONFIG'))
 
-sqs = boto3.resource('sqs')
-sfn = boto3.client('stepfunctions')
+sqs = LazyResource('sqs')
+sfn = LazyClient('stepfunctions')
+
+MAX_BATCH_SIZE = 10
+
+# execution names are at most 80 letters, digits, hyphens and underscores
+MAX_EXECUTION_NAME_LENGTH = 80
+EXECUTION_NAME_HASH_LENGTH = 16
+INVALID_EXECUTION_NAME_CHARACTERS = re.compile(r'[^A-Za-z0-9_-]')
+
+
+class SeenExecutions:
+    """Names of the executions this container started recently, from any thread.
+
+    Duplicate deliveries of a message within a batch, or within `seen_ttl_in_seconds` of each other on a warm
+    container, are then skipped without another call to Step Functions.
+    """
+    def __init__(self, clock=time.monotonic):
+        self._lock = threading.Lock()
+        self._clock = clock
+        self.names = {}
+
+    def claim(self, name, ttl_in_seconds):
+        """Remember a name for `ttl_in_seconds`, returning False if it was already claimed and has not expired."""
+        with self._lock:
+            now = self._clock()
+            # names are held for the same time, so the oldest claims are the first to expire
+            while self.names and next(iter(self.names.values())) <= now:
+                del self.names[next(iter(self.names))]
+            if self.names.get(name, now) > now:
+                return False
+            self.names.pop(name, None)
+            self.names[name] = now + ttl_in_seconds
+            return True
+
+    def release(self, name):
+        with self._lock:
+            self.names.pop(name, None)
+
+
+SEEN_EXECUTIONS = SeenExecutions()
 
 
 def validate_message(message, message_error_key):
@@ -23,11 +70,110 @@ def validate_message(message, message_error_key):
     return message
 
 
+def get_execution_name(message):
+    """Name the execution for a message after its ProductName and DeliveryTime, so duplicate deliveries share a name.
+
+    Returns None for messages without both, which then start an execution with a generated name as before.
+    """
+    try:
+        message = json.loads(message)
+        product_name, delivery_time = message['ProductName'], message['DeliveryTime']
+    except (KeyError, TypeError, ValueError):
+        return None
+    if not (isinstance(product_name, str) and isinstance(delivery_time, str) and product_name and delivery_time):
+        return None
+    digest = hashlib.sha256(json.dumps([product_name, delivery_time]).encode()).hexdigest()
+    prefix = INVALID_EXECUTION_NAME_CHARACTERS.sub('_', product_name)
+    prefix = prefix[:MAX_EXECUTION_NAME_LENGTH - EXECUTION_NAME_HASH_LENGTH - 1].rstrip('-')
+    return f'{prefix}-{digest[:EXECUTION_NAME_HASH_LENGTH]}'
+
+
+def start_execution(sfn_client, config, message, name=None):
+    kwargs = {} if name is None else {'name': name}
+    try:
+        response = sfn_client.start_execution(stateMachineArn=config['step_function_arn'], input=message, **kwargs)
+    except ClientError as e:
+        # a duplicate of a message that already started its execution
+        if e.response['Error']['Code'] != 'ExecutionAlreadyExists':
+            raise
+        log.info('Execution %s already exists.  Skipping duplicate message.', name)
+        return
+    log.info('Execution started: %s ', response['executionArn'])
+
+
 def process_sqs_message(sfn_client, config, sqs_message):
     sns_message = json.loads(sqs_message.body)
     validated_message = validate_message(sns_message['Message'], config['message_error_key'])
-    response = sfn_client.start_execution(stateMachineArn=config['step_function_arn'], input=validated_message)
-    log.info('Execution started: %s ', response['executionArn'])
+    name = get_execution_name(validated_message)
+    if name is None:
+        start_execution(sfn_client, config, validated_message)
+        return
+
+    if not SEEN_EXECUTIONS.claim(name, config.get('seen_ttl_in_seconds', 0)):
+        log.info('Execution %s was started recently.  Skipping duplicate message.', name)
+        return
+    try:
+        start_execution(sfn_client, config, validated_message, name)
+    except Exception:
+        # the message will be retried, so a duplicate of it must not be skipped in the meantime
+        SEEN_EXECUTIONS.release(name)
+        raise
+
+
+def receive_messages(queue, config, messages_processed):
+    # never receive more than the messages left to process, so every message received is dispatched
+    max_messages = min(config['max_messages_per_receive'], config['max_messages_to_process'] - messages_processed)
+    return queue.receive_messages(MaxNumberOfMessages=max_messages, WaitTimeSeconds=config['wait_time_in_seconds'])
+
+
+def process_sqs_messages(executor, config, sqs_messages):
+    futures = [executor.submit(process_sqs_message, sfn, config, sqs_message) for sqs_message in sqs_messages]
+    processed = []
+    for sqs_message, future in zip(sqs_messages, futures):
+        try:
+            future.result()
+            processed.append(sqs_message)
+        except Exception:
+            log.exception('Failed to process message %s.  It will be retried.', sqs_message.message_id)
+    return processed
+
+
+def delete_messages(queue, sqs_messages):
+    for i in range(0, len(sqs_messages), MAX_BATCH_SIZE):
+        entries = [
+            {'Id': sqs_message.message_id, 'ReceiptHandle': sqs_message.receipt_handle}
+            for sqs_message in sqs_messages[i:i + MAX_BATCH_SIZE]
+        ]
+        response = queue.delete_messages(Entries=entries)
+        for failure in response.get('Failed', []):
+            log.error('Failed to delete message %s: %s', failure['Id'], failure.get('Message'))
+
+
+def invoke_ingest_pipelined(config):
+    queue = sqs.Queue(config['queue_url'])
+    messages_processed = 0
+
+    receiver = ThreadPoolExecutor(max_workers=1)
+    executor = ThreadPoolExecutor(max_workers=config['max_workers'])
+    with receiver, executor:
+        next_messages = receiver.submit(receive_messages, queue, config, messages_processed)
+        while next_messages is not None:
+            messages = next_messages.result()
+            if not messages:
+                log.info('No messages found.  Exiting.')
+                break
+
+            messages_processed += len(messages)
+            if messages_processed < config['max_messages_to_process']:
+                # long-poll for the next batch while this one is dispatched
+                next_messages = receiver.submit(receive_messages, queue, config, messages_processed)
+            else:
+                log.warning('Processed %s of %s messages.  Exiting.', messages_processed,
+                            config['max_messages_to_process'])
+                next_messages = None
+
+            processed = process_sqs_messages(executor, config['message'], messages)
+            delete_messages(queue, processed)
 
 
 def invoke_ingest(config):
@@ -39,8 +185,7 @@ def invoke_ingest(config):
             log.warning('Processed %s of %s messages.  Exiting.', messages_processed, config['max_messages_to_process'])
             break
 
-        messages = queue.receive_messages(MaxNumberOfMessages=config['max_messages_per_receive'],
-                                          WaitTimeSeconds=config['wait_time_in_seconds'])
+        messages = receive_messages(queue, config, messages_processed)
         if not messages:
             log.info('No messages found.  Exiting.')
             break
@@ -51,5 +196,82 @@ def invoke_ingest(config):
             messages_processed += 1
 
 
+def get_queue_depth(queue):
+    queue.load()
+    return int(queue.attributes['ApproximateNumberOfMessages'])
+
+
+def count_running_executions(sfn_client, state_machine_arn, limit):
+    paginator = sfn_client.get_paginator('list_executions')
+    running_executions = 0
+    for page in paginator.paginate(stateMachineArn=state_machine_arn, statusFilter='RUNNING'):
+        running_executions += len(page['executions'])
+        if running_executions >= limit:
+            break
+    return running_executions
+
+
+def plan_drain(queue_depth, running_executions, remaining_time_in_millis, config):
+    """Decide how many messages to pull this invocation and whether to long-poll for them.
+
+    The number of messages is limited by the queue depth, the room left under the cap on running step function
+    executions, and the number of messages that can be dispatched in the remaining Lambda time. A shallow queue is
+    long-polled so a receive can return a full batch; a deep queue is short-polled since messages are already waiting.
+    """
+    controller = config['drain_controller']
+    execution_capacity = max(controller['max_running_executions'] - running_executions, 0)
+    time_capacity = max(remaining_time_in_millis - controller['reserved_time_in_millis'], 0) \
+        // controller['millis_per_message']
+    messages_to_process = min(queue_depth, execution_capacity, time_capacity, config['max_messages_to_process'])
+
+    if queue_depth < config['max_messages_per_receive']:
+        wait_time_in_seconds = controller['max_wait_time_in_seconds']
+    else:
+        wait_time_in_seconds = 0
+
+    return {
+        'QueueDepth': queue_depth,
+        'RunningExecutions': running_executions,
+        'ExecutionCapacity': execution_capacity,
+        'TimeCapacity': time_capacity,
+        'MessagesToProcess': messages_to_process,
+        'WaitTimeSeconds': wait_time_in_seconds,
+    }
+
+
+def log_metrics(metrics):
+    units = {'WaitTimeSeconds': 'Seconds'}
+    instrumentation.emit({}, {name: (value, units.get(name, 'Count')) for name, value in metrics.items()},
+                         namespace='grfn-ingest/invoke')
+
+
+def get_drain_config(config, remaining_time_in_millis):
+    queue = sqs.Queue(config['queue_url'])
+    queue_depth = get_queue_depth(queue)
+    running_executions = 0
+    if queue_depth:
+        running_executions = count_running_executions(sfn, config['message']['step_function_arn'],
+                                                      config['drain_controller']['max_running_executions'])
+
+    decision = plan_drain(queue_depth, running_executions, remaining_time_in_millis, config)
+    log_metrics(decision)
+    return {
+        **config,
+        'max_messages_to_process': decision['MessagesToProcess'],
+        'wait_time_in_seconds': decision['WaitTimeSeconds'],
+    }
+
+
+@instrumentation.handler
 def lambda_handler(event, context):
-    invoke_ingest(CONFIG)
+    config = CONFIG
+    if 'drain_controller' in config:
+        config = get_drain_config(config, context.get_remaining_time_in_millis())
+        if config['max_messages_to_process'] == 0:
+            log.info('Nothing to process.  Exiting.')
+            return
+
+    if config.get('pipelined'):
+        invoke_ingest_pipelined(config)
+    else:
+        invoke_ingest(config)
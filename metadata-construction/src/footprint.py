@@ -0,0 +1,78 @@
+"""Simplify GUNW footprints before they are written to UMM-G.
+
+Rings are lists of `[longitude, latitude]` pairs, as in the SDS metadata, and are simplified in the plane of those
+coordinates with the Douglas-Peucker algorithm: every vertex dropped lies within `tolerance` degrees of the simplified
+boundary.
+"""
+import numpy as np
+
+
+def get_signed_area(ring):
+    """Return the area of a closed ring, positive when it runs counterclockwise."""
+    x, y = ring[:, 0], ring[:, 1]
+    return 0.5 * np.sum(x[:-1] * y[1:] - x[1:] * y[:-1])
+
+
+def get_distances(points, starts, ends):
+    """Return the distance of each point from a line segment, given by its start and end or one for every point."""
+    segments = ends - starts
+    offsets = points - starts
+    lengths_squared = np.sum(segments * segments, axis=-1)
+    # the distance from a zero length segment is the distance from its start
+    fractions = np.divide(np.sum(offsets * segments, axis=-1), lengths_squared,
+                          out=np.zeros(len(points)), where=lengths_squared > 0)
+    fractions = np.clip(fractions, 0, 1)
+    return np.hypot(*(offsets - fractions[:, np.newaxis] * segments).T)
+
+
+def simplify_line(points, tolerance, keep=None):
+    """Return a mask of the points of a line that Douglas-Peucker keeps.
+
+    The points marked in `keep`, by default the first and last, are kept and split the line into sections. Rather than
+    recursing into one section at a time, every section is split at its farthest point in the same step, so the number
+    of NumPy calls grows with the depth of the recursion instead of the number of points kept.
+    """
+    if keep is None:
+        keep = np.zeros(len(points), dtype=bool)
+        keep[[0, -1]] = True
+    keep = keep.copy()
+    while True:
+        kept = np.flatnonzero(keep)
+        candidates = np.flatnonzero(~keep)
+        # each candidate lies in the section between the kept points before and after it
+        sections = np.searchsorted(kept, candidates) - 1
+        distances = get_distances(points[candidates], points[kept[sections]], points[kept[sections + 1]])
+        # the farthest candidate of each section, the first of them on a tie
+        order = np.lexsort((-distances, sections))
+        farthest = order[np.flatnonzero(np.diff(sections[order], prepend=-1))]
+        farthest = farthest[distances[farthest] > tolerance]
+        if len(farthest) == 0:
+            return keep
+        keep[candidates[farthest]] = True
+
+
+def simplify_ring(ring, tolerance):
+    """Simplify a closed ring to within `tolerance` degrees, returning it closed and counterclockwise."""
+    points = np.asarray(ring, dtype=float)
+    # a ring across the antimeridian is not a simple shape in these coordinates, so it is left as the SDS wrote it
+    if np.ptp(points[:, 0]) > 180:
+        return [list(point) for point in reversed(ring)]
+    if len(points) > 1 and np.array_equal(points[0], points[-1]):
+        points = points[:-1]
+
+    # split the ring at its first vertex and the vertex farthest from it, and simplify each half as a line
+    split = int(np.argmax(np.hypot(*(points - points[0]).T)))
+    keep = np.ones(len(points), dtype=bool)
+    if len(points) > 3 and split > 0:
+        corners = np.zeros(len(points) + 1, dtype=bool)
+        corners[[0, split, -1]] = True
+        keep = simplify_line(np.vstack([points, points[:1]]), tolerance, corners)[:-1]
+        if np.count_nonzero(keep) < 3:
+            # a polygon needs at least three corners, so keep the one farthest from the other two
+            keep[np.argmax(get_distances(points, points[0], points[split]))] = True
+
+    simplified = points[keep]
+    simplified = np.vstack([simplified, simplified[:1]])
+    if get_signed_area(simplified) < 0:
+        simplified = simplified[::-1]
+    return simplified.tolist()
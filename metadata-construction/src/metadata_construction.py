@@ -1,15 +1,23 @@
+import base64
+import hashlib
 import json
 import os
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from logging import getLogger
 
-import boto3
+import orjson
+
+import instrumentation
+from aws_clients import LazyClient
 
 log = getLogger()
 log.setLevel('INFO')
 CONFIG = json.loads(os.getenv('CONFIG'))
 
-s3 = boto3.resource('s3')
+# enough connections for the batch entry point to keep one request in flight per worker
+MAX_POOL_CONNECTIONS = 32
+s3 = LazyClient('s3', max_pool_connections=MAX_POOL_CONNECTIONS)
 
 
 def now():
@@ -17,8 +25,7 @@ def now():
 
 
 def get_file_content_from_s3(bucket, key):
-    obj = s3.Object(bucket, key)
-    response = obj.get()
+    response = s3.get_object(Bucket=bucket, Key=key)
     contents = response['Body'].read()
     return contents
 
@@ -29,7 +36,7 @@ def write_to_file(file_name, content):
 
 
 def upload_file_to_s3(local_file, bucket, key, content_type='application/xml'):
-    s3.meta.client.upload_file(local_file, bucket, key, ExtraArgs={'ContentType': content_type})
+    s3.upload_file(local_file, bucket, key, ExtraArgs={'ContentType': content_type})
 
 
 def upload_content_to_s3(s3_object, content):
@@ -38,9 +45,18 @@ def upload_content_to_s3(s3_object, content):
     upload_file_to_s3(local_file, s3_object['bucket'], s3_object['key'])
 
 
+def put_content_to_s3(s3_object, content, content_type='application/xml', content_md5=False):
+    # uploads straight from memory, without the /tmp file upload_content_to_s3 leaves behind in the container
+    body = content.encode()
+    extra_args = {}
+    if content_md5:
+        extra_args['ContentMD5'] = base64.b64encode(hashlib.md5(body).digest()).decode()
+    s3.put_object(Bucket=s3_object['bucket'], Key=s3_object['key'], Body=body, ContentType=content_type, **extra_args)
+
+
 def get_s3_file_size(obj):
-    obj = s3.Object(obj['Bucket'], obj['Key'])
-    return obj.content_length
+    response = s3.head_object(Bucket=obj['Bucket'], Key=obj['Key'])
+    return response['ContentLength']
 
 
 def get_sds_metadata(obj):
@@ -48,18 +64,35 @@ def get_sds_metadata(obj):
     return json.loads(content)
 
 
-def format_polygon(polygon):
+def get_forwarded_sds_metadata(inputs):
+    # verify hands on the fields of the SDS metadata needed here, inline or as a reference when too large for the state
+    if 'SdsMetadata' in inputs:
+        return inputs['SdsMetadata']
+    if 'SdsMetadataLocation' in inputs:
+        return get_sds_metadata(inputs['SdsMetadataLocation'])
+    return get_sds_metadata(inputs['Metadata'])
+
+
+def format_polygon(polygon, tolerance=None):
+    if tolerance is None:
+        points = reversed(polygon)
+    else:
+        # imported only when footprints are simplified, so other cold starts do not pay for loading NumPy
+        import footprint
+        points = footprint.simplify_ring(polygon, tolerance)
     coordinates = []
-    for long, lat in reversed(polygon):
+    for long, lat in points:
         coordinates.append({"Latitude": lat, "Longitude": long})
     return coordinates
 
 
-def render_granule_metadata(sds_metadata, config, product, browse) -> dict:
+def render_granule_metadata(sds_metadata, config, product, browse, product_size=None) -> dict:
+    if product_size is None:
+        product_size = get_s3_file_size(product)
     granule_ur = sds_metadata['label']
     download_url = config['granule_data']['download_path']
     browse_url = config['granule_data']['browse_path']
-    polygon = format_polygon(sds_metadata['location']['coordinates'][0])
+    polygon = format_polygon(sds_metadata['location']['coordinates'][0], config.get('footprint_tolerance'))
 
     umm = {
         'MetadataSpecification': {
@@ -115,7 +148,7 @@ def render_granule_metadata(sds_metadata, config, product, browse) -> dict:
             "ArchiveAndDistributionInformation": [
                 {
                     "Name": os.path.basename(product['Key']),
-                    "SizeInBytes": get_s3_file_size(product)
+                    "SizeInBytes": product_size
                 }
             ],
             "DayNightFlag": "Unspecified",
@@ -147,19 +180,57 @@ def render_granule_metadata(sds_metadata, config, product, browse) -> dict:
     return umm
 
 
+def serialize_umm(umm_json, config):
+    if config.get('fast_serializer'):
+        # compact, with sorted keys and shortest round-trip floats, so the same UMM-G always gives the same bytes
+        return orjson.dumps(umm_json, option=orjson.OPT_SORT_KEYS).decode()
+    return json.dumps(umm_json, sort_keys=True)
+
+
 def create_granule_metadata_in_s3(inputs, config):
     log.info('Creating metadata file for %s', inputs['Product']['Key'])
-    sds_metadata = get_sds_metadata(inputs['Metadata'])
+    sds_metadata = get_forwarded_sds_metadata(inputs)
     umm_json = render_granule_metadata(sds_metadata, config, inputs['Product'], inputs['Browse'])
     output_location = {
         'bucket': config['output_bucket'],
         'key': umm_json['GranuleUR'] + '.umm.json',
     }
-    upload_content_to_s3(output_location, json.dumps(umm_json, sort_keys=True))
+    content = serialize_umm(umm_json, config)
+    if config.get('in_memory_upload'):
+        put_content_to_s3(output_location, content, content_md5=config.get('content_md5', False))
+    else:
+        upload_content_to_s3(output_location, content)
 
     return output_location
 
 
+def create_granule_metadata_result(inputs, config):
+    try:
+        return {'Result': create_granule_metadata_in_s3(inputs, config)}
+    except Exception as e:
+        log.exception('Failed to create metadata file for %s', inputs['Product']['Key'])
+        return {'Error': {'Error': type(e).__name__, 'Cause': str(e)}}
+
+
+def create_granule_metadata_batch(granules, config, max_workers):
+    """Render and upload UMM-G for many granules, overlapping their S3 requests on a thread pool.
+
+    Returns one `{'Result': output_location}` or `{'Error': {'Error': ..., 'Cause': ...}}` per granule, in the order of
+    `granules`, so a failure for one granule does not stop the rest of the batch.
+    """
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        return list(executor.map(lambda inputs: create_granule_metadata_result(inputs, config), granules))
+
+
+@instrumentation.handler
 def lambda_handler(event, context):
     output = create_granule_metadata_in_s3(event, CONFIG)
     return output
+
+
+@instrumentation.handler
+def batch_lambda_handler(event, context):
+    max_workers = CONFIG.get('batch_max_workers', MAX_POOL_CONNECTIONS)
+    results = create_granule_metadata_batch(event['Granules'], CONFIG, max_workers)
+    log.info('Created %s of %s metadata files', sum('Result' in result for result in results), len(results))
+    return {'Results': results}
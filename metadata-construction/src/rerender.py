@@ -0,0 +1,226 @@
+"""Re-render UMM-G for already ingested granules from S3 Inventory manifests, outside the step function.
+
+Manifest rows for `<ProductName>.nc`, `<ProductName>.json` and `<ProductName>.png` are grouped into granules on disk,
+in a temporary SQLite database, which needs free space in the temporary directory (`TMPDIR`) of about the size of the
+uncompressed manifests. Granules are rendered on a process pool with `render_granule_metadata` using the product size
+from the manifest, and written to the `output_bucket` of the given metadata construction config. Progress is
+checkpointed, so an interrupted run continues where it stopped when started again with the same manifests in the same
+order, and a checkpoint written for other manifests is refused; granules that fail are appended to a CSV file.
+
+CSV manifests (optionally gzipped) are read with the columns given by `--file-schema`, as listed in the inventory's
+`manifest.json`. Parquet manifests require pyarrow. `--local-root` reads and writes `<local-root>/<bucket>/<key>`
+instead of S3.
+
+    python metadata-construction/src/rerender.py --config config.json manifests/*.csv.gz
+"""
+import argparse
+import csv
+import gzip
+import itertools
+import json
+import os
+import sqlite3
+import sys
+import tempfile
+from logging import basicConfig, getLogger
+from multiprocessing import Pool
+from pathlib import Path
+from urllib.parse import unquote_plus
+
+import boto3
+
+os.environ.setdefault('CONFIG', '{}')
+# common/src is only copied next to this module when the Lambda function is packaged
+sys.path.append(str(Path(__file__).resolve().parents[2] / 'common' / 'src'))
+
+import metadata_construction  # noqa: E402
+
+log = getLogger()
+
+GRANULE_FILES = {
+    '.nc': 'Product',
+    '.json': 'Metadata',
+    '.png': 'Browse',
+}
+
+storage = None
+render_config = None
+
+
+class LocalStorage:
+    def __init__(self, root):
+        self.root = Path(root)
+
+    def get(self, bucket, key):
+        return (self.root / bucket / key).read_bytes()
+
+    def put(self, bucket, key, body):
+        path = self.root / bucket / key
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(body)
+
+
+class S3Storage:
+    def __init__(self):
+        self.s3 = boto3.client('s3')
+
+    def get(self, bucket, key):
+        return self.s3.get_object(Bucket=bucket, Key=key)['Body'].read()
+
+    def put(self, bucket, key, body):
+        self.s3.put_object(Bucket=bucket, Key=key, Body=body, ContentType='application/xml')
+
+
+def read_csv_manifest(path, file_schema):
+    columns = [column.strip() for column in file_schema.split(',')]
+    opener = gzip.open if str(path).endswith('.gz') else open
+    with opener(path, 'rt', newline='') as f:
+        for row in csv.reader(f):
+            record = dict(zip(columns, row))
+            # S3 Inventory URL-encodes keys in CSV manifests
+            yield record['Bucket'], unquote_plus(record['Key']), int(record['Size'])
+
+
+def read_parquet_manifest(path):
+    try:
+        import pyarrow.parquet
+    except ImportError as e:
+        raise ImportError('Reading Parquet manifests requires pyarrow') from e
+    for batch in pyarrow.parquet.ParquetFile(path).iter_batches(columns=['bucket', 'key', 'size']):
+        for row in batch.to_pylist():
+            yield row['bucket'], row['key'], row['size']
+
+
+def read_manifest(path, file_schema):
+    if str(path).endswith('.parquet'):
+        return read_parquet_manifest(path)
+    return read_csv_manifest(path, file_schema)
+
+
+def get_granules(manifests, file_schema):
+    """Group manifest rows into granules, yielding those with a product, metadata and browse file in name order.
+
+    S3 Inventory writes a separate manifest for each bucket, so a granule's files are spread across manifests. Rows are
+    first written to an SQLite database in a temporary file, indexed by granule name, and read back grouped by it, so
+    memory use does not grow with the size of the inventory. Granules are yielded in the same order for the same
+    manifests, which is what lets a checkpoint record progress as a count.
+    """
+    with tempfile.TemporaryDirectory() as temp_dir:
+        # the generator may be resumed from Pool.imap's task thread
+        db = sqlite3.connect(os.path.join(temp_dir, 'granules.db'), check_same_thread=False)
+        try:
+            db.execute('CREATE TABLE files (name TEXT, file TEXT, bucket TEXT, key TEXT, size INTEGER, '
+                       'PRIMARY KEY (name, file))')
+            for manifest in manifests:
+                db.executemany('INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?)',
+                               get_granule_files(manifest, file_schema))
+            db.commit()
+
+            skipped = 0
+            rows = db.execute('SELECT name, file, bucket, key, size FROM files ORDER BY name')
+            for _, files in itertools.groupby(rows, key=lambda row: row[0]):
+                granule = {file: {'Bucket': bucket, 'Key': key, 'Size': size} for _, file, bucket, key, size in files}
+                if len(granule) == len(GRANULE_FILES):
+                    yield granule
+                else:
+                    skipped += 1
+        finally:
+            db.close()
+    if skipped:
+        log.warning('Skipped %s granules missing a product, metadata or browse file', skipped)
+
+
+def get_granule_files(manifest, file_schema):
+    for bucket, key, size in read_manifest(manifest, file_schema):
+        name, extension = os.path.splitext(os.path.basename(key))
+        if extension in GRANULE_FILES and not name.endswith('.umm'):
+            yield name, GRANULE_FILES[extension], bucket, key, size
+
+
+def init_worker(local_root, config):
+    global storage, render_config
+    storage = LocalStorage(local_root) if local_root else S3Storage()
+    render_config = config
+
+
+def rerender_granule(granule):
+    try:
+        metadata = granule['Metadata']
+        sds_metadata = json.loads(storage.get(metadata['Bucket'], metadata['Key']))
+        umm_json = metadata_construction.render_granule_metadata(sds_metadata, render_config, granule['Product'],
+                                                                 granule['Browse'], granule['Product']['Size'])
+        content = metadata_construction.serialize_umm(umm_json, render_config)
+        storage.put(render_config['output_bucket'], umm_json['GranuleUR'] + '.umm.json', content.encode())
+        return granule['Product']['Key'], None
+    except Exception as e:
+        return granule['Product']['Key'], f'{type(e).__name__}: {e}'
+
+
+def load_checkpoint(checkpoint_file, manifests):
+    manifests = [os.path.abspath(manifest) for manifest in manifests]
+    if not os.path.exists(checkpoint_file):
+        return {'Manifests': manifests, 'Completed': 0, 'Failed': 0}
+    with open(checkpoint_file) as f:
+        checkpoint = json.load(f)
+    # the checkpoint is a count of granules, so it only holds for the manifests it was written for, in that order
+    if checkpoint.get('Manifests') != manifests:
+        raise ValueError(f'{checkpoint_file} was written for other manifests or another order of them. '
+                         'Run with the same manifests or a new checkpoint file.')
+    return checkpoint
+
+
+def save_checkpoint(checkpoint_file, checkpoint):
+    with open(checkpoint_file + '.tmp', 'w') as f:
+        json.dump(checkpoint, f)
+    os.replace(checkpoint_file + '.tmp', checkpoint_file)
+
+
+def rerender(manifests, config, checkpoint_file, failures_file, local_root=None, processes=None,
+             file_schema='Bucket, Key, Size', chunksize=16, checkpoint_every=1000):
+    checkpoint = load_checkpoint(checkpoint_file, manifests)
+    if checkpoint['Completed']:
+        log.info('Resuming after %s granules', checkpoint['Completed'])
+    granules = itertools.islice(get_granules(manifests, file_schema), checkpoint['Completed'], None)
+
+    with Pool(processes, initializer=init_worker, initargs=(local_root, config)) as pool, \
+            open(failures_file, 'a', newline='') as f:
+        failures = csv.writer(f)
+        # imap keeps results in manifest order, so everything before the checkpointed count is done
+        for product_key, error in pool.imap(rerender_granule, granules, chunksize):
+            checkpoint['Completed'] += 1
+            if error:
+                checkpoint['Failed'] += 1
+                failures.writerow([product_key, error])
+            if checkpoint['Completed'] % checkpoint_every == 0:
+                f.flush()
+                save_checkpoint(checkpoint_file, checkpoint)
+                log.info('Rendered %s granules, %s failed', checkpoint['Completed'], checkpoint['Failed'])
+
+    save_checkpoint(checkpoint_file, checkpoint)
+    return checkpoint
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('manifests', nargs='+', help='S3 Inventory CSV, CSV.GZ or Parquet files')
+    parser.add_argument('--config', required=True, help='Metadata construction config JSON file')
+    parser.add_argument('--local-root', help='Directory standing in for S3, with one subdirectory per bucket')
+    parser.add_argument('--processes', type=int, help='Worker processes (default: CPU count)')
+    parser.add_argument('--file-schema', default='Bucket, Key, Size', help='Columns of the CSV manifests')
+    parser.add_argument('--checkpoint', default='rerender.checkpoint.json', help='Checkpoint file')
+    parser.add_argument('--failures', default='rerender.failures.csv', help='CSV file of failed granules')
+    parser.add_argument('--chunksize', type=int, default=16, help='Granules sent to a worker at a time')
+    parser.add_argument('--checkpoint-every', type=int, default=1000, help='Granules between checkpoints')
+    args = parser.parse_args()
+
+    basicConfig(level='INFO', format='%(asctime)s %(levelname)s %(message)s')
+    with open(args.config) as f:
+        config = json.load(f)
+
+    checkpoint = rerender(args.manifests, config, args.checkpoint, args.failures, args.local_root, args.processes,
+                          args.file_schema, args.chunksize, args.checkpoint_every)
+    log.info('Rendered %s granules, %s failed', checkpoint['Completed'], checkpoint['Failed'])
+
+
+if __name__ == '__main__':
+    main()
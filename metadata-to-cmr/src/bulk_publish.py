@@ -0,0 +1,152 @@
+"""Publish UMM-G documents already in the aux bucket to CMR in bulk, for reprocessing campaigns.
+
+CMR has no bulk API for creating or replacing whole granule records (its bulk granule update API only edits a few
+fields such as OPeNDAP and S3 links), so granules are published with the same per-granule PUT as the metadata-to-cmr
+activity, but outside the step function and many at a time over one connection pool. Granules are sent in submissions
+of `--submission-size`, paced by the `rate_limit` and `circuit_breaker` settings of the config; granules that fail
+with a retryable error (throttling, 5xx, connection errors, requests paused by backpressure) are re-queued for the
+next round and only they are sent again. Every outcome is appended to a JSON lines results file mapping the S3 key to
+its concept-id or error, and granules already published there are skipped when the campaign is run again.
+
+    python metadata-to-cmr/src/bulk_publish.py --config cmr.json --bucket my-aux-bucket --prefix S1-GUNW
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+from logging import basicConfig, getLogger
+from pathlib import Path
+
+import boto3
+import httpx
+
+# common/src is only copied next to this module when the Lambda function is packaged
+sys.path.append(str(Path(__file__).resolve().parents[2] / 'common' / 'src'))
+
+import cmr  # noqa: E402
+import cmr_async  # noqa: E402
+
+log = getLogger()
+
+RETRYABLE_STATUS_CODES = {429, 500, 502, 503, 504}
+
+
+def is_retryable(error):
+    if isinstance(error, httpx.HTTPStatusError):
+        return error.response.status_code in RETRYABLE_STATUS_CODES
+    return isinstance(error, (httpx.TransportError, cmr.CMR_UNAVAILABLE))
+
+
+def list_keys(s3_client, bucket, prefix):
+    paginator = s3_client.get_paginator('list_objects_v2')
+    for page in paginator.paginate(Bucket=bucket, Prefix=prefix):
+        for obj in page.get('Contents', []):
+            if obj['Key'].endswith('.umm.json'):
+                yield obj['Key']
+
+
+def load_results(results_file):
+    results = {}
+    if os.path.exists(results_file):
+        with open(results_file) as f:
+            for line in f:
+                result = json.loads(line)
+                results[result['Key']] = result
+    return results
+
+
+def get_unpublished(keys, results_file):
+    results = load_results(results_file)
+    return [key for key in keys if 'ConceptId' not in results.get(key, {})]
+
+
+async def publish_granule(semaphore, client, bucket, key, config, s3):
+    async with semaphore:
+        return await cmr_async.process_task({'bucket': bucket, 'key': key}, config, client, s3)
+
+
+async def publish(client, bucket, keys, config, s3, max_in_flight=32, submission_size=1000, max_rounds=3,
+                  backoff_in_seconds=5, on_result=None):
+    """Publish the UMM-G documents at `keys` in `bucket`, returning `{key: {'Key', 'ConceptId' or 'Error'}}`.
+
+    `on_result` is called with each final result as soon as it is known, so progress survives an interrupted run.
+    """
+    semaphore = asyncio.Semaphore(max_in_flight)
+    results = {}
+    pending = list(keys)
+    for round_number in range(1, max_rounds + 1):
+        retry = []
+        for start in range(0, len(pending), submission_size):
+            submission = pending[start:start + submission_size]
+            outcomes = await asyncio.gather(
+                *[publish_granule(semaphore, client, bucket, key, config, s3) for key in submission],
+                return_exceptions=True,
+            )
+            for key, outcome in zip(submission, outcomes):
+                if not isinstance(outcome, Exception):
+                    results[key] = {'Key': key, 'ConceptId': outcome}
+                elif is_retryable(outcome) and round_number < max_rounds:
+                    retry.append(key)
+                    continue
+                else:
+                    results[key] = {'Key': key, 'Error': f'{type(outcome).__name__}: {outcome}'}
+                if on_result:
+                    on_result(results[key])
+            log.info('Round %s: submitted %s of %s granules', round_number, start + len(submission), len(pending))
+
+        if not retry:
+            break
+        log.warning('Re-queuing %s granules that failed with retryable errors', len(retry))
+        await asyncio.sleep(backoff_in_seconds * round_number)
+        pending = retry
+    return results
+
+
+async def publish_campaign(args, config):
+    cmr.configure_backpressure(config)
+    s3 = boto3.resource('s3')
+    if args.keys_file:
+        with open(args.keys_file) as f:
+            keys = [line.strip() for line in f if line.strip()]
+    else:
+        keys = list(list_keys(s3.meta.client, args.bucket, args.prefix))
+    keys = get_unpublished(keys, args.results)
+    log.info('Publishing %s granules', len(keys))
+
+    with open(args.results, 'a') as f:
+        def on_result(result):
+            f.write(json.dumps(result) + '\n')
+            f.flush()
+
+        async with cmr_async.get_client(config['cached_token'], s3, args.max_in_flight) as client:
+            results = await publish(client, args.bucket, keys, config, s3, args.max_in_flight, args.submission_size,
+                                    args.max_rounds, args.backoff, on_result)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--config', required=True,
+                        help='JSON file with the "cmr" section of the metadata-to-cmr CONFIG')
+    parser.add_argument('--bucket', required=True, help='Bucket holding the UMM-G documents')
+    parser.add_argument('--prefix', default='', help='Publish every .umm.json document under this prefix')
+    parser.add_argument('--keys-file', help='Publish the keys listed in this file, one per line, instead')
+    parser.add_argument('--results', default='bulk_publish.results.jsonl', help='JSON lines results file')
+    parser.add_argument('--max-in-flight', type=int, default=32, help='Concurrent requests to CMR')
+    parser.add_argument('--submission-size', type=int, default=1000, help='Granules per submission')
+    parser.add_argument('--max-rounds', type=int, default=3, help='Rounds of re-queuing retryable failures')
+    parser.add_argument('--backoff', type=float, default=5, help='Seconds to wait before a retry round, per round')
+    args = parser.parse_args()
+
+    basicConfig(level='INFO', format='%(asctime)s %(levelname)s %(message)s')
+    with open(args.config) as f:
+        config = json.load(f)
+
+    results = asyncio.run(publish_campaign(args, config))
+    published = sum('ConceptId' in result for result in results.values())
+    log.info('Published %s of %s granules', published, len(results))
+
+
+if __name__ == '__main__':
+    main()
@@ -2,31 +2,319 @@
 # https://wiki.earthdata.nasa.gov/display/CMR/CMR+Data+Partner+User+Guide
 # https://cmr.earthdata.nasa.gov/ingest/site/ingest_api_docs.html#create-update-granule
 
+import hashlib
 import json
+import random
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
+from email.utils import parsedate_to_datetime
 from logging import getLogger
 from urllib.parse import urljoin
 
-import boto3
+import botocore
 import requests
+from requests.adapters import HTTPAdapter
+
+import instrumentation
+from aws_clients import LazyClient
 
 log = getLogger()
+lambda_client = LazyClient('lambda')
+
+THROTTLED_STATUS_CODES = {429, 503}
+
+
+class CMR_UNAVAILABLE(Exception):
+    pass
+
+
+class TokenCache:
+    """CMR token and its expiry, held for the life of a warm Lambda container.
+
+    Refreshes are single-flight: the first caller to find the token about to expire, or rejected by CMR, refreshes it
+    while other callers wait on the lock and then reuse the new token.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.token = None
+        self.expires_at = None
+
+    def is_fresh(self, margin_in_seconds=0):
+        if self.token is None:
+            return False
+        # tokens cached before expiry times were recorded are used until CMR rejects them
+        if self.expires_at is None:
+            return True
+        return datetime.now(timezone.utc) + timedelta(seconds=margin_in_seconds) < self.expires_at
+
+    def load(self, config, s3):
+        self.token, self.expires_at = get_cached_token_and_expiry(config, s3)
+        return self.token
+
+    def get(self, config, s3):
+        margin = config.get('token_refresh_margin_in_seconds', 0)
+        if self.is_fresh(margin):
+            return self.token
+        with self._lock:
+            if not self.is_fresh(margin):
+                # another container may have refreshed the cached token already
+                self.load(config['cached_token'], s3)
+                if not self.is_fresh(margin):
+                    self._refresh(config, s3)
+            return self.token
+
+    def refresh(self, config, s3, rejected_token):
+        with self._lock:
+            if self.token == rejected_token:
+                self.load(config['cached_token'], s3)
+                if self.token == rejected_token:
+                    self._refresh(config, s3)
+            return self.token
+
+    def _refresh(self, config, s3):
+        log.info('Refreshing CMR token')
+        lambda_client.invoke(FunctionName=config['cmr_token_lambda'])
+        self.load(config['cached_token'], s3)
+
+
+TOKEN_CACHE = TokenCache()
+
+
+class RateLimiter:
+    """Token bucket pacing requests to CMR from every worker in the container.
+
+    A throttled response halves the request rate, down to a floor, and stops all requests until its `Retry-After` has
+    passed; each other response raises the rate again by a twentieth of the configured rate. Workers thus settle
+    together near the rate CMR accepts rather than bursting into it. Unconfigured, it never makes a caller wait.
+    """
+    def __init__(self, clock=time.monotonic):
+        self._lock = threading.Lock()
+        self._clock = clock
+        self.max_rate = None
+        self.min_rate = None
+        self.rate = None
+        self.burst = None
+        self.tokens = 0.0
+        self.updated = clock()
+
+    def configure(self, requests_per_second, burst, min_requests_per_second):
+        with self._lock:
+            self.max_rate = self.rate = requests_per_second
+            self.min_rate = min_requests_per_second
+            self.burst = self.tokens = burst
+            self.updated = self._clock()
+
+    def _refill(self, now):
+        if now > self.updated:
+            self.tokens = min(self.tokens + (now - self.updated) * self.rate, self.burst)
+            self.updated = now
+
+    def reserve(self, max_wait_in_seconds=float('inf')):
+        """Take a token, returning the seconds to wait before using it, or None if that is over the maximum."""
+        if self.rate is None:
+            return 0
+        with self._lock:
+            now = self._clock()
+            self._refill(now)
+            wait = max(self.updated - now, 0) + max(1 - self.tokens, 0) / self.rate
+            if wait > max_wait_in_seconds:
+                return None
+            self.tokens -= 1
+            return wait
+
+    def throttled(self, retry_after_in_seconds=None):
+        if self.rate is None:
+            return
+        with self._lock:
+            now = self._clock()
+            self._refill(now)
+            self.rate = max(self.rate / 2, self.min_rate)
+            self.tokens = min(self.tokens, 0)
+            if retry_after_in_seconds:
+                # no tokens accrue until the time CMR asked for has passed
+                self.updated = max(self.updated, now + retry_after_in_seconds)
+
+    def succeeded(self):
+        if self.rate is None:
+            return
+        with self._lock:
+            self._refill(self._clock())
+            self.rate = min(self.rate + self.max_rate / 20, self.max_rate)
+
+
+class CircuitBreaker:
+    """Pause requests to CMR after repeated throttling or server errors.
+
+    While open, tasks fail fast back to the step function instead of waiting out their timeout. After
+    `reset_timeout_in_seconds` a single trial request decides whether to close it again. Unconfigured, it never opens.
+    """
+    def __init__(self, clock=time.monotonic):
+        self._lock = threading.Lock()
+        self._clock = clock
+        self.failure_threshold = None
+        self.reset_timeout = 0
+        self.failures = 0
+        self.opened_at = None
+        self.trial_in_flight = False
+
+    def configure(self, failure_threshold, reset_timeout_in_seconds):
+        with self._lock:
+            self.failure_threshold = failure_threshold
+            self.reset_timeout = reset_timeout_in_seconds
+
+    def is_open(self):
+        """Return whether requests are paused, without claiming the trial request."""
+        with self._lock:
+            if self.opened_at is None:
+                return False
+            return self.trial_in_flight or self._clock() - self.opened_at < self.reset_timeout
+
+    def acquire(self):
+        """Return None if requests are paused, True for the trial request of a half-open breaker, otherwise False.
+
+        A trial that gets no response to record must be given back with `release_trial`, or the breaker stays open.
+        """
+        with self._lock:
+            if self.opened_at is None:
+                return False
+            if self.trial_in_flight or self._clock() - self.opened_at < self.reset_timeout:
+                return None
+            self.trial_in_flight = True
+            return True
+
+    def release_trial(self):
+        with self._lock:
+            self.trial_in_flight = False
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self.trial_in_flight = False
+
+    def record_failure(self):
+        if self.failure_threshold is None:
+            return
+        with self._lock:
+            self.failures += 1
+            if self.trial_in_flight or self.failures >= self.failure_threshold:
+                if self.opened_at is None or self.trial_in_flight:
+                    log.warning('Too many failed requests to CMR.  Pausing for %s seconds.', self.reset_timeout)
+                self.opened_at = self._clock()
+                self.trial_in_flight = False
+
+
+RATE_LIMITER = RateLimiter()
+CIRCUIT_BREAKER = CircuitBreaker()
+
+
+def configure_backpressure(config):
+    if 'rate_limit' in config:
+        RATE_LIMITER.configure(**config['rate_limit'])
+    if 'circuit_breaker' in config:
+        CIRCUIT_BREAKER.configure(**config['circuit_breaker'])
+
+
+def get_retry_after(headers):
+    value = headers.get('Retry-After')
+    if not value:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    try:
+        return max((parsedate_to_datetime(value) - datetime.now(timezone.utc)).total_seconds(), 0)
+    except (TypeError, ValueError):
+        return None
+
+
+@contextmanager
+def claim_request(config, deadline=None):
+    """Claim the next request to CMR, yielding the seconds to wait before sending it.
+
+    Raises CMR_UNAVAILABLE if the request should not be sent: while the circuit breaker is open, or if the rate limiter
+    would have it wait longer than `max_request_delay_in_seconds` or past `deadline`, a `time.monotonic()` time. A trial
+    request that leaves the block without its response recorded, because it raised, is released for a later task.
+    """
+    if CIRCUIT_BREAKER.is_open():
+        raise CMR_UNAVAILABLE('Requests to CMR are paused after repeated throttling or server errors')
+    max_delay = config.get('max_request_delay_in_seconds', float('inf'))
+    if deadline is not None:
+        max_delay = min(max_delay, deadline - time.monotonic())
+    delay = RATE_LIMITER.reserve(max_delay)
+    if delay is None:
+        raise CMR_UNAVAILABLE('CMR is throttling requests for longer than the task can wait')
+    trial = CIRCUIT_BREAKER.acquire()
+    if trial is None:
+        raise CMR_UNAVAILABLE('Requests to CMR are paused after repeated throttling or server errors')
+    try:
+        yield delay
+    finally:
+        if trial:
+            CIRCUIT_BREAKER.release_trial()
+
+
+def get_task_deadline(config):
+    if 'task_deadline_in_seconds' not in config:
+        return None
+    return time.monotonic() + config['task_deadline_in_seconds']
+
+
+def get_request_timeout(deadline):
+    # a request is only sent with time left before the deadline, but allow it at least a second to get a response
+    if deadline is None:
+        return None
+    return max(deadline - time.monotonic(), 1)
+
+
+def check_retry_deadline(delay, deadline):
+    if deadline is not None and time.monotonic() + delay >= deadline:
+        raise CMR_UNAVAILABLE('CMR is throttling requests for longer than the task can wait')
+
+
+def record_response(status_code, headers):
+    """Feed a CMR response to the rate limiter and circuit breaker, returning True if it was throttled."""
+    if status_code == 429 or status_code >= 500:
+        CIRCUIT_BREAKER.record_failure()
+    else:
+        CIRCUIT_BREAKER.record_success()
+
+    if status_code in THROTTLED_STATUS_CODES:
+        RATE_LIMITER.throttled(get_retry_after(headers))
+        return True
+    RATE_LIMITER.succeeded()
+    return False
+
+
+def get_retry_delay(attempt, config):
+    # exponential backoff with full jitter, so workers throttled together do not retry together
+    cap = min(config.get('backoff_base_in_seconds', 1) * 2 ** attempt, config.get('backoff_max_in_seconds', 20))
+    return random.uniform(0, cap)
 
 
-def send_request(session, base_url, metadata_content):
+def send_request(session, base_url, metadata_content, token=None, timeout=None):
     metadata = json.loads(metadata_content)
     granule_native_id = metadata['GranuleUR']
     content_type = f'application/vnd.nasa.cmr.umm+json;version={metadata["MetadataSpecification"]["Version"]}'
     url = urljoin(base_url, granule_native_id)
-    response = session.put(url, headers={'Content-Type': content_type}, data=metadata_content)
+    headers = {'Content-Type': content_type}
+    if token:
+        headers['Authorization'] = token
+    response = session.put(url, headers=headers, data=metadata_content, timeout=timeout)
     log.info('Response text: %s', response.text)
     return response
 
 
-def get_session(config, s3):
-    token = get_cached_token(config, s3)
+def get_session(config, s3, pool_size=1):
+    token = TOKEN_CACHE.load(config, s3)
     session = requests.Session()
+    session.mount('https://', HTTPAdapter(pool_maxsize=pool_size))
     headers = {'Accept': 'application/json', 'Authorization': token}
     session.headers.update(headers)
+    instrumentation.register_requests_session(session, 'cmr')
     return session
 
 
@@ -37,27 +325,101 @@ def get_file_content_from_s3(bucket, key, s3):
     return contents
 
 
-def get_cached_token(config, s3):
+def get_cached_token_and_expiry(config, s3):
     try:
-        return get_file_content_from_s3(config['bucket'], config['key'], s3)
+        response = s3.Object(config['bucket'], config['key']).get()
+        token = response['Body'].read()
     except Exception:
-        return None
+        return None, None
+    expires_at = response.get('Metadata', {}).get('expires-at')
+    return token, datetime.fromisoformat(expires_at) if expires_at else None
+
+
+def put_granule_metadata(session, metadata_content, config, s3, deadline=None):
+    token = TOKEN_CACHE.get(config, s3)
+    try:
+        response = send_request(session, config['granule_url'], metadata_content, token, get_request_timeout(deadline))
+        if response.status_code == 401:
+            token = TOKEN_CACHE.refresh(config, s3, rejected_token=token)
+            response = send_request(session, config['granule_url'], metadata_content, token,
+                                    get_request_timeout(deadline))
+    except (requests.ConnectionError, requests.Timeout):
+        CIRCUIT_BREAKER.record_failure()
+        raise
+    return response
 
 
-def push_granule_metadata_to_cmr(session, metadata_content, config, s3):
-    response = send_request(session, config['granule_url'], metadata_content)
-    if response.status_code == 401:
-        lamb = boto3.client('lambda')
-        lamb.invoke(FunctionName=config['cmr_token_lambda'])
-        token = get_cached_token(config['cached_token'], s3)
-        session.headers.update({'Authorization': token})
-        response = send_request(session, config['granule_url'], metadata_content)
+def push_granule_metadata_to_cmr(session, metadata_content, config, s3, deadline=None):
+    max_attempts = config.get('max_attempts', 1)
+    for attempt in range(max_attempts):
+        with claim_request(config, deadline) as delay:
+            time.sleep(delay)
+            response = put_granule_metadata(session, metadata_content, config, s3, deadline)
+            throttled = record_response(response.status_code, response.headers)
+        if not throttled or attempt + 1 == max_attempts:
+            break
+        delay = get_retry_delay(attempt, config)
+        check_retry_deadline(delay, deadline)
+        log.warning('CMR responded %s.  Retrying in %.1f seconds.', response.status_code, delay)
+        time.sleep(delay)
     response.raise_for_status()
     return response.json()
 
 
+def get_fingerprint(metadata):
+    # ProviderDates are re-stamped on every render, so they are left out of the comparison
+    normalized = {key: value for key, value in metadata.items() if key != 'ProviderDates'}
+    return hashlib.sha256(json.dumps(normalized, sort_keys=True, separators=(',', ':')).encode()).hexdigest()
+
+
+def get_fingerprint_key(config, granule_ur):
+    return config['prefix'] + granule_ur
+
+
+def get_published_concept_id(metadata_content, config, s3):
+    """Return the concept-id of the granule if this UMM-G was already published to CMR, otherwise None.
+
+    The fingerprint of the last UMM-G published for each GranuleUR is kept with its concept-id in the S3 metadata of
+    an empty object under `config['prefix']`.
+    """
+    metadata = json.loads(metadata_content)
+    try:
+        response = s3.meta.client.head_object(Bucket=config['bucket'],
+                                              Key=get_fingerprint_key(config, metadata['GranuleUR']))
+    except botocore.exceptions.ClientError as e:
+        if e.response['Error']['Code'] in ['403', '404']:
+            return None
+        raise
+    if response['Metadata'].get('fingerprint') != get_fingerprint(metadata):
+        return None
+    return response['Metadata']['concept-id']
+
+
+def put_published_fingerprint(metadata_content, concept_id, config, s3):
+    metadata = json.loads(metadata_content)
+    s3.meta.client.put_object(
+        Bucket=config['bucket'],
+        Key=get_fingerprint_key(config, metadata['GranuleUR']),
+        Body=b'',
+        Metadata={'fingerprint': get_fingerprint(metadata), 'concept-id': concept_id},
+    )
+
+
 def process_task(task_input, config, session, s3):
     log.info(task_input)
+    deadline = get_task_deadline(config)
     metadata_content = get_file_content_from_s3(task_input['bucket'], task_input['key'], s3)
-    response = push_granule_metadata_to_cmr(session, metadata_content, config, s3)
+    if 'fingerprints' in config:
+        concept_id = get_published_concept_id(metadata_content, config['fingerprints'], s3)
+        if concept_id:
+            log.info('Metadata unchanged since it was published as %s.  Skipping.', concept_id)
+            return concept_id
+
+    response = push_granule_metadata_to_cmr(session, metadata_content, config, s3, deadline)
+    if 'fingerprints' in config:
+        # CMR has the granule, so failing the task now would only have the step function publish it again
+        try:
+            put_published_fingerprint(metadata_content, response['concept-id'], config['fingerprints'], s3)
+        except Exception:
+            log.exception('Failed to record the fingerprint of %s', response['concept-id'])
     return response['concept-id']
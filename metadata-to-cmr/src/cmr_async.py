@@ -0,0 +1,103 @@
+# asyncio counterpart of cmr.py, so one daemon can keep many granule PUTs to CMR in flight over reused connections
+# https://cmr.earthdata.nasa.gov/ingest/site/ingest_api_docs.html#create-update-granule
+
+import asyncio
+import json
+from logging import getLogger
+from urllib.parse import urljoin
+
+import httpx
+
+import instrumentation
+from cmr import (CIRCUIT_BREAKER, TOKEN_CACHE, check_retry_deadline, claim_request, get_published_concept_id,
+                 get_request_timeout, get_retry_delay, get_task_deadline, put_published_fingerprint, record_response)
+
+log = getLogger()
+
+
+def get_client(config, s3, max_in_flight):
+    headers = {'Accept': 'application/json'}
+    token = TOKEN_CACHE.load(config, s3)
+    if token:
+        headers['Authorization'] = token
+    limits = httpx.Limits(max_connections=max_in_flight, max_keepalive_connections=max_in_flight)
+    return httpx.AsyncClient(headers=headers, limits=limits, timeout=httpx.Timeout(30.0),
+                             event_hooks=instrumentation.get_httpx_event_hooks('cmr'))
+
+
+async def send_request(client, base_url, metadata_content, token=None, timeout=None):
+    metadata = json.loads(metadata_content)
+    granule_native_id = metadata['GranuleUR']
+    content_type = f'application/vnd.nasa.cmr.umm+json;version={metadata["MetadataSpecification"]["Version"]}'
+    url = urljoin(base_url, granule_native_id)
+    headers = {'Content-Type': content_type}
+    if token:
+        headers['Authorization'] = token
+    response = await client.put(url, headers=headers, content=metadata_content,
+                                timeout=httpx.USE_CLIENT_DEFAULT if timeout is None else timeout)
+    log.info('Response text: %s', response.text)
+    return response
+
+
+async def get_file_content_from_s3(bucket, key, s3_client):
+    response = await asyncio.to_thread(s3_client.get_object, Bucket=bucket, Key=key)
+    return await asyncio.to_thread(response['Body'].read)
+
+
+async def get_token(config, s3):
+    if TOKEN_CACHE.is_fresh(config.get('token_refresh_margin_in_seconds', 0)):
+        return TOKEN_CACHE.token
+    return await asyncio.to_thread(TOKEN_CACHE.get, config, s3)
+
+
+async def put_granule_metadata(client, metadata_content, config, s3, deadline=None):
+    token = await get_token(config, s3)
+    try:
+        response = await send_request(client, config['granule_url'], metadata_content, token,
+                                      get_request_timeout(deadline))
+        if response.status_code == 401:
+            token = await asyncio.to_thread(TOKEN_CACHE.refresh, config, s3, token)
+            response = await send_request(client, config['granule_url'], metadata_content, token,
+                                          get_request_timeout(deadline))
+    except httpx.TransportError:
+        CIRCUIT_BREAKER.record_failure()
+        raise
+    return response
+
+
+async def push_granule_metadata_to_cmr(client, metadata_content, config, s3, deadline=None):
+    max_attempts = config.get('max_attempts', 1)
+    for attempt in range(max_attempts):
+        with claim_request(config, deadline) as delay:
+            await asyncio.sleep(delay)
+            response = await put_granule_metadata(client, metadata_content, config, s3, deadline)
+            throttled = record_response(response.status_code, response.headers)
+        if not throttled or attempt + 1 == max_attempts:
+            break
+        delay = get_retry_delay(attempt, config)
+        check_retry_deadline(delay, deadline)
+        log.warning('CMR responded %s.  Retrying in %.1f seconds.', response.status_code, delay)
+        await asyncio.sleep(delay)
+    response.raise_for_status()
+    return response.json()
+
+
+async def process_task(task_input, config, client, s3):
+    log.info(task_input)
+    deadline = get_task_deadline(config)
+    metadata_content = await get_file_content_from_s3(task_input['bucket'], task_input['key'], s3.meta.client)
+    if 'fingerprints' in config:
+        concept_id = await asyncio.to_thread(get_published_concept_id, metadata_content, config['fingerprints'], s3)
+        if concept_id:
+            log.info('Metadata unchanged since it was published as %s.  Skipping.', concept_id)
+            return concept_id
+
+    response = await push_granule_metadata_to_cmr(client, metadata_content, config, s3, deadline)
+    if 'fingerprints' in config:
+        # CMR has the granule, so failing the task now would only have the step function publish it again
+        try:
+            await asyncio.to_thread(put_published_fingerprint, metadata_content, response['concept-id'],
+                                    config['fingerprints'], s3)
+        except Exception:
+            log.exception('Failed to record the fingerprint of %s', response['concept-id'])
+    return response['concept-id']
@@ -1,11 +1,15 @@
+import asyncio
 import json
+from concurrent.futures import ThreadPoolExecutor
 from logging import getLogger
 from os import getenv
 
-import boto3
-from botocore.client import Config
 from botocore.exceptions import ClientError
-from cmr import get_session, process_task
+
+import aws_clients
+import cmr_async
+import instrumentation
+from cmr import configure_backpressure, get_session, process_task
 
 
 log = getLogger()
@@ -13,10 +17,9 @@ log.setLevel('INFO')
 CONFIG = json.loads(getenv('CONFIG'))
 
 
-def get_sfn_client(connect_timeout):
-    config = Config(connect_timeout=connect_timeout, read_timeout=connect_timeout)
-    sfn_client = boto3.client('stepfunctions', config=config)
-    return sfn_client
+def get_sfn_client(connect_timeout, max_pool_connections=10):
+    return aws_clients.get_client('stepfunctions', connect_timeout=connect_timeout, read_timeout=connect_timeout,
+                                  max_pool_connections=max_pool_connections)
 
 
 def get_task(sfn_client, activity):
@@ -37,11 +40,7 @@ def send_task_response(sfn_client, token, output=None, exception=None):
             raise
 
 
-def daemon_loop(config, get_remaining_time_in_millis_fcn):
-    log.info('Daemon started')
-    s3 = boto3.resource('s3')
-    session = get_session(config['cmr']['cached_token'], s3)
-    sfn_client = get_sfn_client(config['sfn_connect_timeout'])
+def worker_loop(config, get_remaining_time_in_millis_fcn, sfn_client, session, s3):
     while True:
         if get_remaining_time_in_millis_fcn() < config['max_task_time_in_millis']:
             log.info('Remaining time %s less than max task time %s.  Exiting.', get_remaining_time_in_millis_fcn(),
@@ -62,5 +61,69 @@ def daemon_loop(config, get_remaining_time_in_millis_fcn):
             send_task_response(sfn_client, task['taskToken'], exception=e)
 
 
+def daemon_loop(config, get_remaining_time_in_millis_fcn):
+    log.info('Daemon started')
+    workers = config.get('workers', 1)
+    configure_backpressure(config['cmr'])
+    s3 = aws_clients.create_resource('s3')
+    session = get_session(config['cmr']['cached_token'], s3, pool_size=workers)
+    sfn_client = get_sfn_client(config['sfn_connect_timeout'], max_pool_connections=max(workers, 10))
+    if workers == 1:
+        worker_loop(config, get_remaining_time_in_millis_fcn, sfn_client, session, s3)
+        return
+
+    # boto3 resources are not thread safe, so each worker gets its own
+    s3_resources = [aws_clients.create_resource('s3') for _ in range(workers)]
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = [
+            executor.submit(worker_loop, config, get_remaining_time_in_millis_fcn, sfn_client, session, worker_s3)
+            for worker_s3 in s3_resources
+        ]
+        for future in futures:
+            future.result()
+    log.info('All %s workers finished', workers)
+
+
+async def async_worker_loop(config, get_remaining_time_in_millis_fcn, sfn_client, client, s3):
+    while True:
+        if get_remaining_time_in_millis_fcn() < config['max_task_time_in_millis']:
+            log.info('Remaining time %s less than max task time %s.  Exiting.', get_remaining_time_in_millis_fcn(),
+                     config['max_task_time_in_millis'])
+            break
+
+        task = await asyncio.to_thread(get_task, sfn_client, config['activity'])
+        if 'taskToken' not in task:
+            log.info('No tasks found.  Exiting')
+            break
+
+        try:
+            task_input = json.loads(task['input'])
+            output = await cmr_async.process_task(task_input, config['cmr'], client, s3)
+            await asyncio.to_thread(send_task_response, sfn_client, task['taskToken'], output)
+        except Exception as e:
+            log.exception('Failed to process task.')
+            await asyncio.to_thread(send_task_response, sfn_client, task['taskToken'], exception=e)
+
+
+async def async_daemon_loop(config, get_remaining_time_in_millis_fcn):
+    log.info('Async daemon started')
+    workers = config.get('workers', 1)
+    configure_backpressure(config['cmr'])
+    # activity polls block a thread for up to a minute, so size the thread pool for every worker to poll at once
+    asyncio.get_running_loop().set_default_executor(ThreadPoolExecutor(max_workers=workers + 4))
+    s3 = aws_clients.create_resource('s3')
+    sfn_client = get_sfn_client(config['sfn_connect_timeout'], max_pool_connections=max(workers, 10))
+    async with cmr_async.get_client(config['cmr']['cached_token'], s3, max_in_flight=workers) as client:
+        await asyncio.gather(*[
+            async_worker_loop(config, get_remaining_time_in_millis_fcn, sfn_client, client, s3)
+            for _ in range(workers)
+        ])
+    log.info('All %s workers finished', workers)
+
+
+@instrumentation.handler
 def lambda_handler(event, context):
-    daemon_loop(CONFIG, context.get_remaining_time_in_millis)
+    if CONFIG.get('async'):
+        asyncio.run(async_daemon_loop(CONFIG, context.get_remaining_time_in_millis))
+    else:
+        daemon_loop(CONFIG, context.get_remaining_time_in_millis)
@@ -3,13 +3,20 @@ from datetime import datetime
 from logging import getLogger
 from os import getenv
 
-import boto3
+import instrumentation
+from aws_clients import get_client
 
 
 log = getLogger()
 log.setLevel('INFO')
 CONFIG = json.loads(getenv('CONFIG'))
 
+MAX_BATCH_SIZE = 10
+
+
+class PUBLISH_FAILED(Exception):
+    pass
+
 
 def create_response(event, error_config):
     response = {
@@ -34,8 +41,12 @@ def create_response(event, error_config):
     return response
 
 
+def get_sns_client(region):
+    return get_client('sns', region_name=region)
+
+
 def send_message(message, topic):
-    client = boto3.client('sns', region_name=topic['Region'])
+    client = get_sns_client(topic['Region'])
     response = client.publish(
         TopicArn=topic['Arn'],
         Message=message,
@@ -59,6 +70,61 @@ def notify(event, config):
     return response
 
 
+def publish_batch(messages, topic):
+    """Publish messages to a topic ten at a time, returning the indexes of the messages that could not be sent."""
+    client = get_sns_client(topic['Region'])
+    failed = []
+    for start in range(0, len(messages), MAX_BATCH_SIZE):
+        entries = [
+            {'Id': str(index), 'Message': message}
+            for index, message in enumerate(messages[start:start + MAX_BATCH_SIZE], start)
+        ]
+        try:
+            response = client.publish_batch(TopicArn=topic['Arn'], PublishBatchRequestEntries=entries)
+        except Exception:
+            log.exception('Failed to send %s messages to topic %s', len(entries), topic['Arn'])
+            failed.extend(range(start, start + len(entries)))
+            continue
+        for failure in response.get('Failed', []):
+            log.error('Failed to send message %s to topic %s: %s', failure['Id'], topic['Arn'], failure.get('Message'))
+            failed.append(int(failure['Id']))
+    return sorted(failed)
+
+
+def notify_batch(events, config):
+    """Send the responses for many executions, batching them per topic.
+
+    As with `notify`, responses that cannot be sent to their response topic are sent to the default topic instead.
+    """
+    responses = [create_response(event, config['errors']) for event in events]
+
+    indexes_by_topic = {}
+    for index, event in enumerate(events):
+        topic = event.get('ResponseTopic', config['default_topic'])
+        indexes_by_topic.setdefault((topic['Arn'], topic['Region']), []).append(index)
+
+    default_topic = (config['default_topic']['Arn'], config['default_topic']['Region'])
+    default_indexes = indexes_by_topic.pop(default_topic, [])
+    for (arn, region), indexes in indexes_by_topic.items():
+        log.info('Sending %s messages to response topic %s', len(indexes), arn)
+        failed = publish_batch([json.dumps(responses[index]) for index in indexes], {'Arn': arn, 'Region': region})
+        default_indexes.extend(indexes[i] for i in failed)
+
+    if default_indexes:
+        log.info('Sending %s messages to default topic %s', len(default_indexes), config['default_topic'])
+        failed = publish_batch([json.dumps(responses[index]) for index in default_indexes], config['default_topic'])
+        if failed:
+            raise PUBLISH_FAILED(f'Failed to send {len(failed)} messages to the default topic')
+
+    return responses
+
+
+@instrumentation.handler
 def lambda_handler(event, context):
     response = notify(event, CONFIG)
     return response
+
+
+@instrumentation.handler
+def batch_lambda_handler(event, context):
+    return notify_batch(event['Executions'], CONFIG)
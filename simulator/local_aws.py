@@ -0,0 +1,293 @@
+"""Filesystem-backed stand-ins for the S3, SNS and Step Functions activity APIs the ingest Lambdas call.
+
+`LocalAws.install()` makes every boto3 session created afterwards answer from the local stand-ins. It hooks the
+session's `before-call` event, so no request is signed or sent and the real boto3 clients, resources and transfer
+managers run unchanged. S3 objects are files under `<root>/s3/<bucket>/` and SNS messages are appended to
+`<root>/sns/<topic>.jsonl`, so the output of a run can be inspected after it finishes.
+
+Only the operations the Lambdas use are implemented; anything else raises NotImplementedError.
+"""
+import base64
+import hashlib
+import io
+import json
+import queue
+import threading
+import time
+import uuid
+from concurrent.futures import Future
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from pathlib import Path
+from unittest import mock
+from urllib.parse import unquote
+
+import boto3
+from botocore.response import StreamingBody
+
+from state_machine import ExecutionFailed, RUNTIME_ERROR, TIMEOUT, TaskFailed
+
+ACCOUNT_ID = '123456789012'
+
+
+class LocalHttpResponse:
+    def __init__(self, status_code):
+        self.status_code = status_code
+
+
+class LocalError(Exception):
+    def __init__(self, status_code, code, message):
+        super().__init__(message)
+        self.status_code = status_code
+        self.code = code
+        self.message = message
+
+
+class LocalActivity:
+    """A Step Functions activity: the state machine schedules tasks on it and activity workers poll for them."""
+    def __init__(self, arn):
+        self.arn = arn
+        self._tasks = queue.Queue()
+        self._pending = {}
+        self._closed = False
+        self._lock = threading.Lock()
+
+    def __call__(self, task_input, timeout=None):
+        token = uuid.uuid4().hex
+        future = Future()
+        with self._lock:
+            if self._closed:
+                raise ExecutionFailed(RUNTIME_ERROR, f'No worker is polling {self.arn}')
+            self._pending[token] = future
+        self._tasks.put((token, json.dumps(task_input)))
+        try:
+            return future.result(timeout)
+        except TimeoutError:
+            raise TaskFailed(TIMEOUT, f'Task was not completed within {timeout} seconds')
+        finally:
+            with self._lock:
+                self._pending.pop(token, None)
+
+    def get_task(self):
+        """Wait for a task, returning its token and input, or None once the activity is closed."""
+        while True:
+            task = self._tasks.get()
+            if task is None:
+                # wake the next waiting worker too
+                self._tasks.put(None)
+                return None
+            with self._lock:
+                if task[0] in self._pending:
+                    return task
+
+    def complete(self, token, output=None, failed=False, error=None, cause=None):
+        """Resolve a task, returning False if it is unknown or has already timed out."""
+        with self._lock:
+            future = self._pending.pop(token, None)
+        if future is None:
+            return False
+        if failed:
+            future.set_exception(TaskFailed(error or '', cause or ''))
+        else:
+            future.set_result(json.loads(output))
+        return True
+
+    def close(self):
+        """Stop handing out tasks, failing the executions still waiting on one."""
+        with self._lock:
+            self._closed = True
+            pending, self._pending = self._pending, {}
+        for future in pending.values():
+            future.set_exception(ExecutionFailed(RUNTIME_ERROR, f'No worker is polling {self.arn}'))
+        self._tasks.put(None)
+
+
+class LocalAws:
+    def __init__(self, root, region='us-east-1', latency_in_seconds=0):
+        self.root = Path(root)
+        self.region = region
+        self.latency_in_seconds = latency_in_seconds
+        self.buckets = set()
+        self.objects = {}
+        self.topics = set()
+        self.activities = {}
+        self._lock = threading.Lock()
+        self.operations = {
+            ('s3', 'CopyObject'): self.copy_object,
+            ('s3', 'GetObject'): self.get_object,
+            ('s3', 'HeadObject'): self.head_object,
+            ('s3', 'PutObject'): self.put_object,
+            ('sns', 'Publish'): self.publish,
+            ('sns', 'PublishBatch'): self.publish_batch,
+            ('stepfunctions', 'GetActivityTask'): self.get_activity_task,
+            ('stepfunctions', 'SendTaskFailure'): self.send_task_failure,
+            ('stepfunctions', 'SendTaskSuccess'): self.send_task_success,
+        }
+
+    def create_bucket(self, bucket):
+        (self.root / 's3' / bucket).mkdir(parents=True, exist_ok=True)
+        self.buckets.add(bucket)
+
+    def create_topic(self, name):
+        (self.root / 'sns').mkdir(parents=True, exist_ok=True)
+        arn = f'arn:aws:sns:{self.region}:{ACCOUNT_ID}:{name}'
+        self.topics.add(arn)
+        return arn
+
+    def create_activity(self, name):
+        arn = f'arn:aws:states:{self.region}:{ACCOUNT_ID}:activity:{name}'
+        self.activities[arn] = LocalActivity(arn)
+        return self.activities[arn]
+
+    def get_messages(self, topic_arn):
+        path = self.root / 'sns' / f'{topic_arn.split(":")[-1]}.jsonl'
+        if not path.exists():
+            return []
+        return [json.loads(line) for line in path.read_text().splitlines()]
+
+    def register(self, session):
+        session.events.register('provide-client-params', self._capture_params, unique_id='local-aws-params')
+        session.events.register('before-call', self._call, unique_id='local-aws-call')
+
+    @contextmanager
+    def install(self):
+        """Answer the calls of every boto3 session created inside the block, including the default session."""
+        local_aws = self
+
+        class LocalSession(boto3.session.Session):
+            def __init__(self, *args, **kwargs):
+                super().__init__(*args, **kwargs)
+                local_aws.register(self)
+
+        with mock.patch('boto3.session.Session', LocalSession), mock.patch('boto3.Session', LocalSession), \
+                mock.patch('boto3.DEFAULT_SESSION', None):
+            yield self
+
+    def _capture_params(self, params, context, **kwargs):
+        # the API parameters as the caller passed them, before botocore serializes them into the request
+        context['local_aws_params'] = dict(params)
+
+    def _call(self, model, context, **kwargs):
+        operation = self.operations.get((model.service_model.service_name, model.name))
+        if operation is None:
+            raise NotImplementedError(f'{model.service_model.service_name} {model.name} is not available locally')
+        if self.latency_in_seconds:
+            time.sleep(self.latency_in_seconds)
+        try:
+            status_code, parsed = 200, operation(**context['local_aws_params'])
+        except LocalError as e:
+            status_code, parsed = e.status_code, {'Error': {'Code': e.code, 'Message': e.message}}
+        parsed['ResponseMetadata'] = {'HTTPStatusCode': status_code, 'HTTPHeaders': {}, 'RetryAttempts': 0}
+        return LocalHttpResponse(status_code), parsed
+
+    def _object_path(self, bucket, key):
+        if bucket not in self.buckets:
+            raise LocalError(404, 'NoSuchBucket', f'The specified bucket does not exist: {bucket}')
+        return self.root / 's3' / bucket / key
+
+    def _put(self, bucket, key, body, content_type, metadata):
+        path = self._object_path(bucket, key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(body)
+        attributes = {
+            'ContentLength': len(body),
+            'ContentType': content_type,
+            'ETag': f'"{hashlib.md5(body).hexdigest()}"',
+            'LastModified': datetime.now(timezone.utc),
+            'Metadata': metadata,
+        }
+        with self._lock:
+            self.objects[(bucket, key)] = attributes
+        return {'ETag': attributes['ETag']}
+
+    def _get_attributes(self, bucket, key, missing_code):
+        self._object_path(bucket, key)
+        with self._lock:
+            attributes = self.objects.get((bucket, key))
+        if attributes is None:
+            raise LocalError(404, missing_code, f'The specified key does not exist: {key}')
+        return attributes
+
+    def head_object(self, Bucket, Key, **kwargs):  # noqa: N803
+        # HEAD responses have no body, so botocore reports the status code as the error code
+        return dict(self._get_attributes(Bucket, Key, '404'))
+
+    def get_object(self, Bucket, Key, **kwargs):  # noqa: N803
+        attributes = self._get_attributes(Bucket, Key, 'NoSuchKey')
+        body = self._object_path(Bucket, Key).read_bytes()
+        return {**attributes, 'Body': StreamingBody(io.BytesIO(body), len(body))}
+
+    def put_object(self, Bucket, Key, Body=b'', ContentType='binary/octet-stream', Metadata=None,  # noqa: N803
+                   ContentMD5=None, **kwargs):
+        if hasattr(Body, 'read'):
+            Body = Body.read()  # noqa: N806
+        if isinstance(Body, str):
+            Body = Body.encode()  # noqa: N806
+        if ContentMD5 is not None and ContentMD5 != base64.b64encode(hashlib.md5(Body).digest()).decode():
+            raise LocalError(400, 'BadDigest', 'The Content-MD5 you specified did not match what was received.')
+        return self._put(Bucket, Key, Body, ContentType, Metadata or {})
+
+    def copy_object(self, CopySource, Bucket, Key, MetadataDirective='COPY', ContentType=None,  # noqa: N803
+                    Metadata=None, **kwargs):
+        if isinstance(CopySource, str):
+            source_bucket, source_key = unquote(CopySource.split('?')[0]).lstrip('/').split('/', 1)
+        else:
+            source_bucket, source_key = CopySource['Bucket'], CopySource['Key']
+        source = self.get_object(source_bucket, source_key)
+        if MetadataDirective != 'REPLACE':
+            ContentType, Metadata = source['ContentType'], source['Metadata']  # noqa: N806
+        response = self._put(Bucket, Key, source['Body'].read(), ContentType or source['ContentType'], Metadata or {})
+        return {'CopyObjectResult': {'ETag': response['ETag'], 'LastModified': datetime.now(timezone.utc)}}
+
+    def _append_messages(self, topic_arn, messages):
+        if topic_arn not in self.topics:
+            raise LocalError(404, 'NotFound', 'Topic does not exist')
+        path = self.root / 'sns' / f'{topic_arn.split(":")[-1]}.jsonl'
+        with self._lock, open(path, 'a') as f:
+            for message in messages:
+                f.write(json.dumps(message) + '\n')
+
+    def publish(self, TopicArn, Message, MessageStructure=None, **kwargs):  # noqa: N803
+        if MessageStructure == 'json':
+            try:
+                structure = json.loads(Message)
+            except json.JSONDecodeError:
+                raise LocalError(400, 'InvalidParameter',
+                                 'Invalid parameter: Message Structure - JSON message body failed to parse')
+            if not isinstance(structure, dict) or 'default' not in structure:
+                raise LocalError(400, 'InvalidParameter',
+                                 'Invalid parameter: Message Structure - No default entry in JSON message body')
+            Message = structure['default']  # noqa: N806
+        message_id = str(uuid.uuid4())
+        self._append_messages(TopicArn, [{'MessageId': message_id, 'Message': Message}])
+        return {'MessageId': message_id}
+
+    def publish_batch(self, TopicArn, PublishBatchRequestEntries, **kwargs):  # noqa: N803
+        successful = [{'Id': entry['Id'], 'MessageId': str(uuid.uuid4())} for entry in PublishBatchRequestEntries]
+        self._append_messages(TopicArn, [
+            {'MessageId': result['MessageId'], 'Message': entry['Message']}
+            for entry, result in zip(PublishBatchRequestEntries, successful)
+        ])
+        return {'Successful': successful, 'Failed': []}
+
+    def _get_activity(self, arn):
+        if arn not in self.activities:
+            raise LocalError(400, 'ActivityDoesNotExist', f'Activity does not exist: {arn}')
+        return self.activities[arn]
+
+    def get_activity_task(self, activityArn, **kwargs):  # noqa: N803
+        task = self._get_activity(activityArn).get_task()
+        if task is None:
+            return {}
+        return {'taskToken': task[0], 'input': task[1]}
+
+    def _complete_task(self, token, **kwargs):
+        if not any(activity.complete(token, **kwargs) for activity in self.activities.values()):
+            raise LocalError(400, 'TaskTimedOut', 'Task Timed Out')
+        return {}
+
+    def send_task_success(self, taskToken, output, **kwargs):  # noqa: N803
+        return self._complete_task(taskToken, output=output)
+
+    def send_task_failure(self, taskToken, error=None, cause=None, **kwargs):  # noqa: N803
+        return self._complete_task(taskToken, failed=True, error=error, cause=cause)
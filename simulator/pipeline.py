@@ -0,0 +1,293 @@
+"""Run the ingest step function end to end on this machine and measure how fast granules get through it.
+
+Executes `step-function/step-function.json` with `state_machine`. Its tasks call the real verify, ingest, metadata
+construction and notify handlers in process, and the metadata-to-cmr daemon runs alongside as the activity worker.
+With `--express`, it executes `step-function/express-step-function.json` and the express handler instead.
+S3, SNS and the activity API are served by `local_aws`, and CMR by `tests/cmr_stub_server.py`. Each Lambda gets the
+CONFIG from its CloudFormation template, so a run measures what would be deployed.
+
+All handlers share one Python process, so CPU-bound work contends for the GIL in a way separate Lambda containers do
+not. Compare runs with each other rather than with production timings.
+
+    python simulator/pipeline.py --granules 500 --concurrency 50 --cmr-latency 0.2 --cmr-error-rate 0.02
+"""
+import argparse
+import contextlib
+import json
+import logging
+import math
+import os
+import random
+import re
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from unittest import mock
+
+ROOT = Path(__file__).resolve().parent.parent
+os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+os.environ.setdefault('CONFIG', '{}')
+for path in ('tests', 'metadata-to-cmr/src', 'notify/src', 'metadata-construction/src', 'ingest/src', 'verify/src',
+             'express/src', 'common/src'):
+    sys.path.insert(0, str(ROOT / path))
+
+import aws_clients  # noqa: E402
+import cmr  # noqa: E402
+import cmr_async  # noqa: E402
+import daemon  # noqa: E402
+import express  # noqa: E402
+import ingest  # noqa: E402
+import metadata_construction  # noqa: E402
+import notify  # noqa: E402
+import verify  # noqa: E402
+from cmr_stub_server import run_server  # noqa: E402
+from local_aws import ACCOUNT_ID, LocalAws  # noqa: E402
+from state_machine import StateMachine, TaskFailed  # noqa: E402
+
+REGION = 'us-east-1'
+SOURCE_BUCKET = 'local-source'
+CMR_TOKEN = 'local-cmr-token'
+BROWSE_SIZE = 16 * 1024
+PERCENTILES = [50, 90, 99]
+
+
+class LambdaFunction:
+    """Calls a Lambda handler as a Task state would, failing the task the way Lambda reports an unhandled error."""
+    def __init__(self, handler):
+        self.handler = handler
+
+    def __call__(self, event, timeout=None):
+        # events and results cross a JSON boundary, as they do between Step Functions and Lambda
+        event = json.loads(json.dumps(event))
+        try:
+            result = self.handler(event, None)
+        except Exception as e:
+            error = type(e).__name__
+            raise TaskFailed(error, json.dumps({'errorMessage': str(e), 'errorType': error})) from e
+        return json.loads(json.dumps(result))
+
+
+class DaemonContext:
+    def get_remaining_time_in_millis(self):
+        return 900000
+
+
+def substitute(template, parameters):
+    return re.sub(r'\$\{(\w+)\}', lambda match: parameters[match.group(1)], template)
+
+
+def get_lambda_config(component, parameters):
+    """Read the CONFIG of a component's Lambda from its CloudFormation template, filling in the template parameters."""
+    lines = (ROOT / component / 'cloudformation.yaml').read_text().splitlines()
+    start = next(index for index, line in enumerate(lines) if line.strip() == 'CONFIG: !Sub |-')
+    indent = len(lines[start]) - len(lines[start].lstrip())
+    body = []
+    for line in lines[start + 1:]:
+        if line.strip() and len(line) - len(line.lstrip()) <= indent:
+            break
+        body.append(line)
+    return json.loads(substitute('\n'.join(body), parameters))
+
+
+def get_definition(resource_arns, file_name='step-function.json'):
+    return json.loads(substitute((ROOT / 'step-function' / file_name).read_text(), resource_arns))
+
+
+def create_granules(aws, count, product_size, response_topic):
+    """Upload `count` synthetic granules to the source bucket, returning the ingest message for each."""
+    sds_metadata = json.loads((ROOT / 'tests' / 'data' / 'granule1' / 'sds_metadata.json').read_text())
+    messages = []
+    for index in range(count):
+        product_name = f'{sds_metadata["label"]}-{index:06d}'
+        files = {
+            'Metadata': (f'{product_name}.json', json.dumps({**sds_metadata, 'label': product_name}).encode()),
+            'Browse': (f'{product_name}.png', bytes(BROWSE_SIZE)),
+            'Product': (f'{product_name}.nc', bytes(product_size)),
+        }
+        for key, body in files.values():
+            aws.put_object(Bucket=SOURCE_BUCKET, Key=key, Body=body)
+        messages.append({
+            'ProductName': product_name,
+            'DeliveryTime': '2024-01-01T00:00:00.000000',
+            'ResponseTopic': {'Region': REGION, 'Arn': response_topic},
+            **{name: {'Bucket': SOURCE_BUCKET, 'Key': key} for name, (key, _) in files.items()},
+        })
+    return messages
+
+
+def cold_start(stack):
+    # each run starts from cold containers, without caches or CMR backpressure left over from a previous run
+    stack.enter_context(mock.patch.multiple(aws_clients, _session=None, _clients={}, _resources={}))
+    stack.enter_context(mock.patch.object(verify, 'TOPIC_CACHE', verify.TopicCache()))
+    for name, value in [('TOKEN_CACHE', cmr.TokenCache()), ('RATE_LIMITER', cmr.RateLimiter()),
+                        ('CIRCUIT_BREAKER', cmr.CircuitBreaker())]:
+        stack.enter_context(mock.patch.object(cmr, name, value))
+        if hasattr(cmr_async, name):
+            stack.enter_context(mock.patch.object(cmr_async, name, value))
+
+
+def run_pipeline(work_dir, granules, concurrency, product_size=1024 * 1024, aws_latency_in_seconds=0,
+                 cmr_options=None, retry_interval_scale=1.0, express_pipeline=False):
+    """Run `granules` synthetic granules through the step function, `concurrency` executions at a time.
+
+    Returns the executions, as `StateMachine.run` reports them, and the seconds the whole workload took.
+    """
+    aws = LocalAws(work_dir, REGION, aws_latency_in_seconds)
+    with contextlib.ExitStack() as stack:
+        stack.enter_context(aws.install())
+        cold_start(stack)
+        # verify loads its JSON schemas relative to its own directory, as in the Lambda runtime
+        stack.enter_context(contextlib.chdir(ROOT / 'verify' / 'src'))
+        cmr_server = stack.enter_context(run_server(CMR_TOKEN, **(cmr_options or {})))
+
+        parameters = {
+            'Name': 'local-ingest',
+            'AuxBucket': 'local-aux',
+            'PublicBucket': 'local-public',
+            'PrivateBucket': 'local-private',
+            'DistributionBaseUrl': 'https://local-distribution/download',
+            'BrowseBaseUrl': 'https://local-distribution/browse',
+            'DefaultResponseTopicArn': aws.create_topic('local-default-responses'),
+            'DefaultResponseTopicRegion': REGION,
+            'ActivityArn': aws.create_activity('local-metadata-to-cmr').arn,
+            'CachedCmrTokenKey': 'cached-cmr-auth-token',
+            'CmrTokenLambda': 'local-cmr-token',
+            'CmrGranuleUrl': cmr_server.granule_url,
+        }
+        for bucket in (SOURCE_BUCKET, parameters['AuxBucket'], parameters['PublicBucket'],
+                       parameters['PrivateBucket']):
+            aws.create_bucket(bucket)
+        aws.put_object(Bucket=parameters['AuxBucket'], Key=parameters['CachedCmrTokenKey'], Body=CMR_TOKEN.encode())
+
+        stack.enter_context(mock.patch.object(verify, 'CONFIG', get_lambda_config('verify', parameters)))
+        stack.enter_context(mock.patch.object(ingest, 'config', get_lambda_config('ingest', parameters)))
+        stack.enter_context(mock.patch.object(metadata_construction, 'CONFIG',
+                                              get_lambda_config('metadata-construction', parameters)))
+        stack.enter_context(mock.patch.object(notify, 'CONFIG', get_lambda_config('notify', parameters)))
+        stack.enter_context(mock.patch.object(daemon, 'CONFIG', get_lambda_config('metadata-to-cmr', parameters)))
+        stack.enter_context(mock.patch.object(express, 'CONFIG', get_lambda_config('express', parameters)))
+
+        handlers = {
+            'VerifyLambdaArn': verify.lambda_handler,
+            'IngestLambdaArn': ingest.lambda_handler,
+            'MetadataConstructionLambdaArn': metadata_construction.lambda_handler,
+            'NotifyLambdaArn': notify.lambda_handler,
+            'ExpressLambdaArn': express.lambda_handler,
+        }
+        resource_arns = {name: f'arn:aws:lambda:{REGION}:{ACCOUNT_ID}:function:{name}' for name in handlers}
+        resource_arns['CmrActivity'] = parameters['ActivityArn']
+        resources = {resource_arns[name]: LambdaFunction(handler) for name, handler in handlers.items()}
+        resources[parameters['ActivityArn']] = aws.activities[parameters['ActivityArn']]
+        definition_file = 'express-step-function.json' if express_pipeline else 'step-function.json'
+        state_machine = StateMachine(get_definition(resource_arns, definition_file), resources, retry_interval_scale)
+
+        messages = create_granules(aws, granules, product_size, aws.create_topic('local-responses'))
+
+        activity = aws.activities[parameters['ActivityArn']]
+        with ThreadPoolExecutor(max_workers=1) as daemon_executor:
+            daemon_future = daemon_executor.submit(daemon.lambda_handler, None, DaemonContext())
+            # if the daemon stops early, fail the executions waiting on it rather than waiting out their retries
+            daemon_future.add_done_callback(lambda _: activity.close())
+            try:
+                start = time.perf_counter()
+                with ThreadPoolExecutor(max_workers=concurrency) as executor:
+                    executions = list(executor.map(state_machine.run, messages))
+                elapsed_in_seconds = time.perf_counter() - start
+            finally:
+                activity.close()
+            daemon_future.result()
+
+    return executions, elapsed_in_seconds
+
+
+def percentile(values, percent):
+    ordered = sorted(values)
+    return ordered[max(math.ceil(len(ordered) * percent / 100) - 1, 0)]
+
+
+def get_latency_summary(durations):
+    summary = {f'P{percent}': percentile(durations, percent) for percent in PERCENTILES}
+    summary['Max'] = max(durations)
+    return summary
+
+
+def summarize(executions, elapsed_in_seconds):
+    states = {}
+    for execution in executions:
+        for record in execution['States']:
+            state = states.setdefault(record['Name'], {'Count': 0, 'Retries': 0, 'Errors': 0, 'Durations': []})
+            state['Count'] += 1
+            state['Retries'] += max(record['Attempts'] - 1, 0)
+            state['Errors'] += record['Error'] is not None
+            state['Durations'].append(record['Duration'])
+
+    return {
+        'Granules': len(executions),
+        'Succeeded': sum(execution['Status'] == 'SUCCEEDED' for execution in executions),
+        'Failed': sum(execution['Status'] == 'FAILED' for execution in executions),
+        'ElapsedSeconds': elapsed_in_seconds,
+        'GranulesPerSecond': len(executions) / elapsed_in_seconds,
+        'Executions': get_latency_summary([execution['Duration'] for execution in executions]),
+        'States': {
+            name: {**{key: value for key, value in state.items() if key != 'Durations'},
+                   **get_latency_summary(state['Durations'])}
+            for name, state in states.items()
+        },
+    }
+
+
+def print_summary(summary):
+    columns = ''.join(f'{f"p{percent} (ms)":>11}' for percent in PERCENTILES)
+    print(f'{"state":<22}{"count":>7}{"retries":>9}{"errors":>8}{columns}{"max (ms)":>11}')
+    executions = {'Count': summary['Granules'], 'Retries': '', 'Errors': '', **summary['Executions']}
+    rows = [*summary['States'].items(), ('execution', executions)]
+    for name, state in rows:
+        latencies = ''.join(f'{state[f"P{percent}"] * 1000:>11.1f}' for percent in PERCENTILES)
+        print(f'{name:<22}{state["Count"]:>7}{state["Retries"]:>9}{state["Errors"]:>8}{latencies}'
+              f'{state["Max"] * 1000:>11.1f}')
+    print(f'\n{summary["Granules"]} granules in {summary["ElapsedSeconds"]:.2f} s, '
+          f'{summary["GranulesPerSecond"]:.1f} granules/s: {summary["Succeeded"]} succeeded, '
+          f'{summary["Failed"]} failed')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--granules', type=int, default=200, help='Granules in the synthetic workload')
+    parser.add_argument('--concurrency', type=int, default=25, help='Step function executions running at once')
+    parser.add_argument('--product-size', type=int, default=1024 * 1024, help='Bytes in each product file')
+    parser.add_argument('--aws-latency', type=float, default=0, help='Seconds added to every S3, SNS and activity call')
+    parser.add_argument('--cmr-latency', type=float, default=0, help='Seconds CMR takes to answer each request')
+    parser.add_argument('--cmr-error-rate', type=float, default=0, help='Fraction of CMR requests answered with 503')
+    parser.add_argument('--retry-interval-scale', type=float, default=1.0,
+                        help='Multiplier for the waits between step function retries')
+    parser.add_argument('--express', action='store_true',
+                        help='Run the express step function, with verify, ingest and metadata construction in one task')
+    parser.add_argument('--seed', type=int, default=0, help='Seed for CMR errors and retry jitter')
+    parser.add_argument('--work-dir', help='Directory for the local S3 and SNS files; a temporary one by default')
+    parser.add_argument('--output', help='Also write the summary to this JSON file, to compare runs')
+    parser.add_argument('--log-level', default='ERROR', help='Level for the handlers\' log messages')
+    args = parser.parse_args()
+
+    for name, value in [('AWS_ACCESS_KEY_ID', 'local'), ('AWS_SECRET_ACCESS_KEY', 'local'),
+                        ('AWS_EC2_METADATA_DISABLED', 'true')]:
+        os.environ.setdefault(name, value)
+    logging.getLogger().setLevel(args.log_level)
+    random.seed(args.seed)
+    cmr_options = {'latency_in_seconds': args.cmr_latency, 'error_rate': args.cmr_error_rate, 'seed': args.seed}
+
+    with contextlib.ExitStack() as stack:
+        work_dir = args.work_dir or stack.enter_context(tempfile.TemporaryDirectory())
+        executions, elapsed_in_seconds = run_pipeline(work_dir, args.granules, args.concurrency, args.product_size,
+                                                      args.aws_latency, cmr_options, args.retry_interval_scale,
+                                                      args.express)
+
+    summary = summarize(executions, elapsed_in_seconds)
+    print_summary(summary)
+    if args.output:
+        Path(args.output).write_text(json.dumps(summary, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,211 @@
+"""Run a Step Functions state machine definition in process.
+
+Interprets the part of the Amazon States Language that `step-function/step-function.json` uses: Task, Choice, Pass,
+Succeed and Fail states; InputPath, ResultPath and OutputPath given as `$` or `$.field.field`; and Task Retry and
+Catch, with the Step Functions defaults for IntervalSeconds, MaxAttempts and BackoffRate.
+
+Task resources are callables, looked up by the state's `Resource`, that take the task input and the state's
+`TimeoutSeconds` and return the task result. They raise `TaskFailed` to fail the task with an error name and cause.
+"""
+import copy
+import operator
+import time
+
+ALL_ERRORS = 'States.ALL'
+NO_CHOICE_MATCHED = 'States.NoChoiceMatched'
+RUNTIME_ERROR = 'States.Runtime'
+TASK_FAILED = 'States.TaskFailed'
+TIMEOUT = 'States.Timeout'
+
+CHOICE_COMPARISONS = {
+    'StringEquals': operator.eq,
+    'NumericEquals': operator.eq,
+    'BooleanEquals': operator.eq,
+    'NumericLessThan': operator.lt,
+    'NumericLessThanEquals': operator.le,
+    'NumericGreaterThan': operator.gt,
+    'NumericGreaterThanEquals': operator.ge,
+}
+
+_MISSING = object()
+
+
+class TaskFailed(Exception):
+    def __init__(self, error, cause):
+        super().__init__(f'{error}: {cause}')
+        self.error = error
+        self.cause = cause
+
+
+class ExecutionFailed(Exception):
+    def __init__(self, error, cause):
+        super().__init__(f'{error}: {cause}')
+        self.error = error
+        self.cause = cause
+
+
+def split_path(path):
+    if path == '$':
+        return []
+    if not path.startswith('$.'):
+        raise ValueError(f'Unsupported path {path}')
+    return path[2:].split('.')
+
+
+def get_path(data, path):
+    if path is None:
+        return {}
+    for name in split_path(path):
+        try:
+            data = data[name]
+        except (KeyError, TypeError):
+            raise ExecutionFailed(RUNTIME_ERROR, f'Invalid path {path}: the input does not contain {name}')
+    return data
+
+
+def set_path(data, path, value):
+    if path is None:
+        return data
+    names = split_path(path)
+    if not names:
+        return value
+    data = copy.deepcopy(data)
+    target = data
+    for name in names[:-1]:
+        target = target.setdefault(name, {})
+    target[names[-1]] = value
+    return data
+
+
+def matches(error, error_equals):
+    # States.ALL catches every error except the runtime errors that end an execution
+    return error in error_equals or (ALL_ERRORS in error_equals and error != RUNTIME_ERROR)
+
+
+def get_retry_interval(retrier, retries):
+    interval = retrier.get('IntervalSeconds', 1) * retrier.get('BackoffRate', 2.0) ** retries
+    return min(interval, retrier.get('MaxDelaySeconds', interval))
+
+
+def evaluate_choice_rule(rule, data):
+    if 'And' in rule:
+        return all(evaluate_choice_rule(sub_rule, data) for sub_rule in rule['And'])
+    if 'Or' in rule:
+        return any(evaluate_choice_rule(sub_rule, data) for sub_rule in rule['Or'])
+    if 'Not' in rule:
+        return not evaluate_choice_rule(rule['Not'], data)
+
+    try:
+        value = get_path(data, rule['Variable'])
+    except ExecutionFailed:
+        value = _MISSING
+    if 'IsPresent' in rule:
+        return (value is not _MISSING) == rule['IsPresent']
+    for name, compare in CHOICE_COMPARISONS.items():
+        if name in rule:
+            return value is not _MISSING and compare(value, rule[name])
+    raise ValueError(f'Unsupported choice rule {rule}')
+
+
+class StateMachine:
+    """A state machine definition with the resources its Task states call.
+
+    `retry_interval_scale` multiplies the waits between retries, so a definition with long backoffs can be exercised
+    quickly; 1 keeps the waits Step Functions would use.
+    """
+    def __init__(self, definition, resources, retry_interval_scale=1.0, sleep=time.sleep, clock=time.perf_counter):
+        self.definition = definition
+        self.resources = resources
+        self.retry_interval_scale = retry_interval_scale
+        self._sleep = sleep
+        self._clock = clock
+
+    def run(self, execution_input):
+        """Run one execution, returning its status, its output or error, and a record of each state it entered."""
+        start = self._clock()
+        history = []
+        data = execution_input
+        name = self.definition['StartAt']
+        try:
+            while name is not None:
+                state = self.definition['States'][name]
+                record = {'Name': name, 'Type': state['Type'], 'Attempts': 0, 'Error': None}
+                history.append(record)
+                state_start = self._clock()
+                try:
+                    data, name = self.run_state(state, data, record)
+                finally:
+                    record['Duration'] = self._clock() - state_start
+        except ExecutionFailed as e:
+            execution = {'Status': 'FAILED', 'Error': e.error, 'Cause': e.cause}
+        else:
+            execution = {'Status': 'SUCCEEDED', 'Output': data}
+        execution['Duration'] = self._clock() - start
+        execution['States'] = history
+        return execution
+
+    def run_state(self, state, data, record):
+        """Run one state, returning its output and the name of the next state, which is None after the last one."""
+        next_name = None if state.get('End') else state.get('Next')
+        state_type = state['Type']
+
+        if state_type == 'Fail':
+            raise ExecutionFailed(state.get('Error'), state.get('Cause'))
+
+        effective_input = get_path(data, state.get('InputPath', '$'))
+
+        if state_type == 'Choice':
+            next_name = self.choose(state, effective_input)
+            return get_path(effective_input, state.get('OutputPath', '$')), next_name
+        if state_type == 'Succeed':
+            return get_path(effective_input, state.get('OutputPath', '$')), None
+        if state_type == 'Pass':
+            result = state.get('Result', effective_input)
+        elif state_type == 'Task':
+            try:
+                result = self.run_task(state, effective_input, record)
+            except TaskFailed as e:
+                record['Error'] = e.error
+                catcher = next((c for c in state.get('Catch', []) if matches(e.error, c['ErrorEquals'])), None)
+                if catcher is None:
+                    raise ExecutionFailed(e.error, e.cause)
+                error_output = {'Error': e.error, 'Cause': e.cause}
+                return set_path(data, catcher.get('ResultPath', '$'), error_output), catcher['Next']
+        else:
+            raise ValueError(f'Unsupported state type {state_type}')
+
+        output = set_path(data, state.get('ResultPath', '$'), result)
+        return get_path(output, state.get('OutputPath', '$')), next_name
+
+    def run_task(self, state, task_input, record):
+        resource = self.resources[state['Resource']]
+        retries = [0] * len(state.get('Retry', []))
+        while True:
+            record['Attempts'] += 1
+            try:
+                return resource(task_input, state.get('TimeoutSeconds'))
+            except ExecutionFailed:
+                raise
+            except TaskFailed as e:
+                error = e
+            except Exception as e:
+                error = TaskFailed(TASK_FAILED, str(e))
+
+            # the first retrier matching the error decides whether it is retried, once its attempts are used up too
+            index = next((i for i, r in enumerate(state.get('Retry', [])) if matches(error.error, r['ErrorEquals'])),
+                         None)
+            if index is None:
+                raise error
+            retrier = state['Retry'][index]
+            if retries[index] >= retrier.get('MaxAttempts', 3):
+                raise error
+            self._sleep(get_retry_interval(retrier, retries[index]) * self.retry_interval_scale)
+            retries[index] += 1
+
+    def choose(self, state, data):
+        for rule in state['Choices']:
+            if evaluate_choice_rule(rule, data):
+                return rule['Next']
+        if 'Default' in state:
+            return state['Default']
+        raise ExecutionFailed(NO_CHOICE_MATCHED, 'No choice rule matched and there is no Default')
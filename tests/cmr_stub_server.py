@@ -0,0 +1,123 @@
+"""A local stand-in for the CMR ingest granule API, for tests and trying out bulk publishing without CMR.
+
+Accepts `PUT /ingest/providers/<provider>/granules/<native-id>` and answers like CMR with a concept-id and revision-id.
+Requests without the expected token get a 401, and `failures` can script error responses for particular granules.
+`latency_in_seconds` delays every response and `error_rate` answers that fraction of requests with `error_status`,
+to stand in for a slow or overloaded CMR.
+
+    python tests/cmr_stub_server.py --port 8080 --token myToken --latency 0.2 --error-rate 0.05
+"""
+import argparse
+import json
+import random
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class CmrRequestHandler(BaseHTTPRequestHandler):
+    def send_json(self, status, body):
+        content = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def do_PUT(self):  # noqa: N802
+        content = self.rfile.read(int(self.headers['Content-Length']))
+        if self.server.latency_in_seconds:
+            time.sleep(self.server.latency_in_seconds)
+        parts = self.path.strip('/').split('/')
+        if len(parts) != 5 or parts[:2] != ['ingest', 'providers'] or parts[3] != 'granules':
+            self.send_json(404, {'errors': [f'Not found: {self.path}']})
+            return
+        provider, native_id = parts[2], parts[4]
+        self.server.record(native_id, content)
+
+        if self.server.token is not None and self.headers.get('Authorization') != self.server.token:
+            self.send_json(401, {'errors': ['Token does not exist']})
+            return
+        failure = self.server.next_failure(native_id)
+        if failure is None and self.server.is_random_failure():
+            failure = self.server.error_status
+        if failure is not None:
+            self.send_json(failure, {'errors': [f'Scripted {failure} for {native_id}']})
+            return
+        self.send_json(201, self.server.publish(provider, native_id))
+
+    def log_message(self, format, *args):  # noqa: A002
+        pass
+
+
+class CmrStubServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, token=None, failures=None, latency_in_seconds=0, error_rate=0, error_status=503,
+                 seed=None):
+        super().__init__(address, CmrRequestHandler)
+        self.token = token
+        # native id -> list of status codes to answer with, one per request, before succeeding
+        self.failures = {native_id: list(statuses) for native_id, statuses in (failures or {}).items()}
+        self.latency_in_seconds = latency_in_seconds
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.random = random.Random(seed)
+        self.requests = []
+        self.granules = {}
+        self.lock = threading.Lock()
+
+    def record(self, native_id, content):
+        with self.lock:
+            self.requests.append((native_id, content))
+
+    def next_failure(self, native_id):
+        with self.lock:
+            statuses = self.failures.get(native_id)
+            return statuses.pop(0) if statuses else None
+
+    def is_random_failure(self):
+        with self.lock:
+            return self.random.random() < self.error_rate
+
+    def publish(self, provider, native_id):
+        with self.lock:
+            concept_id, revision_id = self.granules.get(native_id, (f'G{len(self.granules) + 1}-{provider}', 0))
+            self.granules[native_id] = (concept_id, revision_id + 1)
+            return {'concept-id': concept_id, 'revision-id': revision_id + 1}
+
+    @property
+    def granule_url(self):
+        return f'http://{self.server_address[0]}:{self.server_address[1]}/ingest/providers/ASF/granules/'
+
+
+@contextmanager
+def run_server(token=None, failures=None, port=0, **kwargs):
+    server = CmrStubServer(('127.0.0.1', port), token, failures, **kwargs)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        yield server
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--token', help='Token to require in the Authorization header')
+    parser.add_argument('--latency', type=float, default=0, help='Seconds to wait before answering each request')
+    parser.add_argument('--error-rate', type=float, default=0, help='Fraction of requests to answer with an error')
+    parser.add_argument('--error-status', type=int, default=503, help='Status code of those errors')
+    args = parser.parse_args()
+
+    with run_server(args.token, port=args.port, latency_in_seconds=args.latency, error_rate=args.error_rate,
+                    error_status=args.error_status) as server:
+        print(f'Serving {server.granule_url}', flush=True)
+        threading.Event().wait()
+
+
+if __name__ == '__main__':
+    main()
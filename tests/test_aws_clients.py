@@ -0,0 +1,46 @@
+import threading
+
+import aws_clients
+
+
+def test_get_client():
+    client = aws_clients.get_client('sqs', region_name='us-west-2')
+    assert aws_clients.get_client('sqs', region_name='us-west-2') is client
+    assert client.meta.region_name == 'us-west-2'
+    assert aws_clients.get_client('sqs', region_name='us-east-1') is not client
+
+    configured = aws_clients.get_client('sqs', region_name='us-west-2', max_pool_connections=32)
+    assert configured is not client
+    assert configured.meta.config.max_pool_connections == 32
+
+
+def test_get_client_threads():
+    clients = []
+    threads = [
+        threading.Thread(target=lambda: clients.append(aws_clients.get_client('sns', region_name='eu-west-1')))
+        for _ in range(8)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len({id(client) for client in clients}) == 1
+
+
+def test_lazy_client(mocker):
+    mocker.patch('aws_clients.get_client', wraps=aws_clients.get_client)
+    lazy_client = aws_clients.LazyClient('sqs', region_name='us-west-2', max_pool_connections=16)
+    aws_clients.get_client.assert_not_called()
+
+    assert lazy_client.meta.region_name == 'us-west-2'
+    aws_clients.get_client.assert_called_once_with('sqs', 'us-west-2', max_pool_connections=16)
+    assert lazy_client.meta is aws_clients.get_client('sqs', 'us-west-2', max_pool_connections=16).meta
+
+
+def test_create_resource(mocker):
+    mocker.patch.multiple(aws_clients, _session=None, _clients={}, _resources={})
+    resource = aws_clients.create_resource('s3', region_name='us-west-2')
+    other = aws_clients.create_resource('s3', region_name='us-west-2')
+    assert resource is not other
+    assert resource.meta.client.meta.region_name == 'us-west-2'
+    assert aws_clients._session is not None
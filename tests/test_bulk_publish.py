@@ -0,0 +1,97 @@
+import asyncio
+import json
+import os
+import subprocess
+import sys
+from pathlib import Path
+
+import httpx
+import pytest
+
+import bulk_publish
+import cmr
+import cmr_async
+from cmr_stub_server import run_server
+
+
+@pytest.fixture
+def token_cache(monkeypatch):
+    token_cache = cmr.TokenCache()
+    token_cache.token = 'goodToken'
+    monkeypatch.setattr(cmr_async, 'TOKEN_CACHE', token_cache)
+    return token_cache
+
+
+def get_metadata_content(granule_ur):
+    return json.dumps({'GranuleUR': granule_ur, 'MetadataSpecification': {'Version': '1.6.5'}})
+
+
+@pytest.fixture
+def s3_documents(mocker):
+    async def get_file_content_from_s3(bucket, key, s3_client):
+        return get_metadata_content(key[:-len('.umm.json')])
+
+    mocker.patch('cmr_async.get_file_content_from_s3', side_effect=get_file_content_from_s3)
+
+
+def test_is_retryable():
+    request = httpx.Request('PUT', 'https://cmr.earthdata.nasa.gov/')
+    assert bulk_publish.is_retryable(
+        httpx.HTTPStatusError('', request=request, response=httpx.Response(503, request=request))
+    )
+    assert not bulk_publish.is_retryable(
+        httpx.HTTPStatusError('', request=request, response=httpx.Response(400, request=request))
+    )
+    assert bulk_publish.is_retryable(httpx.ConnectError('refused'))
+    assert bulk_publish.is_retryable(cmr.CMR_UNAVAILABLE('paused'))
+    assert not bulk_publish.is_retryable(KeyError('GranuleUR'))
+
+
+def test_publish(token_cache, s3_documents, mocker):
+    keys = [f'granule{n}.umm.json' for n in range(5)]
+    published = []
+
+    with run_server(token='goodToken', failures={'granule1': [503], 'granule3': [400], 'granule4': [503, 503]}) \
+            as server:
+        async def publish():
+            async with httpx.AsyncClient() as client:
+                return await bulk_publish.publish(client, 'myBucket', keys, {'granule_url': server.granule_url},
+                                                  mocker.MagicMock(), max_in_flight=2, submission_size=2, max_rounds=2,
+                                                  backoff_in_seconds=0, on_result=published.append)
+
+        results = asyncio.run(publish())
+
+    assert results == {
+        'granule0.umm.json': {'Key': 'granule0.umm.json', 'ConceptId': server.granules['granule0'][0]},
+        'granule1.umm.json': {'Key': 'granule1.umm.json', 'ConceptId': server.granules['granule1'][0]},
+        'granule2.umm.json': {'Key': 'granule2.umm.json', 'ConceptId': server.granules['granule2'][0]},
+        'granule3.umm.json': {'Key': 'granule3.umm.json', 'Error': mocker.ANY},
+        'granule4.umm.json': {'Key': 'granule4.umm.json', 'Error': mocker.ANY},
+    }
+    assert results['granule3.umm.json']['Error'].startswith("HTTPStatusError: Client error '400 Bad Request'")
+    assert results['granule4.umm.json']['Error'].startswith("HTTPStatusError: Server error '503 Service Unavailable'")
+    assert sorted(result['Key'] for result in published) == keys
+    assert sorted(native_id for native_id, _ in server.requests) == \
+        ['granule0', 'granule1', 'granule1', 'granule2', 'granule3', 'granule4', 'granule4']
+
+
+def test_get_unpublished(tmp_path):
+    results_file = tmp_path / 'results.jsonl'
+    results_file.write_text(
+        '{"Key": "a.umm.json", "ConceptId": "G1-ASF"}\n'
+        '{"Key": "b.umm.json", "Error": "HTTPStatusError: 400"}\n'
+        '{"Key": "c.umm.json", "Error": "HTTPStatusError: 503"}\n'
+        '{"Key": "c.umm.json", "ConceptId": "G2-ASF"}\n'
+    )
+    keys = ['a.umm.json', 'b.umm.json', 'c.umm.json', 'd.umm.json']
+
+    assert bulk_publish.get_unpublished(keys, str(results_file)) == ['b.umm.json', 'd.umm.json']
+    assert bulk_publish.get_unpublished(keys, str(tmp_path / 'missing.jsonl')) == keys
+
+
+def test_command_line_from_repository_root():
+    # run as the README does, without the PYTHONPATH the tests are run with
+    env = {key: value for key, value in os.environ.items() if key != 'PYTHONPATH'}
+    result = subprocess.run([sys.executable, 'metadata-to-cmr/src/bulk_publish.py', '--help'],
+                            cwd=Path(__file__).resolve().parent.parent, env=env, capture_output=True, text=True)
+    assert result.returncode == 0, result.stderr
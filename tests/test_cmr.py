@@ -0,0 +1,392 @@
+import io
+import json
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+
+import boto3
+import botocore
+import pytest
+from botocore.stub import Stubber
+
+import cmr
+
+
+@pytest.fixture
+def cmr_config():
+    return {
+        'granule_url': 'https://cmr.earthdata.nasa.gov/ingest/providers/ASF/granules/',
+        'cached_token': {'bucket': 'myBucket', 'key': 'myKey'},
+        'cmr_token_lambda': 'myLambda',
+        'token_refresh_margin_in_seconds': 300,
+    }
+
+
+def test_get_cached_token_and_expiry(mocker):
+    s3 = mocker.MagicMock()
+    s3.Object.return_value.get.return_value = {
+        'Body': io.BytesIO(b'myToken'),
+        'Metadata': {'expires-at': '2024-01-01T12:00:00+00:00'},
+    }
+    assert cmr.get_cached_token_and_expiry({'bucket': 'myBucket', 'key': 'myKey'}, s3) == \
+        (b'myToken', datetime(2024, 1, 1, 12, tzinfo=timezone.utc))
+    s3.Object.assert_called_once_with('myBucket', 'myKey')
+
+    s3.Object.return_value.get.return_value = {'Body': io.BytesIO(b'myToken'), 'Metadata': {}}
+    assert cmr.get_cached_token_and_expiry({'bucket': 'myBucket', 'key': 'myKey'}, s3) == (b'myToken', None)
+
+    s3.Object.return_value.get.side_effect = Exception('NoSuchKey')
+    assert cmr.get_cached_token_and_expiry({'bucket': 'myBucket', 'key': 'myKey'}, s3) == (None, None)
+
+
+def test_token_cache_is_fresh():
+    token_cache = cmr.TokenCache()
+    assert not token_cache.is_fresh()
+
+    token_cache.token = b'myToken'
+    assert token_cache.is_fresh(300)
+
+    token_cache.expires_at = datetime.now(timezone.utc) + timedelta(minutes=10)
+    assert token_cache.is_fresh(300)
+    assert not token_cache.is_fresh(900)
+
+    token_cache.expires_at = datetime.now(timezone.utc) - timedelta(minutes=10)
+    assert not token_cache.is_fresh()
+
+
+def test_token_cache_get_refreshes_ahead_of_expiry(cmr_config, mocker):
+    soon = datetime.now(timezone.utc) + timedelta(minutes=2)
+    later = datetime.now(timezone.utc) + timedelta(hours=1)
+    mocker.patch('cmr.get_cached_token_and_expiry', side_effect=[(b'oldToken', soon), (b'newToken', later)])
+    lamb = mocker.patch('cmr.lambda_client')
+
+    token_cache = cmr.TokenCache()
+    assert token_cache.get(cmr_config, None) == b'newToken'
+    lamb.invoke.assert_called_once_with(FunctionName='myLambda')
+
+    assert token_cache.get(cmr_config, None) == b'newToken'
+    assert cmr.get_cached_token_and_expiry.call_count == 2
+
+
+def test_token_cache_get_uses_token_refreshed_by_another_container(cmr_config, mocker):
+    later = datetime.now(timezone.utc) + timedelta(hours=1)
+    mocker.patch('cmr.get_cached_token_and_expiry', return_value=(b'newToken', later))
+    mocker.patch('cmr.lambda_client')
+
+    token_cache = cmr.TokenCache()
+    token_cache.token = b'oldToken'
+    token_cache.expires_at = datetime.now(timezone.utc)
+
+    assert token_cache.get(cmr_config, None) == b'newToken'
+    cmr.lambda_client.invoke.assert_not_called()
+
+
+def test_token_cache_refresh_is_single_flight(cmr_config, mocker):
+    later = datetime.now(timezone.utc) + timedelta(hours=1)
+    cached_tokens = [(b'expiredToken', None)]
+
+    def invoke(FunctionName):  # noqa: N803
+        time.sleep(0.05)
+        cached_tokens.append((b'newToken', later))
+
+    mocker.patch('cmr.get_cached_token_and_expiry', side_effect=lambda config, s3: cached_tokens[-1])
+    lamb = mocker.patch('cmr.lambda_client')
+    lamb.invoke.side_effect = invoke
+
+    token_cache = cmr.TokenCache()
+    token_cache.token = b'expiredToken'
+    results = []
+    threads = [
+        threading.Thread(target=lambda: results.append(token_cache.refresh(cmr_config, None, b'expiredToken')))
+        for _ in range(5)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert results == [b'newToken'] * 5
+    lamb.invoke.assert_called_once_with(FunctionName='myLambda')
+
+
+def test_push_granule_metadata_to_cmr(cmr_config, monkeypatch, mocker):
+    token_cache = cmr.TokenCache()
+    token_cache.token = b'expiredToken'
+    monkeypatch.setattr(cmr, 'TOKEN_CACHE', token_cache)
+    mocker.patch.object(token_cache, 'refresh', return_value=b'newToken')
+
+    responses = [mocker.MagicMock(status_code=401), mocker.MagicMock(status_code=200)]
+    responses[1].json.return_value = {'concept-id': 'G123-ASF'}
+    session = mocker.MagicMock()
+    session.put.side_effect = responses
+    metadata_content = '{"GranuleUR": "granule1", "MetadataSpecification": {"Version": "1.6.5"}}'
+
+    assert cmr.push_granule_metadata_to_cmr(session, metadata_content, cmr_config, None) == {'concept-id': 'G123-ASF'}
+    token_cache.refresh.assert_called_once_with(cmr_config, None, rejected_token=b'expiredToken')
+    assert [call.kwargs['headers']['Authorization'] for call in session.put.call_args_list] == \
+        [b'expiredToken', b'newToken']
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_rate_limiter():
+    clock = FakeClock()
+    rate_limiter = cmr.RateLimiter(clock)
+    assert rate_limiter.reserve() == 0
+
+    rate_limiter.configure(requests_per_second=10, burst=2, min_requests_per_second=1)
+    assert rate_limiter.reserve() == 0
+    assert rate_limiter.reserve() == 0
+    assert rate_limiter.reserve() == pytest.approx(0.1)
+    assert rate_limiter.reserve() == pytest.approx(0.2)
+
+    clock.now = 1.0
+    assert rate_limiter.reserve() == 0
+
+    rate_limiter.throttled(retry_after_in_seconds=3)
+    assert rate_limiter.rate == 5
+    assert rate_limiter.reserve(max_wait_in_seconds=2) is None
+    assert rate_limiter.reserve() == pytest.approx(3.2)
+
+    for _ in range(10):
+        rate_limiter.throttled()
+    assert rate_limiter.rate == 1
+
+    for _ in range(30):
+        rate_limiter.succeeded()
+    assert rate_limiter.rate == 10
+
+
+def test_circuit_breaker():
+    clock = FakeClock()
+    circuit_breaker = cmr.CircuitBreaker(clock)
+    for _ in range(5):
+        circuit_breaker.record_failure()
+    assert circuit_breaker.acquire() is False
+
+    circuit_breaker.configure(failure_threshold=2, reset_timeout_in_seconds=30)
+    circuit_breaker.record_failure()
+    assert circuit_breaker.acquire() is False
+    circuit_breaker.record_failure()
+    assert circuit_breaker.is_open()
+    assert circuit_breaker.acquire() is None
+
+    clock.now = 30
+    assert not circuit_breaker.is_open()
+    assert circuit_breaker.acquire() is True
+    assert circuit_breaker.is_open()
+    assert circuit_breaker.acquire() is None
+    circuit_breaker.record_failure()
+
+    clock.now = 45
+    assert circuit_breaker.acquire() is None
+
+    clock.now = 60
+    assert circuit_breaker.acquire() is True
+    circuit_breaker.release_trial()
+    assert circuit_breaker.acquire() is True
+    circuit_breaker.record_success()
+    assert circuit_breaker.acquire() is False
+    assert circuit_breaker.acquire() is False
+
+
+@pytest.fixture
+def half_open_circuit_breaker(monkeypatch):
+    clock = FakeClock()
+    circuit_breaker = cmr.CircuitBreaker(clock)
+    circuit_breaker.configure(failure_threshold=1, reset_timeout_in_seconds=30)
+    circuit_breaker.record_failure()
+    clock.now = 30
+    monkeypatch.setattr(cmr, 'CIRCUIT_BREAKER', circuit_breaker)
+    return circuit_breaker
+
+
+def test_claim_request_rejected_by_rate_limiter(cmr_config, half_open_circuit_breaker, monkeypatch):
+    rate_limiter = cmr.RateLimiter()
+    rate_limiter.configure(requests_per_second=1, burst=1, min_requests_per_second=1)
+    rate_limiter.throttled(retry_after_in_seconds=60)
+    monkeypatch.setattr(cmr, 'RATE_LIMITER', rate_limiter)
+    cmr_config['max_request_delay_in_seconds'] = 10
+
+    with pytest.raises(cmr.CMR_UNAVAILABLE, match='throttling'):
+        with cmr.claim_request(cmr_config):
+            pass
+    assert not half_open_circuit_breaker.trial_in_flight
+    assert half_open_circuit_breaker.acquire() is True
+
+
+def test_push_granule_metadata_to_cmr_releases_trial_on_error(cmr_config, half_open_circuit_breaker, monkeypatch,
+                                                              mocker):
+    monkeypatch.setattr(cmr, 'RATE_LIMITER', cmr.RateLimiter())
+    token_cache = cmr.TokenCache()
+    monkeypatch.setattr(cmr, 'TOKEN_CACHE', token_cache)
+    mocker.patch.object(token_cache, 'get', side_effect=botocore.exceptions.ClientError({}, 'Invoke'))
+    session = mocker.MagicMock()
+    metadata_content = '{"GranuleUR": "granule1", "MetadataSpecification": {"Version": "1.6.5"}}'
+
+    with pytest.raises(botocore.exceptions.ClientError):
+        cmr.push_granule_metadata_to_cmr(session, metadata_content, cmr_config, None)
+    assert not half_open_circuit_breaker.trial_in_flight
+
+    mocker.patch.object(token_cache, 'get', return_value=b'myToken')
+    session.put.return_value = mocker.MagicMock(status_code=201, headers={})
+    session.put.return_value.json.return_value = {'concept-id': 'G123-ASF'}
+    assert cmr.push_granule_metadata_to_cmr(session, metadata_content, cmr_config, None) == {'concept-id': 'G123-ASF'}
+    assert not half_open_circuit_breaker.is_open()
+
+
+def test_push_granule_metadata_to_cmr_deadline(cmr_config, monkeypatch, mocker):
+    token_cache = cmr.TokenCache()
+    token_cache.token = b'myToken'
+    monkeypatch.setattr(cmr, 'TOKEN_CACHE', token_cache)
+    monkeypatch.setattr(cmr, 'RATE_LIMITER', cmr.RateLimiter())
+    monkeypatch.setattr(cmr, 'CIRCUIT_BREAKER', cmr.CircuitBreaker())
+    clock = FakeClock()
+    mocker.patch('cmr.time.monotonic', side_effect=clock)
+    mocker.patch('cmr.time.sleep', side_effect=lambda seconds: setattr(clock, 'now', clock.now + seconds))
+    mocker.patch('cmr.random.uniform', side_effect=lambda low, high: high)
+    cmr_config.update({'max_attempts': 4, 'backoff_base_in_seconds': 4, 'backoff_max_in_seconds': 20})
+    metadata_content = '{"GranuleUR": "granule1", "MetadataSpecification": {"Version": "1.6.5"}}'
+    session = mocker.MagicMock()
+    session.put.return_value = mocker.MagicMock(status_code=503, headers={})
+
+    with pytest.raises(cmr.CMR_UNAVAILABLE):
+        cmr.push_granule_metadata_to_cmr(session, metadata_content, cmr_config, None, deadline=10)
+    # the first retry waits 4 seconds, and the second 8 seconds would pass the deadline
+    assert session.put.call_count == 2
+    assert session.put.call_args.kwargs['timeout'] == 6
+
+    clock.now = 0
+    rate_limiter = cmr.RateLimiter(clock)
+    rate_limiter.configure(requests_per_second=1, burst=1, min_requests_per_second=1)
+    rate_limiter.throttled(retry_after_in_seconds=15)
+    monkeypatch.setattr(cmr, 'RATE_LIMITER', rate_limiter)
+    with pytest.raises(cmr.CMR_UNAVAILABLE):
+        cmr.push_granule_metadata_to_cmr(session, metadata_content, cmr_config, None, deadline=10)
+    assert session.put.call_count == 2
+
+
+def test_get_retry_after():
+    assert cmr.get_retry_after({}) is None
+    assert cmr.get_retry_after({'Retry-After': '7'}) == 7
+    assert cmr.get_retry_after({'Retry-After': 'Wed, 21 Oct 2015 07:28:00 GMT'}) == 0
+    assert cmr.get_retry_after({'Retry-After': 'soon'}) is None
+
+
+def test_push_granule_metadata_to_cmr_retries_throttled(cmr_config, monkeypatch, mocker):
+    token_cache = cmr.TokenCache()
+    token_cache.token = b'myToken'
+    monkeypatch.setattr(cmr, 'TOKEN_CACHE', token_cache)
+    rate_limiter = cmr.RateLimiter()
+    rate_limiter.configure(requests_per_second=100, burst=100, min_requests_per_second=1)
+    monkeypatch.setattr(cmr, 'RATE_LIMITER', rate_limiter)
+    monkeypatch.setattr(cmr, 'CIRCUIT_BREAKER', cmr.CircuitBreaker())
+    mocker.patch('cmr.time.sleep')
+    cmr_config.update({'max_attempts': 3, 'backoff_base_in_seconds': 1, 'backoff_max_in_seconds': 20})
+    metadata_content = '{"GranuleUR": "granule1", "MetadataSpecification": {"Version": "1.6.5"}}'
+
+    responses = [
+        mocker.MagicMock(status_code=429, headers={'Retry-After': '2'}),
+        mocker.MagicMock(status_code=503, headers={}),
+        mocker.MagicMock(status_code=201, headers={}),
+    ]
+    responses[2].json.return_value = {'concept-id': 'G123-ASF'}
+    session = mocker.MagicMock()
+    session.put.side_effect = responses
+
+    assert cmr.push_granule_metadata_to_cmr(session, metadata_content, cmr_config, None) == {'concept-id': 'G123-ASF'}
+    assert session.put.call_count == 3
+    assert rate_limiter.rate == 25 + 5
+
+    responses = [mocker.MagicMock(status_code=503, headers={}) for _ in range(3)]
+    responses[2].raise_for_status.side_effect = cmr.requests.HTTPError('503 Server Error')
+    session.put.side_effect = responses
+
+    with pytest.raises(cmr.requests.HTTPError):
+        cmr.push_granule_metadata_to_cmr(session, metadata_content, cmr_config, None)
+    assert session.put.call_count == 6
+
+
+def test_push_granule_metadata_to_cmr_circuit_open(cmr_config, monkeypatch, mocker):
+    circuit_breaker = cmr.CircuitBreaker()
+    circuit_breaker.configure(failure_threshold=1, reset_timeout_in_seconds=60)
+    circuit_breaker.record_failure()
+    monkeypatch.setattr(cmr, 'CIRCUIT_BREAKER', circuit_breaker)
+    session = mocker.MagicMock()
+
+    with pytest.raises(cmr.CMR_UNAVAILABLE):
+        cmr.push_granule_metadata_to_cmr(session, '{}', cmr_config, None)
+    session.put.assert_not_called()
+
+
+@pytest.fixture
+def s3():
+    return boto3.resource('s3')
+
+
+def test_get_fingerprint():
+    metadata = {'GranuleUR': 'granule1', 'ProviderDates': [{'Date': '2024-01-01T00:00:00Z', 'Type': 'Insert'}]}
+    fingerprint = cmr.get_fingerprint(metadata)
+    assert fingerprint == cmr.get_fingerprint({'ProviderDates': [], 'GranuleUR': 'granule1'})
+    assert fingerprint != cmr.get_fingerprint({'GranuleUR': 'granule2'})
+
+
+def test_get_published_concept_id(s3):
+    config = {'bucket': 'myBucket', 'prefix': 'fingerprints/'}
+    metadata_content = '{"GranuleUR": "granule1", "MetadataSpecification": {"Version": "1.6.5"}}'
+    fingerprint = cmr.get_fingerprint(json.loads(metadata_content))
+    expected_params = {'Bucket': 'myBucket', 'Key': 'fingerprints/granule1'}
+
+    with Stubber(s3.meta.client) as stubber:
+        stubber.add_response('head_object', {'Metadata': {'fingerprint': fingerprint, 'concept-id': 'G123-ASF'}},
+                             expected_params)
+        assert cmr.get_published_concept_id(metadata_content, config, s3) == 'G123-ASF'
+
+        stubber.add_response('head_object', {'Metadata': {'fingerprint': 'other', 'concept-id': 'G123-ASF'}},
+                             expected_params)
+        assert cmr.get_published_concept_id(metadata_content, config, s3) is None
+
+        stubber.add_client_error('head_object', service_error_code='404', http_status_code=404,
+                                 expected_params=expected_params)
+        assert cmr.get_published_concept_id(metadata_content, config, s3) is None
+
+        stubber.add_client_error('head_object', service_error_code='500', http_status_code=500,
+                                 expected_params=expected_params)
+        with pytest.raises(botocore.exceptions.ClientError):
+            cmr.get_published_concept_id(metadata_content, config, s3)
+
+
+def test_process_task_fingerprints(cmr_config, s3, mocker):
+    cmr_config['fingerprints'] = {'bucket': 'myBucket', 'prefix': 'fingerprints/'}
+    metadata_content = '{"GranuleUR": "granule1", "MetadataSpecification": {"Version": "1.6.5"}}'
+    mocker.patch('cmr.get_file_content_from_s3', return_value=metadata_content)
+    mocker.patch('cmr.push_granule_metadata_to_cmr', return_value={'concept-id': 'G123-ASF'})
+    mocker.patch('cmr.get_published_concept_id', return_value=None)
+    mocker.patch('cmr.put_published_fingerprint')
+    task_input = {'bucket': 'myBucket', 'key': 'granule1.umm.json'}
+
+    assert cmr.process_task(task_input, cmr_config, None, s3) == 'G123-ASF'
+    cmr.put_published_fingerprint.assert_called_once_with(metadata_content, 'G123-ASF', cmr_config['fingerprints'],
+                                                          s3)
+
+    cmr.get_published_concept_id.return_value = 'G123-ASF'
+    assert cmr.process_task(task_input, cmr_config, None, s3) == 'G123-ASF'
+    cmr.push_granule_metadata_to_cmr.assert_called_once()
+    cmr.put_published_fingerprint.assert_called_once()
+
+
+def test_process_task_fingerprint_error(cmr_config, s3, mocker):
+    cmr_config['fingerprints'] = {'bucket': 'myBucket', 'prefix': 'fingerprints/'}
+    mocker.patch('cmr.get_file_content_from_s3',
+                 return_value='{"GranuleUR": "granule1", "MetadataSpecification": {"Version": "1.6.5"}}')
+    mocker.patch('cmr.push_granule_metadata_to_cmr', return_value={'concept-id': 'G123-ASF'})
+    mocker.patch('cmr.get_published_concept_id', return_value=None)
+    mocker.patch('cmr.put_published_fingerprint', side_effect=botocore.exceptions.ClientError({}, 'PutObject'))
+
+    assert cmr.process_task({'bucket': 'myBucket', 'key': 'granule1.umm.json'}, cmr_config, None, s3) == 'G123-ASF'
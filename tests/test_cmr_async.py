@@ -0,0 +1,110 @@
+import asyncio
+import json
+
+import httpx
+import pytest
+
+import cmr
+import cmr_async
+
+
+@pytest.fixture
+def cmr_config():
+    return {
+        'granule_url': 'https://cmr.earthdata.nasa.gov/ingest/providers/ASF/granules/',
+        'cached_token': {'bucket': 'myBucket', 'key': 'myKey'},
+        'cmr_token_lambda': 'myLambda',
+    }
+
+
+def get_metadata_content(granule_ur):
+    return json.dumps({'GranuleUR': granule_ur, 'MetadataSpecification': {'Version': '1.6.5'}})
+
+
+@pytest.fixture
+def token_cache(monkeypatch):
+    token_cache = cmr.TokenCache()
+    monkeypatch.setattr(cmr_async, 'TOKEN_CACHE', token_cache)
+    return token_cache
+
+
+def get_transport(valid_token, requests):
+    def handler(request):
+        requests.append(request)
+        if request.headers.get('Authorization') != valid_token:
+            return httpx.Response(401, json={'errors': ['Token expired']})
+        return httpx.Response(200, json={'concept-id': 'G' + request.url.path.split('/')[-1]})
+    return httpx.MockTransport(handler)
+
+
+def test_push_granule_metadata_to_cmr(cmr_config, token_cache):
+    token_cache.token = 'goodToken'
+    requests = []
+
+    async def push():
+        async with httpx.AsyncClient(transport=get_transport('goodToken', requests)) as client:
+            return await cmr_async.push_granule_metadata_to_cmr(client, get_metadata_content('granule1'), cmr_config,
+                                                                None)
+
+    assert asyncio.run(push()) == {'concept-id': 'Ggranule1'}
+    assert len(requests) == 1
+    assert str(requests[0].url) == 'https://cmr.earthdata.nasa.gov/ingest/providers/ASF/granules/granule1'
+    assert requests[0].headers['Content-Type'] == 'application/vnd.nasa.cmr.umm+json;version=1.6.5'
+
+
+def test_push_granule_metadata_to_cmr_refreshes_token_once(cmr_config, token_cache, mocker):
+    token_cache.token = 'expiredToken'
+
+    def refresh(config, s3):
+        token_cache.token = 'goodToken'
+
+    mocker.patch.object(token_cache, 'load')
+    mocker.patch.object(token_cache, '_refresh', side_effect=refresh)
+    requests = []
+
+    async def push():
+        async with httpx.AsyncClient(transport=get_transport('goodToken', requests)) as client:
+            return await asyncio.gather(*[
+                cmr_async.push_granule_metadata_to_cmr(client, get_metadata_content(f'granule{n}'), cmr_config, None)
+                for n in range(5)
+            ])
+
+    responses = asyncio.run(push())
+
+    assert responses == [{'concept-id': f'Ggranule{n}'} for n in range(5)]
+    token_cache._refresh.assert_called_once_with(cmr_config, None)
+
+
+def test_push_granule_metadata_to_cmr_error(cmr_config, token_cache):
+    token_cache.token = 'goodToken'
+
+    async def push():
+        transport = httpx.MockTransport(lambda request: httpx.Response(400, json={'errors': ['Bad metadata']}))
+        async with httpx.AsyncClient(transport=transport) as client:
+            return await cmr_async.push_granule_metadata_to_cmr(client, get_metadata_content('granule1'), cmr_config,
+                                                                None)
+
+    with pytest.raises(httpx.HTTPStatusError):
+        asyncio.run(push())
+
+
+def test_push_granule_metadata_to_cmr_releases_trial_on_error(cmr_config, token_cache, monkeypatch, mocker):
+    circuit_breaker = cmr.CircuitBreaker()
+    circuit_breaker.configure(failure_threshold=1, reset_timeout_in_seconds=0)
+    circuit_breaker.record_failure()
+    monkeypatch.setattr(cmr, 'CIRCUIT_BREAKER', circuit_breaker)
+    monkeypatch.setattr(cmr_async, 'CIRCUIT_BREAKER', circuit_breaker)
+    mocker.patch.object(token_cache, 'get', side_effect=RuntimeError('Token Lambda failed'))
+
+    async def push():
+        async with httpx.AsyncClient(transport=get_transport('goodToken', [])) as client:
+            return await cmr_async.push_granule_metadata_to_cmr(client, get_metadata_content('granule1'), cmr_config,
+                                                                None)
+
+    with pytest.raises(RuntimeError):
+        asyncio.run(push())
+    assert not circuit_breaker.trial_in_flight
+
+    token_cache.token = 'goodToken'
+    assert asyncio.run(push()) == {'concept-id': 'Ggranule1'}
+    assert not circuit_breaker.is_open()
@@ -0,0 +1,86 @@
+import json
+import unittest.mock
+
+import pytest
+
+import daemon
+
+
+@pytest.fixture
+def daemon_config():
+    return {
+        'max_task_time_in_millis': 65000,
+        'sfn_connect_timeout': 65,
+        'workers': 3,
+        'activity': {
+            'arn': 'myActivityArn',
+            'worker_name': 'myWorker',
+        },
+        'cmr': {
+            'granule_url': 'https://cmr.earthdata.nasa.gov/ingest/providers/ASF/granules/',
+            'cached_token': {
+                'bucket': 'myBucket',
+                'key': 'myKey',
+            },
+            'cmr_token_lambda': 'myLambda',
+        },
+    }
+
+
+def test_worker_loop(daemon_config, mocker):
+    sfn_client = unittest.mock.MagicMock()
+    sfn_client.get_activity_task.side_effect = [
+        {'taskToken': 'token1', 'input': json.dumps({'bucket': 'b', 'key': 'k1'})},
+        {'taskToken': 'token2', 'input': json.dumps({'bucket': 'b', 'key': 'k2'})},
+        {},
+    ]
+    mocker.patch('daemon.process_task', side_effect=['G123-ASF', RuntimeError('CMR is down')])
+
+    daemon.worker_loop(daemon_config, lambda: 900000, sfn_client, None, None)
+
+    sfn_client.send_task_success.assert_called_once_with(taskToken='token1', output='"G123-ASF"')
+    sfn_client.send_task_failure.assert_called_once_with(taskToken='token2', error='RuntimeError',
+                                                         cause='CMR is down')
+
+
+def test_worker_loop_respects_max_task_time(daemon_config):
+    sfn_client = unittest.mock.MagicMock()
+    daemon.worker_loop(daemon_config, lambda: 60000, sfn_client, None, None)
+    sfn_client.get_activity_task.assert_not_called()
+
+
+def test_daemon_loop_workers(daemon_config, mocker):
+    mocker.patch('daemon.get_session')
+    mocker.patch('daemon.get_sfn_client')
+    mocker.patch('daemon.worker_loop')
+
+    daemon.daemon_loop(daemon_config, lambda: 900000)
+
+    assert daemon.worker_loop.call_count == 3
+    daemon.get_session.assert_called_once_with(daemon_config['cmr']['cached_token'], unittest.mock.ANY, pool_size=3)
+    daemon.get_sfn_client.assert_called_once_with(65, max_pool_connections=10)
+    s3_resources = {id(call.args[4]) for call in daemon.worker_loop.call_args_list}
+    assert len(s3_resources) == 3
+
+
+def test_get_sfn_client(mocker):
+    mocker.patch.multiple('aws_clients', _session=None, _clients={}, _resources={})
+    sfn_client = daemon.get_sfn_client(65, max_pool_connections=32)
+
+    assert daemon.get_sfn_client(65, max_pool_connections=32) is sfn_client
+    assert sfn_client.meta.config.connect_timeout == 65
+    assert sfn_client.meta.config.read_timeout == 65
+    assert sfn_client.meta.config.max_pool_connections == 32
+
+
+def test_daemon_loop_shares_session(daemon_config, mocker):
+    mocker.patch.multiple('aws_clients', _session=None, _clients={}, _resources={})
+    mocker.patch('daemon.get_session')
+    mocker.patch('daemon.worker_loop')
+    session = mocker.patch('aws_clients.boto3.session.Session').return_value
+
+    daemon.daemon_loop(daemon_config, lambda: 900000)
+
+    # one S3 resource for the daemon and one for each of the 3 workers, all from the one shared session
+    assert session.resource.call_args_list == [mocker.call('s3', region_name=None)] * 4
+    session.client.assert_called_once_with('stepfunctions', region_name=None, config=unittest.mock.ANY)
@@ -0,0 +1,45 @@
+import pytest
+
+import express
+import verify
+
+
+@pytest.fixture
+def express_config():
+    return {
+        'verify': {'max_inline_metadata_bytes': 1024},
+        'ingest': {'product_bucket': 'product-bucket'},
+        'metadata_construction': {'output_bucket': 'aux-bucket'},
+    }
+
+
+def test_process(express_config, mocker):
+    event = {'ProductName': 'myProduct', 'Metadata': {'Bucket': 'sourceBucket', 'Key': 'foo.json'}}
+    verify_results = {'Objects': {'Metadata': {'ContentLength': 1}}, 'SdsMetadata': {'label': 'myProduct'}}
+    ingest_results = {
+        'Metadata': {'Bucket': 'aux-bucket', 'Key': 'myProduct.json'},
+        'SkippedCopies': [],
+        'SdsMetadata': {'label': 'myProduct'},
+    }
+    mocker.patch('verify.verify', return_value=verify_results)
+    mocker.patch('ingest.ingest', return_value=ingest_results)
+    mocker.patch('metadata_construction.create_granule_metadata_in_s3',
+                 return_value={'bucket': 'aux-bucket', 'key': 'myProduct.umm.json'})
+
+    assert express.process(event, express_config) == {
+        'IngestResults': {'Metadata': {'Bucket': 'aux-bucket', 'Key': 'myProduct.json'}, 'SkippedCopies': []},
+        'ConstructionResults': {'bucket': 'aux-bucket', 'key': 'myProduct.umm.json'},
+    }
+    express.verify.verify.assert_called_once_with(event, express_config['verify'])
+    express.ingest.ingest.assert_called_once_with({**event, 'VerifyResults': verify_results}, express_config['ingest'])
+    express.metadata_construction.create_granule_metadata_in_s3.assert_called_once_with(
+        ingest_results, express_config['metadata_construction'])
+
+
+def test_process_error(express_config, mocker):
+    mocker.patch('verify.verify', side_effect=verify.MISSING_FILE('foo.json not found'))
+    mocker.patch('ingest.ingest')
+
+    with pytest.raises(verify.MISSING_FILE, match='^foo.json not found$'):
+        express.process({'ProductName': 'myProduct'}, express_config)
+    express.ingest.ingest.assert_not_called()
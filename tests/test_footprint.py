@@ -0,0 +1,60 @@
+import json
+
+import numpy as np
+import pytest
+
+import footprint
+
+
+def test_get_signed_area():
+    ring = np.array([[0, 0], [2, 0], [2, 1], [0, 1], [0, 0]], dtype=float)
+    assert footprint.get_signed_area(ring) == 2
+    assert footprint.get_signed_area(ring[::-1]) == -2
+
+
+def test_get_distances():
+    points = np.array([[0.5, 1.0], [-1.0, 0.0], [3.0, 4.0]])
+    origin = np.array([0.0, 0.0])
+    assert footprint.get_distances(points, origin, np.array([1.0, 0.0])).tolist() == [1.0, 1.0, 2 * np.sqrt(5)]
+    assert footprint.get_distances(points, origin, origin).tolist() == [np.hypot(0.5, 1), 1.0, 5.0]
+
+
+def test_simplify_line():
+    points = np.array([[0, 0], [1, 0.01], [2, -0.01], [3, 1], [4, 0]], dtype=float)
+    assert footprint.simplify_line(points, 0.1).tolist() == [True, False, True, True, True]
+    assert footprint.simplify_line(points, 2).tolist() == [True, False, False, False, True]
+    assert footprint.simplify_line(points, 0).tolist() == [True] * 5
+
+
+def test_simplify_ring():
+    clockwise = [[0.0, 0.0], [0.0, 1.0], [0.5, 1.0005], [1.0, 1.0], [1.0, 0.5], [1.0, 0.0], [0.0, 0.0]]
+
+    assert footprint.simplify_ring(clockwise, 0.001) == [[0.0, 0.0], [1.0, 0.0], [1.0, 1.0], [0.0, 1.0], [0.0, 0.0]]
+    assert footprint.simplify_ring(clockwise[::-1], 0.001) == [[0.0, 0.0], [1.0, 0.0], [1.0, 1.0], [0.0, 1.0],
+                                                               [0.0, 0.0]]
+    assert footprint.simplify_ring(clockwise, 0.0001) == [[0.0, 0.0], [1.0, 0.0], [1.0, 1.0], [0.5, 1.0005],
+                                                          [0.0, 1.0], [0.0, 0.0]]
+
+    triangle = footprint.simplify_ring(clockwise, 10)
+    assert len(triangle) == 4
+    assert footprint.get_signed_area(np.array(triangle)) > 0
+
+
+def test_simplify_ring_antimeridian():
+    ring = [[179.0, 0.0], [-179.0, 0.0], [-179.0, 1.0], [179.0, 1.0], [179.0, 0.0]]
+    assert footprint.simplify_ring(ring, 10) == ring[::-1]
+
+
+@pytest.mark.parametrize('granule', ['granule1', 'granule2'])
+def test_simplify_ring_within_tolerance(test_data_dir, granule):
+    ring = json.loads((test_data_dir / granule / 'sds_metadata.json').read_text())['location']['coordinates'][0]
+
+    assert footprint.simplify_ring(ring, 0) == ring[::-1]
+
+    simplified = np.array(footprint.simplify_ring(ring, 0.05))
+    assert len(simplified) < len(ring)
+    assert footprint.get_signed_area(simplified) > 0
+    for point in np.array(ring):
+        distances = [footprint.get_distances(point[np.newaxis], start, end)[0]
+                     for start, end in zip(simplified[:-1], simplified[1:])]
+        assert min(distances) <= 0.05
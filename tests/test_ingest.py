@@ -0,0 +1,196 @@
+import unittest.mock
+
+import pytest
+from botocore.stub import Stubber
+
+import ingest
+
+MB = 1024 * 1024
+
+
+@pytest.fixture
+def ingest_config(monkeypatch):
+    config = {
+        'browse_bucket': 'browse-bucket',
+        'metadata_bucket': 'metadata-bucket',
+        'product_bucket': 'product-bucket',
+        'transfer_plan': {
+            'multipart_threshold': 64 * MB,
+            'min_part_size': 16 * MB,
+            'target_parts': 32,
+            'max_concurrency': 32,
+        },
+    }
+    monkeypatch.setattr(ingest, 'config', config)
+    return config
+
+
+@pytest.fixture
+def s3_stubber():
+    with Stubber(ingest.s3) as stubber:
+        yield stubber
+        stubber.assert_no_pending_responses()
+
+
+@pytest.fixture
+def event():
+    return {
+        'ProductName': 'myProduct',
+        'Metadata': {'Bucket': 'sourceBucket', 'Key': 'prefix/foo.json'},
+        'Browse': {'Bucket': 'sourceBucket', 'Key': 'prefix/foo.png'},
+        'Product': {'Bucket': 'sourceBucket', 'Key': 'prefix/foo.nc'},
+    }
+
+
+def test_get_copies(ingest_config, event):
+    assert ingest.get_copies(event, ingest_config) == {
+        'Metadata': (event['Metadata'], 'metadata-bucket', 'myProduct.json'),
+        'Browse': (event['Browse'], 'browse-bucket', 'myProduct.png'),
+        'Product': (event['Product'], 'product-bucket', 'myProduct.nc'),
+    }
+
+
+def test_plan_transfer_config(ingest_config):
+    plan = ingest_config['transfer_plan']
+
+    transfer_config = ingest.plan_transfer_config([2048], plan)
+    assert transfer_config.multipart_threshold == 64 * MB
+    assert transfer_config.max_concurrency == 1
+
+    transfer_config = ingest.plan_transfer_config([100 * MB], plan)
+    assert transfer_config.multipart_chunksize == 16 * MB
+    assert transfer_config.max_concurrency == 7
+
+    transfer_config = ingest.plan_transfer_config([2048, 4096, 8 * 1024 * MB], plan)
+    assert transfer_config.multipart_chunksize == 256 * MB
+    assert transfer_config.max_concurrency == 32
+
+    transfer_config = ingest.plan_transfer_config([2048, 4096, 1024 * MB], plan)
+    assert transfer_config.multipart_chunksize == 32 * MB
+    assert transfer_config.max_concurrency == 32
+
+    transfer_config = ingest.plan_transfer_config([2048, 4096, 256 * MB], plan)
+    assert transfer_config.multipart_chunksize == 16 * MB
+    assert transfer_config.max_concurrency == 18
+
+    assert ingest.get_part_size(1024 * 1024 * MB, plan) == ingest.MAX_PART_SIZE
+
+
+def test_get_source_object(event, s3_stubber):
+    event['VerifyResults'] = {'Objects': {'Product': {'ContentLength': 123, 'ETag': '"abc"'}}}
+    assert ingest.get_source_object(event, 'Product') == {'ContentLength': 123, 'ETag': '"abc"'}
+
+    s3_stubber.add_response(
+        method='head_object',
+        expected_params={'Bucket': 'sourceBucket', 'Key': 'prefix/foo.png'},
+        service_response={'ContentLength': 456, 'ETag': '"def"'},
+    )
+    assert ingest.get_source_object(event, 'Browse') == {'ContentLength': 456, 'ETag': '"def"'}
+
+
+def test_is_already_copied(s3_stubber):
+    source_object = {'ContentLength': 123, 'ETag': '"abc"'}
+    expected_params = {'Bucket': 'myBucket', 'Key': 'myKey'}
+
+    s3_stubber.add_client_error(method='head_object', expected_params=expected_params, service_error_code='404')
+    assert not ingest.is_already_copied(source_object, 'myBucket', 'myKey')
+
+    s3_stubber.add_response(method='head_object', expected_params=expected_params,
+                            service_response={'ContentLength': 123, 'ETag': '"abc"'})
+    assert ingest.is_already_copied(source_object, 'myBucket', 'myKey')
+
+    s3_stubber.add_response(method='head_object', expected_params=expected_params,
+                            service_response={'ContentLength': 123, 'ETag': '"xyz-4"',
+                                              'Metadata': {'source-etag': '"abc"'}})
+    assert ingest.is_already_copied(source_object, 'myBucket', 'myKey')
+
+    s3_stubber.add_response(method='head_object', expected_params=expected_params,
+                            service_response={'ContentLength': 456, 'ETag': '"abc"'})
+    assert not ingest.is_already_copied(source_object, 'myBucket', 'myKey')
+
+    s3_stubber.add_response(method='head_object', expected_params=expected_params,
+                            service_response={'ContentLength': 123, 'ETag': '"xyz"'})
+    assert not ingest.is_already_copied(source_object, 'myBucket', 'myKey')
+
+    assert not ingest.is_already_copied({'ContentLength': 123}, 'myBucket', 'myKey')
+
+
+def test_copy_s3_object():
+    transfer_manager = unittest.mock.MagicMock()
+    ingest.copy_s3_object({'Bucket': 'a', 'Key': 'b'}, 'myBucket', 'myKey.png', transfer_manager)
+    transfer_manager.copy.assert_called_once_with(
+        copy_source={'Bucket': 'a', 'Key': 'b'},
+        bucket='myBucket',
+        key='myKey.png',
+        extra_args={'ContentType': 'image/png', 'MetadataDirective': 'REPLACE', 'TaggingDirective': 'REPLACE'},
+        subscribers=None,
+    )
+    transfer_manager.copy.return_value.result.assert_called_once_with()
+
+    transfer_manager = unittest.mock.MagicMock()
+    ingest.copy_s3_object({'Bucket': 'a', 'Key': 'b'}, 'myBucket', 'myKey', transfer_manager,
+                          {'ContentLength': 123, 'ETag': '"abc"'}, multipart_threshold=100)
+    assert transfer_manager.copy.call_args.kwargs['extra_args'] == {
+        'ContentType': 'application/octet-stream',
+        'MetadataDirective': 'REPLACE',
+        'TaggingDirective': 'REPLACE',
+        'Metadata': {'source-etag': '"abc"'},
+    }
+
+    ingest.copy_s3_object({'Bucket': 'a', 'Key': 'b'}, 'myBucket', 'myKey', transfer_manager,
+                          {'ContentLength': 123, 'ETag': '"abc"'}, multipart_threshold=1000)
+    assert 'Metadata' not in transfer_manager.copy.call_args.kwargs['extra_args']
+
+
+def test_needs_source_etag():
+    assert not ingest.needs_source_etag({'ContentLength': 123}, 1000)
+    assert not ingest.needs_source_etag({'ContentLength': 123, 'ETag': '"abc"'}, 1000)
+    assert ingest.needs_source_etag({'ContentLength': 123, 'ETag': '"abc-2"'}, 1000)
+    assert ingest.needs_source_etag({'ContentLength': 1000, 'ETag': '"abc"'}, 1000)
+    assert ingest.needs_source_etag({'ContentLength': 123, 'ETag': '"abc"'})
+
+
+def test_copy_s3_objects_concurrently(ingest_config, event, mocker):
+    source_objects = {name: {'ContentLength': 1, 'ETag': '"abc"'} for name in ('Metadata', 'Browse', 'Product')}
+    mocker.patch('ingest.create_transfer_manager')
+    mocker.patch('ingest.copy_s3_object')
+    mocker.patch('ingest.is_already_copied', side_effect=lambda source_object, dest_bucket, dest_key:
+                 dest_bucket == 'browse-bucket')
+
+    skipped = ingest.copy_s3_objects_concurrently(ingest.get_copies(event, ingest_config), source_objects,
+                                                  ingest_config['transfer_plan'], 3, skip_identical=True)
+    assert skipped == ['Browse']
+    assert ingest.copy_s3_object.call_count == 2
+
+
+def test_copy_s3_objects_concurrently_collects_errors(ingest_config, event, mocker):
+    def copy_s3_object(copy_source, dest_bucket, dest_key, transfer_manager, source_object, multipart_threshold):
+        if dest_bucket != 'metadata-bucket':
+            raise RuntimeError(f'{dest_key} failed')
+
+    source_objects = {name: {'ContentLength': 1} for name in ('Metadata', 'Browse', 'Product')}
+    mocker.patch('ingest.create_transfer_manager')
+    mocker.patch('ingest.copy_s3_object', side_effect=copy_s3_object)
+
+    with pytest.raises(ingest.COPY_FAILED, match=r'^Browse: myProduct.png failed; Product: myProduct.nc failed$'):
+        ingest.copy_s3_objects_concurrently(ingest.get_copies(event, ingest_config), source_objects,
+                                            ingest_config['transfer_plan'], 3)
+    assert ingest.copy_s3_object.call_count == 3
+
+
+def test_lambda_handler(ingest_config, event, mocker):
+    ingest_config['concurrent_copies'] = True
+    event['VerifyResults'] = {
+        'Objects': {name: {'ContentLength': 1} for name in ('Metadata', 'Browse', 'Product')},
+        'SdsMetadata': {'label': 'myProduct'},
+    }
+    mocker.patch('ingest.copy_s3_objects_concurrently', return_value=['Metadata'])
+
+    assert ingest.lambda_handler(event, None) == {
+        'Metadata': {'Bucket': 'metadata-bucket', 'Key': 'myProduct.json'},
+        'Browse': {'Bucket': 'browse-bucket', 'Key': 'myProduct.png'},
+        'Product': {'Bucket': 'product-bucket', 'Key': 'myProduct.nc'},
+        'SkippedCopies': ['Metadata'],
+        'SdsMetadata': {'label': 'myProduct'},
+    }
+    ingest.copy_s3_objects_concurrently.assert_called_once()
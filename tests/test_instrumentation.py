@@ -0,0 +1,104 @@
+import json
+
+import boto3
+from botocore.stub import Stubber
+
+import instrumentation
+
+
+def get_records(capsys):
+    return [json.loads(line) for line in capsys.readouterr().out.splitlines()]
+
+
+def test_register_session_disabled(capsys):
+    session = boto3.session.Session(region_name='us-east-1')
+    instrumentation.register_session(session)
+    s3 = session.client('s3')
+    with Stubber(s3) as stubber:
+        stubber.add_response('head_object', {'ContentLength': 7}, {'Bucket': 'myBucket', 'Key': 'myKey'})
+        s3.head_object(Bucket='myBucket', Key='myKey')
+    assert capsys.readouterr().out == ''
+
+
+def test_register_session(mocker, capsys):
+    mocker.patch('instrumentation.ENABLED', True)
+    mocker.patch.dict('os.environ', {'AWS_LAMBDA_FUNCTION_NAME': 'myFunction'})
+    instrumentation.SUMMARY.reset()
+    session = boto3.session.Session(region_name='us-east-1', aws_access_key_id='key', aws_secret_access_key='secret')
+    instrumentation.register_session(session)
+    s3 = session.client('s3')
+    with Stubber(s3) as stubber:
+        stubber.add_response('put_object', {}, {'Bucket': 'myBucket', 'Key': 'myKey', 'Body': b'content'})
+        stubber.add_client_error('head_object', service_error_code='404', http_status_code=404,
+                                 expected_params={'Bucket': 'myBucket', 'Key': 'missing'})
+        s3.put_object(Bucket='myBucket', Key='myKey', Body=b'content')
+        try:
+            s3.head_object(Bucket='myBucket', Key='missing')
+        except s3.exceptions.ClientError:
+            pass
+
+    put_record, head_record = get_records(capsys)
+    assert put_record['_aws']['CloudWatchMetrics'][0]['Namespace'] == 'grfn-ingest/calls'
+    assert put_record['_aws']['CloudWatchMetrics'][0]['Dimensions'] == [['FunctionName', 'Service', 'Operation']]
+    assert put_record['FunctionName'] == 'myFunction'
+    assert put_record['Service'] == 's3'
+    assert put_record['Operation'] == 'PutObject'
+    assert put_record['Endpoint'] == 'myBucket'
+    assert put_record['Bytes'] == 7
+    assert put_record['Error'] is None
+    assert put_record['Duration'] >= 0
+
+    assert head_record['Operation'] == 'HeadObject'
+    assert head_record['Error'] == '404'
+
+    calls = instrumentation.SUMMARY.reset()
+    assert calls['s3.PutObject'] == {'Count': 1, 'Duration': put_record['Duration'], 'Bytes': 7}
+    assert calls['s3.HeadObject']['Count'] == 1
+
+
+def test_handler_disabled():
+    def lambda_handler(event, context):
+        return event
+
+    assert instrumentation.handler(lambda_handler) is lambda_handler
+
+
+def test_handler(mocker, capsys):
+    mocker.patch('instrumentation.ENABLED', True)
+    mocker.patch('instrumentation._cold_start', True)
+    mocker.patch('instrumentation.get_process_age_in_seconds', return_value=1.5)
+
+    @instrumentation.handler
+    def lambda_handler(event, context):
+        instrumentation.record_call('cmr', 'PUT', 0.25, 'cmr.earthdata.nasa.gov', 100)
+        instrumentation.record_call('cmr', 'PUT', 0.5, 'cmr.earthdata.nasa.gov', 200)
+        return event['ProductName']
+
+    assert lambda_handler({'ProductName': 'myProduct'}, None) == 'myProduct'
+    assert lambda_handler({'ProductName': 'otherProduct'}, None) == 'otherProduct'
+
+    records = get_records(capsys)
+    assert len(records) == 6
+    first_summary, second_summary = records[2], records[5]
+    assert first_summary['ProductName'] == 'myProduct'
+    assert first_summary['ColdStart'] == 1
+    assert first_summary['InitDuration'] == 1500
+    assert first_summary['CallDuration'] == 750
+    assert first_summary['Calls'] == {'cmr.PUT': {'Count': 2, 'Duration': 750, 'Bytes': 300}}
+    assert first_summary['InvocationDuration'] >= 0
+
+    assert second_summary['ColdStart'] == 0
+    assert 'InitDuration' not in second_summary
+
+
+def test_get_body_size(tmp_path):
+    assert instrumentation.get_body_size(b'abc') == 3
+    assert instrumentation.get_body_size('é') == 2
+    assert instrumentation.get_body_size(None) is None
+
+    path = tmp_path / 'body'
+    path.write_bytes(b'0123456789')
+    with open(path, 'rb') as f:
+        f.seek(4)
+        assert instrumentation.get_body_size(f) == 6
+        assert f.tell() == 4
@@ -0,0 +1,309 @@
+import json
+import unittest.mock
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+from botocore.stub import Stubber
+
+import invoke
+
+
+@pytest.fixture
+def message_config():
+    return {
+        'message_error_key': 'MessageError',
+        'step_function_arn': 'myStepFunctionArn',
+    }
+
+
+def get_sqs_message(message_id, message):
+    sqs_message = unittest.mock.MagicMock()
+    sqs_message.message_id = message_id
+    sqs_message.receipt_handle = f'handle-{message_id}'
+    sqs_message.body = json.dumps({'Message': message})
+    return sqs_message
+
+
+def test_validate_message():
+    assert invoke.validate_message('{"foo": "bar"}', 'MessageError') == '{"foo": "bar"}'
+    assert invoke.validate_message('{"foo":', 'MessageError') == \
+        '{"MessageError": "Expecting value: line 1 column 8 (char 7)"}'
+
+
+def test_process_sqs_messages(message_config, mocker):
+    def start_execution(stateMachineArn, input):  # noqa: A002
+        if input == '{"fail": true}':
+            raise RuntimeError('failed')
+        return {'executionArn': 'myExecutionArn'}
+
+    mocker.patch.object(invoke.sfn, 'start_execution', side_effect=start_execution)
+    sqs_messages = [
+        get_sqs_message('1', '{"foo": "bar"}'),
+        get_sqs_message('2', '{"fail": true}'),
+        get_sqs_message('3', '{"foo":'),
+    ]
+
+    with ThreadPoolExecutor(max_workers=3) as executor:
+        processed = invoke.process_sqs_messages(executor, message_config, sqs_messages)
+
+    assert processed == [sqs_messages[0], sqs_messages[2]]
+    assert invoke.sfn.start_execution.call_count == 3
+
+
+def test_get_execution_name():
+    message = {'ProductName': 'S1-GUNW-A-R-106-tops-20240517_20230429-002707-00093W_00001S-PP-67fa-v3_0_1',
+               'DeliveryTime': '2023-04-19T20:06:35.712653'}
+    name = invoke.get_execution_name(json.dumps(message))
+    assert name == 'S1-GUNW-A-R-106-tops-20240517_20230429-002707-00093W_00001S-PP-' + name[-16:]
+    assert len(name) == 79
+    assert invoke.get_execution_name(json.dumps(message, indent=2)) == name
+    assert invoke.get_execution_name(json.dumps({**message, 'DeliveryTime': '2023-04-20T00:00:00'})) != name
+
+    assert invoke.get_execution_name(json.dumps({'ProductName': 'my product/1', 'DeliveryTime': 'now'})) \
+        .startswith('my_product_1-')
+    assert invoke.get_execution_name('{"MessageError": "Expecting value"}') is None
+    assert invoke.get_execution_name(json.dumps({'ProductName': 'myProduct', 'DeliveryTime': ''})) is None
+    assert invoke.get_execution_name('["myProduct"]') is None
+
+
+def test_seen_executions():
+    now = [0.0]
+    seen = invoke.SeenExecutions(clock=lambda: now[0])
+    assert seen.claim('a', 10)
+    assert not seen.claim('a', 10)
+    now[0] = 5.0
+    assert seen.claim('b', 10)
+    now[0] = 10.0
+    assert seen.claim('a', 10)
+    assert list(seen.names) == ['b', 'a']
+    seen.release('b')
+    assert seen.claim('b', 10)
+    assert seen.claim('c', 0)
+    assert seen.claim('c', 0)
+
+
+def test_process_sqs_message_duplicates(message_config, mocker):
+    message_config['seen_ttl_in_seconds'] = 300
+    mocker.patch.object(invoke, 'SEEN_EXECUTIONS', invoke.SeenExecutions())
+    message = json.dumps({'ProductName': 'myProduct', 'DeliveryTime': '2024-01-01T00:00:00'})
+    name = invoke.get_execution_name(message)
+
+    with Stubber(invoke.sfn) as stubber:
+        stubber.add_client_error('start_execution', service_error_code='ServiceUnavailable', http_status_code=503,
+                                 expected_params={'stateMachineArn': 'myStepFunctionArn', 'input': message,
+                                                  'name': name})
+        with pytest.raises(invoke.ClientError):
+            invoke.process_sqs_message(invoke.sfn, message_config, get_sqs_message('1', message))
+
+        stubber.add_response('start_execution', {'executionArn': 'myExecutionArn', 'startDate': 0},
+                             {'stateMachineArn': 'myStepFunctionArn', 'input': message, 'name': name})
+        invoke.process_sqs_message(invoke.sfn, message_config, get_sqs_message('2', message))
+        invoke.process_sqs_message(invoke.sfn, message_config, get_sqs_message('3', message))
+        stubber.assert_no_pending_responses()
+
+        invoke.SEEN_EXECUTIONS.release(name)
+        stubber.add_client_error('start_execution', service_error_code='ExecutionAlreadyExists',
+                                 expected_params={'stateMachineArn': 'myStepFunctionArn', 'input': message,
+                                                  'name': name})
+        invoke.process_sqs_message(invoke.sfn, message_config, get_sqs_message('4', message))
+        stubber.assert_no_pending_responses()
+
+
+def test_process_sqs_message_rerun(message_config, mocker):
+    mocker.patch.object(invoke, 'SEEN_EXECUTIONS', invoke.SeenExecutions())
+    message = json.dumps({'ProductName': 'myProduct', 'DeliveryTime': '2024-01-01T00:00:00'})
+    rerun_message = json.dumps({'ProductName': 'myProduct', 'DeliveryTime': '2024-01-02T00:00:00'})
+
+    with Stubber(invoke.sfn) as stubber:
+        # resubmitting the same message is a duplicate, whether its execution succeeded or failed
+        stubber.add_client_error('start_execution', service_error_code='ExecutionAlreadyExists',
+                                 expected_params={'stateMachineArn': 'myStepFunctionArn', 'input': message,
+                                                  'name': invoke.get_execution_name(message)})
+        invoke.process_sqs_message(invoke.sfn, message_config, get_sqs_message('1', message))
+
+        # a new DeliveryTime re-runs the job
+        stubber.add_response('start_execution', {'executionArn': 'myExecutionArn', 'startDate': 0},
+                             {'stateMachineArn': 'myStepFunctionArn', 'input': rerun_message,
+                              'name': invoke.get_execution_name(rerun_message)})
+        invoke.process_sqs_message(invoke.sfn, message_config, get_sqs_message('2', rerun_message))
+        stubber.assert_no_pending_responses()
+
+
+def test_delete_messages():
+    queue = unittest.mock.MagicMock()
+    queue.delete_messages.return_value = {'Successful': []}
+    sqs_messages = [get_sqs_message(str(n), '{}') for n in range(23)]
+
+    invoke.delete_messages(queue, sqs_messages)
+
+    assert [len(call.kwargs['Entries']) for call in queue.delete_messages.call_args_list] == [10, 10, 3]
+    assert queue.delete_messages.call_args_list[2].kwargs['Entries'][0] == {'Id': '20', 'ReceiptHandle': 'handle-20'}
+
+
+def test_invoke_ingest_pipelined(message_config, mocker):
+    batches = [
+        [get_sqs_message(str(n), '{}') for n in range(0, 10)],
+        [get_sqs_message(str(n), '{}') for n in range(10, 15)],
+        [],
+    ]
+    queue = mocker.patch.object(invoke.sqs, 'Queue').return_value
+    queue.receive_messages.side_effect = batches
+    mocker.patch.object(invoke.sfn, 'start_execution', return_value={'executionArn': 'myExecutionArn'})
+    config = {
+        'queue_url': 'myQueueUrl',
+        'max_messages_to_process': 100,
+        'max_messages_per_receive': 10,
+        'wait_time_in_seconds': 0,
+        'max_workers': 4,
+        'message': message_config,
+    }
+
+    invoke.invoke_ingest_pipelined(config)
+
+    assert invoke.sfn.start_execution.call_count == 15
+    assert queue.receive_messages.call_count == 3
+    assert [len(call.kwargs['Entries']) for call in queue.delete_messages.call_args_list] == [10, 5]
+
+    queue.receive_messages.reset_mock(side_effect=True)
+    queue.receive_messages.side_effect = batches
+    config['max_messages_to_process'] = 10
+
+    invoke.invoke_ingest_pipelined(config)
+
+    assert queue.receive_messages.call_count == 1
+
+
+def test_invoke_ingest_caps_receives(message_config, mocker):
+    def receive_messages(MaxNumberOfMessages, WaitTimeSeconds):  # noqa: N803
+        return [get_sqs_message(str(n), '{}') for n in range(MaxNumberOfMessages)]
+
+    queue = mocker.patch.object(invoke.sqs, 'Queue').return_value
+    queue.receive_messages.side_effect = receive_messages
+    mocker.patch.object(invoke.sfn, 'start_execution', return_value={'executionArn': 'myExecutionArn'})
+    config = {
+        'queue_url': 'myQueueUrl',
+        'max_messages_to_process': 13,
+        'max_messages_per_receive': 10,
+        'wait_time_in_seconds': 0,
+        'max_workers': 4,
+        'message': message_config,
+    }
+
+    for invoke_ingest in (invoke.invoke_ingest, invoke.invoke_ingest_pipelined):
+        queue.receive_messages.reset_mock()
+        invoke.sfn.start_execution.reset_mock()
+        invoke_ingest(config)
+        assert [call.kwargs['MaxNumberOfMessages'] for call in queue.receive_messages.call_args_list] == [10, 3]
+        assert invoke.sfn.start_execution.call_count == 13
+
+    # a drain plan limited by the execution cap receives only what it can start
+    config['drain_controller'] = {'max_running_executions': 1000, 'reserved_time_in_millis': 15000,
+                                  'millis_per_message': 100, 'max_wait_time_in_seconds': 5}
+    decision = invoke.plan_drain(5000, 999, 115000, {**config, 'max_messages_to_process': 1000})
+    assert decision['MessagesToProcess'] == 1
+    queue.receive_messages.reset_mock()
+    invoke.sfn.start_execution.reset_mock()
+    invoke.invoke_ingest_pipelined({**config, 'max_messages_to_process': decision['MessagesToProcess']})
+    assert [call.kwargs['MaxNumberOfMessages'] for call in queue.receive_messages.call_args_list] == [1]
+    assert invoke.sfn.start_execution.call_count == 1
+
+
+def test_count_running_executions():
+    with Stubber(invoke.sfn) as stubber:
+        for page in range(3):
+            stubber.add_response(
+                method='list_executions',
+                expected_params={
+                    'stateMachineArn': 'myStepFunctionArn',
+                    'statusFilter': 'RUNNING',
+                    **({'nextToken': f'token{page}'} if page else {}),
+                },
+                service_response={
+                    'executions': [
+                        {
+                            'executionArn': f'arn:aws:states:us-east-1:123456789012:execution:foo:{page}-{n}',
+                            'stateMachineArn': 'arn:aws:states:us-east-1:123456789012:stateMachine:foo',
+                            'name': f'{page}-{n}',
+                            'status': 'RUNNING',
+                            'startDate': '2024-01-01T00:00:00Z',
+                        }
+                        for n in range(100)
+                    ],
+                    'nextToken': f'token{page + 1}',
+                },
+            )
+        assert invoke.count_running_executions(invoke.sfn, 'myStepFunctionArn', 250) == 300
+        stubber.assert_no_pending_responses()
+
+
+def test_plan_drain():
+    config = {
+        'max_messages_to_process': 1000,
+        'max_messages_per_receive': 10,
+        'drain_controller': {
+            'max_running_executions': 1000,
+            'reserved_time_in_millis': 15000,
+            'millis_per_message': 100,
+            'max_wait_time_in_seconds': 5,
+        },
+    }
+
+    decision = invoke.plan_drain(5000, 0, 115000, config)
+    assert decision['MessagesToProcess'] == 1000
+    assert decision['WaitTimeSeconds'] == 0
+
+    decision = invoke.plan_drain(5000, 0, 65000, config)
+    assert decision['TimeCapacity'] == 500
+    assert decision['MessagesToProcess'] == 500
+
+    decision = invoke.plan_drain(5000, 900, 115000, config)
+    assert decision['ExecutionCapacity'] == 100
+    assert decision['MessagesToProcess'] == 100
+
+    decision = invoke.plan_drain(5000, 1200, 115000, config)
+    assert decision['MessagesToProcess'] == 0
+
+    decision = invoke.plan_drain(3, 0, 115000, config)
+    assert decision['MessagesToProcess'] == 3
+    assert decision['WaitTimeSeconds'] == 5
+
+    decision = invoke.plan_drain(0, 0, 115000, config)
+    assert decision['MessagesToProcess'] == 0
+
+
+def test_log_metrics(capsys):
+    invoke.log_metrics({'QueueDepth': 5, 'WaitTimeSeconds': 0})
+
+    record = json.loads(capsys.readouterr().out)
+    assert record['_aws']['CloudWatchMetrics'][0]['Namespace'] == 'grfn-ingest/invoke'
+    assert record['_aws']['CloudWatchMetrics'][0]['Metrics'] == [
+        {'Name': 'QueueDepth', 'Unit': 'Count'},
+        {'Name': 'WaitTimeSeconds', 'Unit': 'Seconds'},
+    ]
+    assert record['QueueDepth'] == 5
+    assert record['WaitTimeSeconds'] == 0
+
+
+def test_lambda_handler_empty_queue(monkeypatch, mocker):
+    monkeypatch.setattr(invoke, 'CONFIG', {
+        'queue_url': 'myQueueUrl',
+        'max_messages_to_process': 1000,
+        'max_messages_per_receive': 10,
+        'drain_controller': {
+            'max_running_executions': 1000,
+            'reserved_time_in_millis': 15000,
+            'millis_per_message': 100,
+            'max_wait_time_in_seconds': 5,
+        },
+        'message': {'step_function_arn': 'myStepFunctionArn'},
+    })
+    queue = mocker.patch.object(invoke.sqs, 'Queue').return_value
+    queue.attributes = {'ApproximateNumberOfMessages': '0'}
+    mocker.patch('invoke.invoke_ingest')
+    context = unittest.mock.MagicMock()
+    context.get_remaining_time_in_millis.return_value = 120000
+
+    invoke.lambda_handler(None, context)
+
+    queue.load.assert_called_once_with()
+    invoke.invoke_ingest.assert_not_called()
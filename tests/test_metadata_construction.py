@@ -6,11 +6,12 @@ import pytest
 from botocore.stub import Stubber
 
 import metadata_construction
+import verify
 
 
 @pytest.fixture
 def s3_stubber():
-    with Stubber(metadata_construction.s3.meta.client) as stubber:
+    with Stubber(metadata_construction.s3) as stubber:
         yield stubber
         stubber.assert_no_pending_responses()
 
@@ -102,3 +103,82 @@ def test_create_granule_metadata_in_s3_g2(test_data_dir, mocker):
             json.dumps(json.loads((test_data_dir / 'granule2' / 'granule.umm.json').read_text()), sort_keys=True),
         ),
     ]
+
+
+@pytest.mark.parametrize('granule', ['granule1', 'granule2'])
+def test_create_granule_metadata_in_s3_forwarded_metadata(test_data_dir, mocker, granule):
+    sds_metadata = json.loads((test_data_dir / granule / 'sds_metadata.json').read_text())
+    inputs = json.loads((test_data_dir / granule / 'inputs.json').read_text())
+    inputs['SdsMetadata'] = verify.get_metadata_digest(sds_metadata)
+    config = json.loads((test_data_dir / granule / 'config.json').read_text())
+
+    mocker.patch('metadata_construction.get_sds_metadata')
+    mocker.patch('metadata_construction.now', return_value='2024-03-02T22:12:36.000Z')
+    mocker.patch('metadata_construction.get_s3_file_size', return_value=456)
+    mocker.patch('metadata_construction.upload_content_to_s3')
+    metadata_construction.create_granule_metadata_in_s3(inputs, config)
+    from_digest = metadata_construction.upload_content_to_s3.call_args
+
+    del inputs['SdsMetadata']
+    metadata_construction.get_sds_metadata.return_value = sds_metadata
+    metadata_construction.create_granule_metadata_in_s3(inputs, config)
+
+    assert from_digest == metadata_construction.upload_content_to_s3.call_args
+    metadata_construction.get_sds_metadata.assert_called_once_with(inputs['Metadata'])
+
+
+def test_put_content_to_s3(s3_stubber):
+    s3_stubber.add_response(
+        method='put_object',
+        expected_params={
+            'Bucket': 'myBucket',
+            'Key': 'myKey',
+            'Body': b'{"foo": "bar"}',
+            'ContentType': 'application/xml',
+            'ContentMD5': 'lCMsW4/JJy9vc6HjbraPzw==',
+        },
+        service_response={},
+    )
+    metadata_construction.put_content_to_s3({'bucket': 'myBucket', 'key': 'myKey'}, '{"foo": "bar"}', content_md5=True)
+
+
+def test_create_granule_metadata_batch(mocker):
+    def create_granule_metadata_in_s3(inputs, config):
+        if inputs['Product']['Key'] == 'bad.nc':
+            raise KeyError('label')
+        return {'bucket': config['output_bucket'], 'key': inputs['Product']['Key'] + '.umm.json'}
+
+    mocker.patch('metadata_construction.create_granule_metadata_in_s3', side_effect=create_granule_metadata_in_s3)
+    granules = [{'Product': {'Key': key}} for key in ('a.nc', 'bad.nc', 'b.nc')]
+
+    assert metadata_construction.create_granule_metadata_batch(granules, {'output_bucket': 'myBucket'}, 2) == [
+        {'Result': {'bucket': 'myBucket', 'key': 'a.nc.umm.json'}},
+        {'Error': {'Error': 'KeyError', 'Cause': "'label'"}},
+        {'Result': {'bucket': 'myBucket', 'key': 'b.nc.umm.json'}},
+    ]
+
+
+def test_format_polygon():
+    polygon = [[0.0, 0.0], [0.0, 1.0], [0.5, 1.0005], [1.0, 1.0], [1.0, 0.0], [0.0, 0.0]]
+    assert metadata_construction.format_polygon(polygon)[:2] == [
+        {'Latitude': 0.0, 'Longitude': 0.0},
+        {'Latitude': 0.0, 'Longitude': 1.0},
+    ]
+    assert metadata_construction.format_polygon(polygon, tolerance=0.001) == [
+        {'Latitude': 0.0, 'Longitude': 0.0},
+        {'Latitude': 0.0, 'Longitude': 1.0},
+        {'Latitude': 1.0, 'Longitude': 1.0},
+        {'Latitude': 1.0, 'Longitude': 0.0},
+        {'Latitude': 0.0, 'Longitude': 0.0},
+    ]
+
+
+@pytest.mark.parametrize('granule', ['granule1', 'granule2'])
+def test_serialize_umm(test_data_dir, granule):
+    umm_json = json.loads((test_data_dir / granule / 'granule.umm.json').read_text())
+
+    assert metadata_construction.serialize_umm(umm_json, {}) == json.dumps(umm_json, sort_keys=True)
+
+    content = metadata_construction.serialize_umm(umm_json, {'fast_serializer': True})
+    assert json.loads(content) == umm_json
+    assert content == json.dumps(umm_json, sort_keys=True, separators=(',', ':'), ensure_ascii=False)
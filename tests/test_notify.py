@@ -0,0 +1,89 @@
+import json
+
+import pytest
+
+import notify
+
+
+@pytest.fixture
+def notify_config():
+    return {
+        'default_topic': {'Arn': 'arn:aws:sns:us-east-1:123456789012:default', 'Region': 'us-east-1'},
+        'errors': {
+            'key': 'Error',
+            'codes': ['INVALID_MESSAGE', 'INVALID_TOPIC', 'MISSING_FILE', 'INVALID_METADATA'],
+            'default_code': 'INGEST_ERROR',
+        },
+    }
+
+
+def get_topic(name, region='us-west-2'):
+    return {'Arn': f'arn:aws:sns:{region}:123456789012:{name}', 'Region': region}
+
+
+def test_get_sns_client():
+    client = notify.get_sns_client('us-west-2')
+    assert notify.get_sns_client('us-west-2') is client
+    assert client.meta.region_name == 'us-west-2'
+    assert notify.get_sns_client('us-east-1') is not client
+
+
+def test_create_response(notify_config):
+    event = {
+        'ProductName': 'myProduct',
+        'DeliveryTime': '2024-01-01T00:00:00',
+        'Error': {'Error': 'States.Timeout', 'Cause': json.dumps({'errorMessage': 'Task timed out'})},
+    }
+    response = notify.create_response(event, notify_config['errors'])
+    assert response['Status'] == 'failure'
+    assert response['ErrorCode'] == 'INGEST_ERROR'
+    assert response['ErrorMessage'] == 'Task timed out'
+
+
+def test_publish_batch(mocker):
+    client = mocker.patch('notify.get_sns_client').return_value
+    client.publish_batch.side_effect = [
+        {'Successful': [], 'Failed': [{'Id': '3', 'Code': 'InternalError', 'SenderFault': False}]},
+        RuntimeError('Throttled'),
+        {'Successful': []},
+    ]
+    messages = [f'message{n}' for n in range(23)]
+
+    assert notify.publish_batch(messages, get_topic('myTopic')) == [3, *range(10, 20)]
+    assert [len(call.kwargs['PublishBatchRequestEntries']) for call in client.publish_batch.call_args_list] == \
+        [10, 10, 3]
+    assert client.publish_batch.call_args_list[2].kwargs['PublishBatchRequestEntries'][0] == \
+        {'Id': '20', 'Message': 'message20'}
+
+
+def test_notify_batch(notify_config, mocker):
+    sent = []
+
+    def publish_batch(messages, topic):
+        if topic['Arn'].endswith(':bad'):
+            return list(range(len(messages)))
+        sent.append((topic['Arn'], [json.loads(message)['ProductName'] for message in messages]))
+        return []
+
+    mocker.patch('notify.publish_batch', side_effect=publish_batch)
+    events = [
+        {'ProductName': 'a', 'ResponseTopic': get_topic('good')},
+        {'ProductName': 'b', 'ResponseTopic': get_topic('bad')},
+        {'ProductName': 'c'},
+        {'ProductName': 'd', 'ResponseTopic': get_topic('good')},
+    ]
+
+    responses = notify.notify_batch(events, notify_config)
+
+    assert [response['ProductName'] for response in responses] == ['a', 'b', 'c', 'd']
+    assert sent == [
+        ('arn:aws:sns:us-west-2:123456789012:good', ['a', 'd']),
+        ('arn:aws:sns:us-east-1:123456789012:default', ['c', 'b']),
+    ]
+
+
+def test_notify_batch_default_topic_fails(notify_config, mocker):
+    mocker.patch('notify.publish_batch', return_value=[0])
+
+    with pytest.raises(notify.PUBLISH_FAILED, match=r'^Failed to send 1 messages to the default topic$'):
+        notify.notify_batch([{'ProductName': 'a'}], notify_config)
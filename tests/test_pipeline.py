@@ -0,0 +1,48 @@
+import json
+
+import pipeline
+
+
+def test_get_lambda_config():
+    config = pipeline.get_lambda_config('verify', {'AuxBucket': 'myBucket'})
+    assert config['metadata_digest_bucket'] == 'myBucket'
+    assert config['max_inline_metadata_bytes'] == 32768
+
+
+def test_run_pipeline(tmp_path, monkeypatch):
+    monkeypatch.setenv('AWS_ACCESS_KEY_ID', 'local')
+    monkeypatch.setenv('AWS_SECRET_ACCESS_KEY', 'local')
+
+    executions, elapsed_in_seconds = pipeline.run_pipeline(tmp_path, granules=3, concurrency=2, product_size=1024)
+
+    assert [execution['Status'] for execution in executions] == ['SUCCEEDED'] * 3
+    product_name = executions[0]['Output']['ProductName']
+    assert (tmp_path / 's3' / 'local-private' / f'{product_name}.nc').stat().st_size == 1024
+    umm = json.loads((tmp_path / 's3' / 'local-aux' / f'{product_name}.umm.json').read_text())
+    assert umm['GranuleUR'] == product_name
+    assert executions[0]['Output']['CmrResults'].startswith('G')
+
+    responses = [json.loads(line)['Message'] for line in (tmp_path / 'sns' / 'local-responses.jsonl').open()]
+    assert sorted(json.loads(response)['Status'] for response in responses) == ['success'] * 3
+
+    summary = pipeline.summarize(executions, elapsed_in_seconds)
+    assert summary['Succeeded'] == 3
+    assert list(summary['States']) == ['Verify', 'Ingest', 'MetadataConstruction', 'MetadataToCMR', 'Notify',
+                                       'Check_Status', 'Success']
+    assert summary['States']['MetadataToCMR']['Count'] == 3
+
+
+def test_run_pipeline_express(tmp_path, monkeypatch):
+    monkeypatch.setenv('AWS_ACCESS_KEY_ID', 'local')
+    monkeypatch.setenv('AWS_SECRET_ACCESS_KEY', 'local')
+
+    executions, elapsed_in_seconds = pipeline.run_pipeline(tmp_path, granules=2, concurrency=2, product_size=1024,
+                                                           express_pipeline=True)
+
+    assert [execution['Status'] for execution in executions] == ['SUCCEEDED'] * 2
+    output = executions[0]['Output']
+    assert output['ExpressResults']['ConstructionResults']['key'] == f'{output["ProductName"]}.umm.json'
+    assert 'SdsMetadata' not in output['ExpressResults']['IngestResults']
+    assert output['CmrResults'].startswith('G')
+    assert list(pipeline.summarize(executions, elapsed_in_seconds)['States']) == ['Process', 'MetadataToCMR', 'Notify',
+                                                                                  'Check_Status', 'Success']
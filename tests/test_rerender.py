@@ -0,0 +1,128 @@
+import csv
+import gzip
+import json
+import os
+import subprocess
+import sys
+from pathlib import Path
+from urllib.parse import quote_plus
+
+import pytest
+
+import rerender
+
+
+@pytest.fixture
+def local_root(tmp_path, test_data_dir):
+    granules = []
+    for granule in ('granule1', 'granule2'):
+        inputs = json.loads((test_data_dir / granule / 'inputs.json').read_text())
+        name = inputs['Product']['Key'].split('/')[-1][:-len('.nc')]
+        for bucket, key, data in (
+            ('product-bucket', f'{name}.nc', b'product'),
+            ('aux-bucket', f'{name}.json', (test_data_dir / granule / 'sds_metadata.json').read_bytes()),
+            ('browse-bucket', f'{name}.png', b'browse'),
+        ):
+            path = tmp_path / 's3' / bucket / key
+            path.parent.mkdir(parents=True, exist_ok=True)
+            path.write_bytes(data)
+        granules.append(name)
+    return tmp_path / 's3', granules
+
+
+def write_manifest(path, rows):
+    with gzip.open(path, 'wt', newline='') as f:
+        csv.writer(f).writerows(
+            (bucket, quote_plus(key), size, '2024-01-01T00:00:00.000Z') for bucket, key, size in rows
+        )
+
+
+@pytest.fixture
+def manifests(tmp_path, local_root):
+    _, granules = local_root
+    write_manifest(tmp_path / 'product.csv.gz', [('product-bucket', f'{name}.nc', 456) for name in granules])
+    write_manifest(tmp_path / 'aux.csv.gz', [
+        *[('aux-bucket', f'{name}.json', 100) for name in granules],
+        ('aux-bucket', f'{granules[0]}.umm.json', 100),
+    ])
+    write_manifest(tmp_path / 'browse.csv.gz', [('browse-bucket', f'{name}.png', 10) for name in granules])
+    return [str(tmp_path / f'{bucket}.csv.gz') for bucket in ('product', 'aux', 'browse')]
+
+
+def test_get_granules(tmp_path):
+    manifest = tmp_path / 'manifest.csv.gz'
+    write_manifest(manifest, [
+        ('product-bucket', 'a b.nc', 1),
+        ('aux-bucket', 'a b.json', 2),
+        ('aux-bucket', 'a b.umm.json', 3),
+        ('product-bucket', 'c.nc', 4),
+        ('browse-bucket', 'a b.png', 5),
+    ])
+
+    assert list(rerender.get_granules([manifest], 'Bucket, Key, Size, LastModifiedDate')) == [
+        {
+            'Product': {'Bucket': 'product-bucket', 'Key': 'a b.nc', 'Size': 1},
+            'Metadata': {'Bucket': 'aux-bucket', 'Key': 'a b.json', 'Size': 2},
+            'Browse': {'Bucket': 'browse-bucket', 'Key': 'a b.png', 'Size': 5},
+        },
+    ]
+
+
+def test_get_granules_per_bucket_manifests(tmp_path):
+    write_manifest(tmp_path / 'product.csv.gz', [('product-bucket', f'{name}.nc', 1) for name in 'cab'])
+    write_manifest(tmp_path / 'aux.csv.gz', [('aux-bucket', f'{name}.json', 2) for name in 'bca'])
+    write_manifest(tmp_path / 'browse.csv.gz', [('browse-bucket', f'{name}.png', 3) for name in 'ab'])
+    manifests = [tmp_path / f'{bucket}.csv.gz' for bucket in ('product', 'aux', 'browse')]
+
+    granules = list(rerender.get_granules(manifests, 'Bucket, Key, Size'))
+    assert [granule['Product']['Key'] for granule in granules] == ['a.nc', 'b.nc']
+    assert granules[1] == {
+        'Product': {'Bucket': 'product-bucket', 'Key': 'b.nc', 'Size': 1},
+        'Metadata': {'Bucket': 'aux-bucket', 'Key': 'b.json', 'Size': 2},
+        'Browse': {'Bucket': 'browse-bucket', 'Key': 'b.png', 'Size': 3},
+    }
+
+
+def test_rerender(tmp_path, test_data_dir, local_root, manifests):
+    root, granules = local_root
+    config = json.loads((test_data_dir / 'granule1' / 'config.json').read_text())
+    config['output_bucket'] = 'output-bucket'
+    checkpoint_file = str(tmp_path / 'checkpoint.json')
+    failures_file = str(tmp_path / 'failures.csv')
+    (root / 'aux-bucket' / f'{granules[1]}.json').write_text('{}')
+
+    checkpoint = rerender.rerender(manifests, config, checkpoint_file, failures_file, str(root), processes=2,
+                                   file_schema='Bucket, Key, Size, LastModifiedDate', chunksize=1,
+                                   checkpoint_every=1)
+
+    assert checkpoint == {'Manifests': manifests, 'Completed': 2, 'Failed': 1}
+    assert json.loads((tmp_path / 'checkpoint.json').read_text()) == checkpoint
+    with open(failures_file) as f:
+        assert list(csv.reader(f)) == [[f'{granules[1]}.nc', "KeyError: 'label'"]]
+
+    umm_json = json.loads((root / 'output-bucket' / f'{granules[0]}.umm.json').read_text())
+    expected = json.loads((test_data_dir / 'granule1' / 'granule.umm.json').read_text())
+    del umm_json['ProviderDates'], expected['ProviderDates']
+    assert umm_json == expected
+
+    (root / 'output-bucket' / f'{granules[0]}.umm.json').unlink()
+    checkpoint = rerender.rerender(manifests, config, checkpoint_file, failures_file, str(root), processes=2,
+                                   file_schema='Bucket, Key, Size, LastModifiedDate')
+
+    assert checkpoint == {'Manifests': manifests, 'Completed': 2, 'Failed': 1}
+    assert not (root / 'output-bucket' / f'{granules[0]}.umm.json').exists()
+
+    with pytest.raises(ValueError, match='other manifests'):
+        rerender.rerender(manifests[::-1], config, checkpoint_file, failures_file, str(root), processes=2,
+                          file_schema='Bucket, Key, Size, LastModifiedDate')
+    with pytest.raises(ValueError, match='other manifests'):
+        rerender.rerender(manifests[:2], config, checkpoint_file, failures_file, str(root), processes=2,
+                          file_schema='Bucket, Key, Size, LastModifiedDate')
+
+
+def test_command_line_from_repository_root():
+    # run as the README does, without the PYTHONPATH the tests are run with
+    env = {key: value for key, value in os.environ.items() if key != 'PYTHONPATH'}
+    result = subprocess.run([sys.executable, 'metadata-construction/src/rerender.py', '--help'],
+                            cwd=Path(__file__).resolve().parent.parent, env=env, capture_output=True, text=True)
+    assert result.returncode == 0, result.stderr
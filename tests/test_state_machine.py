@@ -0,0 +1,132 @@
+import pytest
+
+import state_machine
+from state_machine import StateMachine, TaskFailed
+
+
+class FlakyTask:
+    def __init__(self, errors, result):
+        self.errors = list(errors)
+        self.result = result
+        self.inputs = []
+
+    def __call__(self, task_input, timeout=None):
+        self.inputs.append(task_input)
+        if self.errors:
+            raise TaskFailed(self.errors.pop(0), 'cause')
+        return self.result
+
+
+def get_definition():
+    return {
+        'StartAt': 'First',
+        'States': {
+            'First': {
+                'Type': 'Task',
+                'Resource': 'first',
+                'InputPath': '$.Message',
+                'ResultPath': '$.FirstResults',
+                'Next': 'Second',
+                'Retry': [
+                    {'ErrorEquals': ['INVALID_MESSAGE'], 'MaxAttempts': 0},
+                    {'ErrorEquals': ['States.ALL'], 'IntervalSeconds': 2, 'BackoffRate': 3.0},
+                ],
+                'Catch': [{'ErrorEquals': ['States.ALL'], 'Next': 'Report', 'ResultPath': '$.Error'}],
+            },
+            'Second': {
+                'Type': 'Task',
+                'Resource': 'second',
+                'InputPath': '$.FirstResults',
+                'ResultPath': '$.SecondResults',
+                'Next': 'Report',
+                'Catch': [{'ErrorEquals': ['States.ALL'], 'Next': 'Report', 'ResultPath': '$.Error'}],
+            },
+            'Report': {
+                'Type': 'Pass',
+                'Result': {'Status': 'reported'},
+                'ResultPath': '$.ReportResults',
+                'Next': 'Check_Status',
+            },
+            'Check_Status': {
+                'Type': 'Choice',
+                'Choices': [{'Variable': '$.Error', 'IsPresent': False, 'Next': 'Success'}],
+                'Default': 'Failure',
+            },
+            'Failure': {'Type': 'Fail', 'Error': 'Ingest failed.', 'Cause': 'Ingest failed.'},
+            'Success': {'Type': 'Pass', 'End': True},
+        },
+    }
+
+
+def test_run_retries(mocker):
+    first = FlakyTask(['Throttled', 'Throttled'], {'Name': 'granule'})
+    second = FlakyTask([], 'done')
+    sleep = mocker.MagicMock()
+    machine = StateMachine(get_definition(), {'first': first, 'second': second}, retry_interval_scale=0.5,
+                           sleep=sleep)
+
+    execution = machine.run({'Message': {'Name': 'granule'}})
+
+    assert execution['Status'] == 'SUCCEEDED'
+    assert execution['Output'] == {
+        'Message': {'Name': 'granule'},
+        'FirstResults': {'Name': 'granule'},
+        'SecondResults': 'done',
+        'ReportResults': {'Status': 'reported'},
+    }
+    assert first.inputs == [{'Name': 'granule'}] * 3
+    assert second.inputs == [{'Name': 'granule'}]
+    assert [call.args[0] for call in sleep.call_args_list] == [1.0, 3.0]
+    assert [(record['Name'], record['Attempts'], record['Error']) for record in execution['States']] == [
+        ('First', 3, None), ('Second', 1, None), ('Report', 0, None), ('Check_Status', 0, None), ('Success', 0, None),
+    ]
+
+
+def test_run_catches(mocker):
+    sleep = mocker.MagicMock()
+    machine = StateMachine(get_definition(), {'first': FlakyTask(['INVALID_MESSAGE'], {}), 'second': None},
+                           sleep=sleep)
+
+    execution = machine.run({'Message': {'Name': 'granule'}})
+
+    assert execution['Status'] == 'FAILED'
+    assert execution['Error'] == 'Ingest failed.'
+    assert [(record['Name'], record['Attempts'], record['Error']) for record in execution['States']] == [
+        ('First', 1, 'INVALID_MESSAGE'), ('Report', 0, None), ('Check_Status', 0, None), ('Failure', 0, None),
+    ]
+    sleep.assert_not_called()
+
+
+def test_run_retries_exhausted(mocker):
+    machine = StateMachine(get_definition(), {'first': FlakyTask(['Throttled'] * 4, {}), 'second': None},
+                           sleep=mocker.MagicMock())
+
+    execution = machine.run({'Message': {}})
+
+    assert execution['States'][0]['Attempts'] == 4
+    assert execution['States'][0]['Error'] == 'Throttled'
+    assert execution['Status'] == 'FAILED'
+
+
+def test_run_runtime_error():
+    machine = StateMachine(get_definition(), {'first': FlakyTask([], {}), 'second': None})
+
+    execution = machine.run({})
+
+    assert execution['Status'] == 'FAILED'
+    assert execution['Error'] == state_machine.RUNTIME_ERROR
+    assert [record['Name'] for record in execution['States']] == ['First']
+
+
+def test_paths():
+    data = {'a': {'b': 1}}
+    assert state_machine.get_path(data, '$') is data
+    assert state_machine.get_path(data, '$.a.b') == 1
+    assert state_machine.get_path(data, None) == {}
+    assert state_machine.set_path(data, '$.a.c', 2) == {'a': {'b': 1, 'c': 2}}
+    assert state_machine.set_path(data, '$', 2) == 2
+    assert state_machine.set_path(data, None, 2) is data
+    assert data == {'a': {'b': 1}}
+
+    with pytest.raises(state_machine.ExecutionFailed, match=r'does not contain c$'):
+        state_machine.get_path(data, '$.a.c')
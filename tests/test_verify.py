@@ -1,4 +1,7 @@
+import hashlib
 import io
+import json
+import unittest.mock
 
 import pytest
 from botocore.stub import Stubber
@@ -8,7 +11,7 @@ import verify
 
 @pytest.fixture
 def s3_stubber():
-    with Stubber(verify.s3.meta.client) as stubber:
+    with Stubber(verify.s3) as stubber:
         yield stubber
         stubber.assert_no_pending_responses()
 
@@ -35,8 +38,159 @@ def test_validate_metadata(test_data_dir, mocker, monkeypatch):
 
     sds_metadata_file = test_data_dir / 'granule1' / 'sds_metadata.json'
     mocker.patch('verify.get_file_content_from_s3', return_value=sds_metadata_file.read_text())
-    assert verify.validate_metadata({'Bucket': None, 'Key': None}) is None
+    assert verify.validate_metadata({'Bucket': None, 'Key': None}) == json.loads(sds_metadata_file.read_text())
 
     sds_metadata_file = test_data_dir / 'granule2' / 'sds_metadata.json'
     mocker.patch('verify.get_file_content_from_s3', return_value=sds_metadata_file.read_text())
-    assert verify.validate_metadata({'Bucket': None, 'Key': None}) is None
+    assert verify.validate_metadata({'Bucket': None, 'Key': None}) == json.loads(sds_metadata_file.read_text())
+
+
+def test_validate_message(test_data_dir, monkeypatch):
+    monkeypatch.chdir('verify/src/')
+    message = json.loads((test_data_dir.parent / 'example-message.json').read_text())
+    assert verify.validate_message(message) is None
+
+    with pytest.raises(verify.INVALID_MESSAGE, match=r"^'ProductName' is a required property$"):
+        verify.validate_message({k: v for k, v in message.items() if k != 'ProductName'})
+
+    with pytest.raises(verify.INVALID_MESSAGE, match=r'^Expecting value$'):
+        verify.validate_message({'MessageError': 'Expecting value'})
+
+
+def test_get_validator(monkeypatch, mocker):
+    monkeypatch.chdir('verify/src/')
+    verify.get_validator.cache_clear()
+    mocker.patch('verify.get_json_from_file', wraps=verify.get_json_from_file)
+
+    assert verify.get_validator('metadata_schema.json') is verify.get_validator('metadata_schema.json')
+    verify.get_json_from_file.assert_called_once_with('metadata_schema.json')
+
+
+def test_validate_s3_object(s3_stubber):
+    obj = {'Bucket': 'myBucket', 'Key': 'myKey'}
+    s3_stubber.add_response(method='head_object', expected_params=obj,
+                            service_response={'ContentLength': 123, 'ETag': '"abc"'})
+    assert verify.validate_s3_object(obj) == {'ContentLength': 123, 'ETag': '"abc"'}
+
+    s3_stubber.add_client_error(method='head_object', expected_params=obj, service_error_code='404')
+    with pytest.raises(verify.MISSING_FILE, match=r"^\{'Bucket': 'myBucket', 'Key': 'myKey'\} .*\(404\)"):
+        verify.validate_s3_object(obj)
+
+
+def test_verify(test_data_dir, monkeypatch, mocker):
+    monkeypatch.chdir('verify/src/')
+    message = json.loads((test_data_dir.parent / 'example-message.json').read_text())
+    sds_metadata = (test_data_dir / 'granule1' / 'sds_metadata.json').read_text()
+    mocker.patch('verify.validate_topic')
+    mocker.patch('verify.validate_s3_object', side_effect=lambda obj: {'ContentLength': len(obj['Key'])})
+    mocker.patch('verify.get_file_content_from_s3', return_value=sds_metadata)
+
+    assert verify.verify(message, {}) == {
+        'Objects': {
+            'Metadata': {'ContentLength': len(message['Metadata']['Key'])},
+            'Browse': {'ContentLength': len(message['Browse']['Key'])},
+            'Product': {'ContentLength': len(message['Product']['Key'])},
+        },
+    }
+    verify.validate_topic.assert_called_once_with(message['ResponseTopic'], {})
+
+
+def test_verify_aggregates_errors(test_data_dir, monkeypatch, mocker):
+    monkeypatch.chdir('verify/src/')
+    message = json.loads((test_data_dir.parent / 'example-message.json').read_text())
+
+    def validate_s3_object(obj):
+        if obj['Key'].endswith('.json'):
+            return {'ContentLength': 1}
+        raise verify.MISSING_FILE(obj['Key'])
+
+    mocker.patch('verify.validate_topic', side_effect=verify.INVALID_TOPIC('bad topic'))
+    mocker.patch('verify.validate_s3_object', side_effect=validate_s3_object)
+    mocker.patch('verify.get_file_content_from_s3', return_value='{"foo": "bar"}')
+
+    with pytest.raises(verify.INVALID_TOPIC) as e:
+        verify.verify(message, {})
+    assert str(e.value) == (
+        'bad topic; '
+        f'{message["Browse"]["Key"]}; '
+        f'{message["Product"]["Key"]}; '
+        "'label' is a required property"
+    )
+
+
+def test_verify_missing_metadata(test_data_dir, monkeypatch, mocker):
+    monkeypatch.chdir('verify/src/')
+    message = json.loads((test_data_dir.parent / 'example-message.json').read_text())
+    del message['ResponseTopic']
+
+    def validate_s3_object(obj):
+        if obj['Key'].endswith('.json'):
+            raise verify.MISSING_FILE(obj['Key'])
+        return {'ContentLength': 1}
+
+    mocker.patch('verify.validate_s3_object', side_effect=validate_s3_object)
+    mocker.patch('verify.get_file_content_from_s3', side_effect=Exception('NoSuchKey'))
+
+    with pytest.raises(verify.MISSING_FILE, match=rf'^{message["Metadata"]["Key"]}$'):
+        verify.verify(message, {})
+
+
+def test_forward_metadata(test_data_dir, s3_stubber):
+    metadata = json.loads((test_data_dir / 'granule1' / 'sds_metadata.json').read_text())
+    digest = verify.get_metadata_digest(metadata)
+    assert digest['label'] == metadata['label']
+    assert digest['location'] == metadata['location']
+    assert 'version' not in digest
+    assert digest['metadata']['sensing_start'] == metadata['metadata']['sensing_start']
+    assert 'weather_model' not in digest['metadata']
+
+    assert verify.forward_metadata(metadata, {}) == {}
+    assert verify.forward_metadata(metadata, {'max_inline_metadata_bytes': 32768}) == {'SdsMetadata': digest}
+
+    content = json.dumps(digest, separators=(',', ':'), sort_keys=True)
+    key = 'digests/' + hashlib.sha256(content.encode()).hexdigest() + '.json'
+    s3_stubber.add_response(
+        method='put_object',
+        expected_params={'Bucket': 'auxBucket', 'Key': key, 'Body': content, 'ContentType': 'application/json'},
+        service_response={},
+    )
+    config = {
+        'max_inline_metadata_bytes': 100,
+        'metadata_digest_bucket': 'auxBucket',
+        'metadata_digest_prefix': 'digests/',
+    }
+    assert verify.forward_metadata(metadata, config) == {'SdsMetadataLocation': {'Bucket': 'auxBucket', 'Key': key}}
+
+
+def test_validate_topic(monkeypatch):
+    clock = unittest.mock.MagicMock(return_value=0)
+    monkeypatch.setattr(verify, 'TOPIC_CACHE', verify.TopicCache(clock))
+    config = {'topic_cache_ttl_in_seconds': 3600, 'invalid_topic_cache_ttl_in_seconds': 300}
+    topic = {'Region': 'us-west-2', 'Arn': 'arn:aws:sns:us-west-2:123456789012:myTopic'}
+    bad_topic = {'Region': 'us-west-2', 'Arn': 'arn:aws:sns:us-west-2:123456789012:badTopic'}
+    expected_params = {'Message': 'invalidMessage', 'MessageStructure': 'json'}
+    json_error = 'Invalid parameter: Message Structure - JSON message body failed to parse'
+
+    with Stubber(verify.get_sns_client('us-west-2')) as stubber:
+        stubber.add_client_error('publish', service_error_code='InvalidParameter', service_message=json_error,
+                                 expected_params={'TopicArn': topic['Arn'], **expected_params})
+        verify.validate_topic(topic, config)
+        verify.validate_topic(topic, config)
+
+        stubber.add_client_error('publish', service_error_code='Throttling',
+                                 expected_params={'TopicArn': bad_topic['Arn'], **expected_params})
+        stubber.add_client_error('publish', service_error_code='NotFound', service_message='Topic does not exist',
+                                 expected_params={'TopicArn': bad_topic['Arn'], **expected_params})
+        with pytest.raises(verify.INVALID_TOPIC, match='Throttling'):
+            verify.validate_topic(bad_topic, config)
+        for _ in range(2):
+            with pytest.raises(verify.INVALID_TOPIC, match='Topic does not exist'):
+                verify.validate_topic(bad_topic, config)
+        stubber.assert_no_pending_responses()
+
+        clock.return_value = 300
+        stubber.add_client_error('publish', service_error_code='NotFound', service_message='Topic does not exist',
+                                 expected_params={'TopicArn': bad_topic['Arn'], **expected_params})
+        with pytest.raises(verify.INVALID_TOPIC, match='Topic does not exist'):
+            verify.validate_topic(bad_topic, config)
+        verify.validate_topic(topic, config)
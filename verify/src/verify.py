@@ -1,14 +1,31 @@
+import hashlib
 import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 from logging import getLogger
 
-import boto3
 import botocore
 import jsonschema
 
+import instrumentation
+from aws_clients import LazyClient, get_client
+
 
 log = getLogger()
 log.setLevel('INFO')
-s3 = boto3.resource('s3')
+CONFIG = json.loads(os.getenv('CONFIG'))
+s3 = LazyClient('s3')
+
+# the SDS metadata fields render_granule_metadata in metadata-construction reads
+DIGEST_FIELDS = ['label', 'location', 'creation_timestamp']
+DIGEST_METADATA_FIELDS = [
+    'sensing_start', 'sensing_stop', 'platform', 'orbit_number', 'reference_scenes', 'secondary_scenes',
+    'orbit_direction', 'beam_mode', 'polarization', 'perpendicular_baseline', 'version', 'frame_number',
+    'track_number', 'temporal_baseline_days', 'weather_model',
+]
 
 
 class INVALID_MESSAGE(Exception):
@@ -27,9 +44,40 @@ class INVALID_TOPIC(Exception):
     pass
 
 
+# errors that mean the topic itself is wrong, as opposed to throttling or an SNS outage
+INVALID_TOPIC_ERROR_CODES = ['AuthorizationError', 'InvalidParameter', 'NotFound']
+
+
+class TopicCache:
+    """Results of response topic validation, held for the life of a warm Lambda container.
+
+    Valid topics are remembered for `topic_cache_ttl_in_seconds` and topics rejected by SNS for
+    `invalid_topic_cache_ttl_in_seconds`, so repeat submitters are not checked on every execution while a topic that
+    is fixed, or removed, is noticed soon after.
+    """
+    def __init__(self, clock=time.monotonic):
+        self._lock = threading.Lock()
+        self._clock = clock
+        self.topics = {}
+
+    def get(self, arn):
+        """Return `(True, error)` for a cached result, where error is None for a valid topic, or `(False, None)`."""
+        with self._lock:
+            expires_at, error = self.topics.get(arn, (None, None))
+            if expires_at is None or expires_at <= self._clock():
+                return False, None
+            return True, error
+
+    def put(self, arn, error, ttl_in_seconds):
+        with self._lock:
+            self.topics[arn] = (self._clock() + ttl_in_seconds, error)
+
+
+TOPIC_CACHE = TopicCache()
+
+
 def get_file_content_from_s3(bucket, key):
-    obj = s3.Object(bucket, key)
-    response = obj.get()
+    response = s3.get_object(Bucket=bucket, Key=key)
     contents = response['Body'].read()
     return contents
 
@@ -40,38 +88,88 @@ def get_json_from_file(filename):
     return json.loads(content)
 
 
+@lru_cache
+def get_validator(schema_file):
+    schema = get_json_from_file(schema_file)
+    validator_class = jsonschema.validators.validator_for(schema)
+    validator_class.check_schema(schema)
+    return validator_class(schema)
+
+
+def validate_json(instance, schema_file):
+    # same error selection as jsonschema.validate, without re-reading and re-checking the schema on every call
+    error = jsonschema.exceptions.best_match(get_validator(schema_file).iter_errors(instance))
+    if error is not None:
+        raise error
+
+
 def validate_s3_object(obj):
     try:
-        s3.Object(obj['Bucket'], obj['Key']).load()
+        response = s3.head_object(Bucket=obj['Bucket'], Key=obj['Key'])
     except botocore.exceptions.ClientError as e:
         if e.response['Error']['Code'] in ['403', '404']:
             raise MISSING_FILE(str(obj) + ' ' + str(e))
         raise
+    return {'ContentLength': response['ContentLength'], 'ETag': response['ETag']}
 
 
 def validate_message(message):
     if 'MessageError' in message:
         raise INVALID_MESSAGE(message['MessageError'])
-    message_schema = get_json_from_file('message_schema.json')
     try:
-        jsonschema.validate(message, message_schema)
+        validate_json(message, 'message_schema.json')
     except jsonschema.exceptions.ValidationError as e:
         raise INVALID_MESSAGE(e.message)
 
 
 def validate_metadata(obj):
     metadata = get_file_content_from_s3(obj['Bucket'], obj['Key'])
-    metadata_schema = get_json_from_file('metadata_schema.json')
+    return validate_metadata_content(metadata)
+
 
+def validate_metadata_content(metadata):
     try:
         metadata = json.loads(metadata)
     except json.decoder.JSONDecodeError as e:
         raise INVALID_METADATA(str(e))
 
     try:
-        jsonschema.validate(metadata, metadata_schema)
+        validate_json(metadata, 'metadata_schema.json')
     except jsonschema.exceptions.ValidationError as e:
         raise INVALID_METADATA(e.message)
+    return metadata
+
+
+def get_metadata_digest(metadata):
+    digest = {field: metadata[field] for field in DIGEST_FIELDS}
+    digest['metadata'] = {
+        field: metadata['metadata'][field] for field in DIGEST_METADATA_FIELDS if field in metadata['metadata']
+    }
+    return digest
+
+
+def put_metadata_digest(content, bucket, prefix):
+    # content-addressed, so retried executions and re-submissions of the same granule share one object
+    key = prefix + hashlib.sha256(content.encode()).hexdigest() + '.json'
+    s3.put_object(Bucket=bucket, Key=key, Body=content, ContentType='application/json')
+    return {'Bucket': bucket, 'Key': key}
+
+
+def forward_metadata(metadata, config):
+    """Return the step function state that hands the verified SDS metadata on to metadata construction.
+
+    The digest is passed inline when it fits under the configured size, otherwise it is written to S3 and a reference
+    to it is passed instead. Nothing is forwarded if no bucket is configured for large digests; metadata construction
+    then reads the ingested metadata file itself.
+    """
+    content = json.dumps(get_metadata_digest(metadata), separators=(',', ':'), sort_keys=True)
+    if len(content.encode()) <= config.get('max_inline_metadata_bytes', 0):
+        return {'SdsMetadata': json.loads(content)}
+    if 'metadata_digest_bucket' in config:
+        location = put_metadata_digest(content, config['metadata_digest_bucket'],
+                                       config.get('metadata_digest_prefix', ''))
+        return {'SdsMetadataLocation': location}
+    return {}
 
 
 def json_error(error):
@@ -82,27 +180,86 @@ def json_error(error):
     return error['Code'] == 'InvalidParameter' and error['Message'] in json_messages
 
 
-def validate_topic(topic):
-    sns = boto3.client('sns', region_name=topic['Region'])
+def get_sns_client(region):
+    return get_client('sns', region_name=region)
+
+
+def publish_invalid_message(topic):
+    sns = get_sns_client(topic['Region'])
     try:
         sns.publish(TopicArn=topic['Arn'], Message='invalidMessage', MessageStructure='json')
     except botocore.exceptions.ClientError as e:
         if not json_error(e.response['Error']):
-            raise INVALID_TOPIC(str(e))
+            raise INVALID_TOPIC(str(e)) from e
 
 
-def verify(message):
-    validate_message(message)
+def validate_topic(topic, config):
+    cached, error = TOPIC_CACHE.get(topic['Arn'])
+    if cached:
+        if error:
+            raise INVALID_TOPIC(error)
+        return
 
-    if 'ResponseTopic' in message:
-        validate_topic(message['ResponseTopic'])
+    try:
+        publish_invalid_message(topic)
+    except INVALID_TOPIC as e:
+        if e.__cause__.response['Error']['Code'] in INVALID_TOPIC_ERROR_CODES:
+            TOPIC_CACHE.put(topic['Arn'], str(e), config.get('invalid_topic_cache_ttl_in_seconds', 0))
+        raise
+    TOPIC_CACHE.put(topic['Arn'], None, config.get('topic_cache_ttl_in_seconds', 0))
 
-    validate_s3_object(message['Metadata'])
-    validate_s3_object(message['Browse'])
-    validate_s3_object(message['Product'])
 
-    validate_metadata(message['Metadata'])
+def aggregate_errors(errors):
+    """Combine verification failures into one exception.
 
+    The exception has the type of the first failure, in the order the checks used to run one after another, so the
+    error code reported to the submitter is unchanged while the message lists every problem.
+    """
+    if len(errors) == 1:
+        return errors[0]
+    return type(errors[0])('; '.join(str(error) for error in errors))
+
+
+def verify(message, config):
+    validate_message(message)
 
+    object_names = ['Metadata', 'Browse', 'Product']
+    with ThreadPoolExecutor(max_workers=len(object_names) + 2) as executor:
+        topic_future = None
+        if 'ResponseTopic' in message:
+            topic_future = executor.submit(validate_topic, message['ResponseTopic'], config)
+        object_futures = {name: executor.submit(validate_s3_object, message[name]) for name in object_names}
+        metadata_future = executor.submit(get_file_content_from_s3, message['Metadata']['Bucket'],
+                                          message['Metadata']['Key'])
+
+    errors = []
+    if topic_future is not None:
+        try:
+            topic_future.result()
+        except INVALID_TOPIC as e:
+            errors.append(e)
+
+    objects = {}
+    for name, future in object_futures.items():
+        try:
+            objects[name] = future.result()
+        except MISSING_FILE as e:
+            errors.append(e)
+
+    # the metadata can only be validated if it exists; otherwise its MISSING_FILE error was recorded above
+    metadata = None
+    if 'Metadata' in objects:
+        try:
+            metadata = validate_metadata_content(metadata_future.result())
+        except INVALID_METADATA as e:
+            errors.append(e)
+
+    if errors:
+        raise aggregate_errors(errors)
+
+    return {'Objects': objects, **forward_metadata(metadata, config)}
+
+
+@instrumentation.handler
 def lambda_handler(event, context):
-    verify(event)
+    return verify(event, CONFIG)